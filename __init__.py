@@ -1,25 +1,111 @@
-from flask import Flask
+import logging
+import os
+
+from flask import Flask, jsonify
 from flask_login import LoginManager
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy.exc import SQLAlchemyError
+
+from .api.cache import user_cache
+from .api.feed import feed
+from .api.hashing import HashingBusyError, password_hasher
+from .api.ingest import post_writer
+from .api.instrumentation import instrumentation
+from .api.jobs import job_queue
+from .api.models import db
+from .api.purge import user_purger
+from .api.ratelimit import RateLimitExceeded, limiter, retry_after
+from .api.replica import replica
+from .frontend.cache import page_cache
 
-from .api.models import db, User
-from .api.routes import api
-from .frontend.routes import frontend
+logger = logging.getLogger(__name__)
 
 
-def create_app():
+def create_app(config=None):
     app = Flask("__name__")
-    app.register_blueprint(api)
-    app.register_blueprint(frontend)
     app.config["SECRET_KEY"] = "GHRAGSNJBNBFUREVH863"
     app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///pythonsqlite.db"
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    if config:
+        app.config.update(config)
+
+    instrumentation.init_app(app)
+    # blueprints import views and their dependencies only when app is made
+    from .api.routes import api
+    from .frontend.routes import frontend
+
+    app.register_blueprint(api)
+    app.register_blueprint(frontend)
+    if app.config.get("TEMPLATE_CACHE_DIR"):
+        # compiled templates are reused by other workers and restarts
+        os.makedirs(app.config["TEMPLATE_CACHE_DIR"], exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(
+            app.config["TEMPLATE_CACHE_DIR"]
+        )
     db.init_app(app)
+    post_writer.init_app(app)
+    job_queue.init_app(app)
+    replica.init_app(app)
+    user_purger.init_app(app)
+    feed.init_app(app)
+    user_cache.init_app(app)
+    password_hasher.init_app(app)
+    limiter.init_app(app)
+    page_cache.init_app(app)
+    instrumentation.collector(app, "redditlo_post_writer", post_writer.metrics)
+    instrumentation.collector(app, "redditlo_user_cache", user_cache.metrics)
+    instrumentation.collector(app, "redditlo_user_purger", user_purger.metrics)
+    instrumentation.collector(app, "redditlo_jobs", job_queue.metrics)
+    instrumentation.collector(app, "redditlo_replica", replica.metrics)
+    instrumentation.collector(app, "redditlo_rate_limiter", limiter.metrics)
+    instrumentation.collector(app, "redditlo_page_cache", page_cache.metrics)
     login_manager = LoginManager()
     login_manager.init_app(app)
     login_manager.login_view = "frontend.login"
 
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
+        return user_cache.get_by_id(int(user_id))
+
+    @app.errorhandler(HashingBusyError)
+    def handle_hashing_busy(e):
+        response = jsonify({"status": "error", "message": str(e)})
+        response.headers["Retry-After"] = "1"
+        return response, 503
 
+    @app.errorhandler(RateLimitExceeded)
+    def handle_rate_limited(e):
+        response = jsonify({"status": "error", "message": str(e)})
+        response.headers["Retry-After"] = retry_after(e)
+        return response, 429
+
+    if app.config.get("WARM_UP"):
+        warm_up(app)
     return app
+
+
+def warm_up(app):
+    """Do work of first requests at startup
+
+    Imports modules views load lazily, compiles every template, opens DB
+    pool connections and loads feed, so first requests of new worker are
+    as fast as later ones.
+    """
+    from .frontend import forms  # noqa: F401
+
+    with app.app_context():
+        for name in app.jinja_env.list_templates():
+            app.jinja_env.get_template(name)
+        try:
+            for engine in (db.engine, db.get_read_engine(app)):
+                if engine is None:
+                    continue
+                size = getattr(engine.pool, "size", lambda: 1)()
+                connections = [engine.connect() for _ in range(size)]
+                for connection in connections:
+                    connection.close()
+            feed.rebuild()
+        except SQLAlchemyError as e:
+            logger.warning("Skipping DB warm up: %s", e)
+        finally:
+            db.session.remove()
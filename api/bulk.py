@@ -0,0 +1,124 @@
+import csv
+import json
+from itertools import islice
+
+from sqlalchemy.exc import IntegrityError
+
+from .hashing import HashingBusyError, password_hasher
+from .models import User, db
+
+# 2 bound parameters per row in uniqueness query, stays under SQLite limit of 999
+IMPORT_CHUNK_SIZE = 400
+
+
+def read_records(lines, fmt):
+    """Yield user dicts from iterable of byte or str lines in csv or ndjson format"""
+    lines = (
+        line.decode("utf-8") if isinstance(line, bytes) else line for line in lines
+    )
+    if fmt == "csv":
+        yield from csv.DictReader(lines)
+    elif fmt == "ndjson":
+        for line in lines:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # reported as invalid row instead of aborting whole import
+                    yield None
+    else:
+        raise ValueError("Unsupported format: " + fmt)
+
+
+def _import_chunk(chunk, start):
+    """Validate, hash and insert one chunk of records in single transaction"""
+    results = {}
+    valid = []
+    for row, record in enumerate(chunk, start):
+        if not isinstance(record, dict):
+            chunk[row - start] = record = {}
+        fields = [record.get(field) for field in ("username", "email", "password")]
+        if not all(fields):
+            results[row] = "Missing data"
+        elif not all(isinstance(field, str) for field in fields):
+            results[row] = "Invalid data"
+        else:
+            valid.append((row, record))
+
+    taken_usernames = set()
+    taken_emails = set()
+    if valid:
+        # one query for the whole chunk instead of two per user
+        usernames = {record["username"] for _, record in valid}
+        emails = {record["email"] for _, record in valid}
+        taken = db.session.query(User.username, User.email).filter(
+            db.or_(User.username.in_(usernames), User.email.in_(emails))
+        )
+        for username, email in taken:
+            taken_usernames.add(username)
+            taken_emails.add(email)
+
+    to_insert = []
+    for row, record in valid:
+        # duplicates inside the chunk are caught by adding to taken sets
+        if record["username"] in taken_usernames:
+            results[row] = "User with that username already exists"
+        elif record["email"] in taken_emails:
+            results[row] = "User with that email already exists"
+        else:
+            taken_usernames.add(record["username"])
+            taken_emails.add(record["email"])
+            to_insert.append((row, record))
+
+    try:
+        hashes = password_hasher.hash_many(
+            [record["password"] for _, record in to_insert]
+        )
+    except HashingBusyError as e:
+        for row, _ in to_insert:
+            results[row] = str(e)
+        to_insert = hashes = []
+    rows = [
+        {"username": record["username"], "email": record["email"], "password": hashed}
+        for (_, record), hashed in zip(to_insert, hashes)
+    ]
+    if rows:
+        try:
+            db.session.execute(User.__table__.insert(), rows)
+            db.session.commit()
+        except IntegrityError:
+            # another writer added conflicting user in the meantime
+            db.session.rollback()
+            for row, _ in to_insert:
+                results[row] = "User with that username or email already exists"
+            to_insert = []
+
+    for row, _ in to_insert:
+        results[row] = None
+    return (
+        _result(row, record, results[row]) for row, record in enumerate(chunk, start)
+    )
+
+
+def _result(row, record, error):
+    return {
+        "row": row,
+        "username": record.get("username"),
+        "status": "error" if error else "success",
+        "message": error or "User added successfully",
+    }
+
+
+def import_users(records, chunk_size=IMPORT_CHUNK_SIZE):
+    """Import users chunk by chunk, yielding result dict for every record
+
+    Passwords are hashed in shared pool of password_hasher.
+    """
+    records = iter(records)
+    start = 1
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            break
+        yield from _import_chunk(chunk, start)
+        start += len(chunk)
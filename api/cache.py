@@ -0,0 +1,251 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy.orm import make_transient_to_detached
+
+from .database import PRIMARY_OPTION
+from .models import User, db
+
+USER_COLUMNS = ("id", "username", "email", "password", "date_created")
+
+
+def private_directory(path):
+    """Create directory only this user can access, or check existing one
+
+    Raises PermissionError for directory of other user or one others can
+    access, they could read password hashes or plant entries.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.stat(path)
+    if info.st_uid != os.getuid():
+        raise PermissionError(f"{path} is owned by another user")
+    if info.st_mode & 0o077:
+        raise PermissionError(f"{path} is accessible by other users")
+    return path
+
+
+class LRUCache:
+    """Thread safe in-process LRU cache with per entry time to live"""
+
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + (ttl or self.ttl))
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class RedisCache:
+    """Cache stored in Redis compatible server, shared by all workers"""
+
+    def __init__(self, url, ttl=300, prefix="redditlo:"):
+        # optional dependency, only needed when USER_CACHE_URL is set
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return None if value is None else json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, json.dumps(value), ex=ttl or self.ttl)
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*(self.prefix + key for key in keys))
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + "*"):
+            self.client.delete(key)
+
+
+class FileCache:
+    """Cache stored as JSON files in local directory, shared by local workers"""
+
+    def __init__(self, directory, ttl=300):
+        self.directory = directory
+        self.ttl = ttl
+        private_directory(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self._path(key)) as file:
+                value, expires = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if expires < time.time():
+            self.delete(key)
+            return None
+        return value
+
+    def set(self, key, value, ttl=None):
+        # write to temporary file and rename, readers never see partial file
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".tmp")
+        with os.fdopen(fd, "w") as file:
+            json.dump([value, time.time() + (ttl or self.ttl)], file)
+        os.replace(tmp, self._path(key))
+
+    def delete(self, *keys):
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def clear(self):
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+
+class _UserCacheState:
+    def __init__(self, app):
+        ttl = app.config.get("USER_CACHE_TTL", 300)
+        url = app.config.get("USER_CACHE_URL")
+        directory = app.config.get("USER_CACHE_DIR")
+        if url:
+            self.backend = RedisCache(url, ttl=ttl)
+        elif directory:
+            self.backend = FileCache(directory, ttl)
+        else:
+            self.backend = LRUCache(app.config.get("USER_CACHE_SIZE", 10000), ttl)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def count(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+
+def _to_cache(user):
+    data = {column: getattr(user, column) for column in USER_COLUMNS}
+    if data["date_created"]:
+        data["date_created"] = data["date_created"].isoformat()
+    return data
+
+
+def _from_cache(data):
+    """Attach cached user to current session without querying DB"""
+    data = dict(data)
+    if data["date_created"]:
+        data["date_created"] = datetime.fromisoformat(data["date_created"])
+    user = User(**data)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+class UserCache:
+    """Read-through cache of users keyed by id and by username
+
+    Uses in-process LRU with USER_CACHE_SIZE entries, Redis compatible
+    server at USER_CACHE_URL or files in USER_CACHE_DIR when set. Entries
+    live USER_CACHE_TTL seconds and must be invalidated when user is changed
+    or deleted, so processes sharing database must share cache too. Misses
+    are loaded from primary, stale replica could bring back deleted users.
+    """
+
+    def init_app(self, app):
+        app.extensions["user_cache"] = _UserCacheState(app)
+
+    @property
+    def _state(self):
+        return current_app.extensions["user_cache"]
+
+    def _get(self, key, load):
+        state = self._state
+        data = state.backend.get(key)
+        state.count(data is not None)
+        if data is not None:
+            return _from_cache(data)
+
+        user = load()
+        if user:
+            data = _to_cache(user)
+            state.backend.set("user:id:%d" % user.id, data)
+            state.backend.set("user:name:" + user.username, data)
+        return user
+
+    def get_by_id(self, user_id):
+        return self._get(
+            "user:id:%d" % user_id,
+            lambda: db.session.get(
+                User, user_id, execution_options={PRIMARY_OPTION: True}
+            ),
+        )
+
+    def get_by_username(self, username):
+        return self._get(
+            "user:name:" + username,
+            lambda: User.query.filter_by(username=username)
+            .execution_options(**{PRIMARY_OPTION: True})
+            .first(),
+        )
+
+    def invalidate(self, user_id=None, username=None):
+        keys = []
+        if user_id is not None:
+            keys.append("user:id:%d" % user_id)
+        if username is not None:
+            keys.append("user:name:" + username)
+        self._state.backend.delete(*keys)
+
+    def clear(self):
+        self._state.backend.clear()
+
+    def metrics(self):
+        state = self._state
+        with state.lock:
+            return {"hits": state.hits, "misses": state.misses}
+
+
+user_cache = UserCache()
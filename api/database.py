@@ -0,0 +1,285 @@
+import os
+import sqlite3
+import time
+
+from flask import has_request_context, request, session
+from flask_sqlalchemy import SignallingSession
+from flask_sqlalchemy import SQLAlchemy as _SQLAlchemy
+from sqlalchemy import event, exc, orm
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+# pragmas set on every new SQLite connection, selected with SQLITE_PROFILE
+SQLITE_PROFILES = {
+    "production": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "cache_size": -64000,
+        "mmap_size": 268435456,
+        "temp_store": "MEMORY",
+    },
+    "default": {},
+}
+
+# SQLite leaves foreign keys off, so ON DELETE CASCADE needs them in every profile
+SQLITE_REQUIRED_PRAGMAS = {"foreign_keys": "ON"}
+
+# methods that never write, their queries can go to read-only pool
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# key of replica database in SQLALCHEMY_BINDS
+REPLICA_BIND = "replica"
+# Flask session key with time of last write of that client
+LAST_WRITE_KEY = "_last_write"
+# execution option of queries that must read primary, e.g. to fill caches
+PRIMARY_OPTION = "use_primary"
+
+
+def is_file_sqlite(sa_url):
+    return sa_url.drivername.startswith("sqlite") and sa_url.database not in (
+        None,
+        "",
+        ":memory:",
+    )
+
+
+def pragma_listener(pragmas):
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    return on_connect
+
+
+def snapshot_id(path):
+    """Return what tells apart snapshot files renamed over each other"""
+    try:
+        info = os.stat(path)
+    except OSError:
+        return None
+    return info.st_ino, info.st_mtime_ns
+
+
+class SnapshotConnection(sqlite3.Connection):
+    """Read-only connection to snapshot, knows which file it opened"""
+
+    path = None
+    snapshot = None
+
+
+def snapshot_creator(path):
+    """Return creator of connections stamped with snapshot they open
+
+    File is checked before it is opened, when it is replaced in between
+    connection has old stamp and is only dropped on next checkout.
+    """
+
+    def connect():
+        snapshot = snapshot_id(path)
+        connection = sqlite3.connect(
+            f"file:{path}?mode=ro",
+            uri=True,
+            check_same_thread=False,
+            factory=SnapshotConnection,
+        )
+        connection.path, connection.snapshot = path, snapshot
+        return connection
+
+    return connect
+
+
+def drop_stale_snapshots(dbapi_connection, connection_record, connection_proxy):
+    """Pool checkout listener dropping connections to replaced snapshot
+
+    Any worker can replace snapshot file, pooled connections of the others
+    still read old one, so reads would be older than replica_synced_at.
+    """
+    if dbapi_connection.snapshot != snapshot_id(dbapi_connection.path):
+        # pool closes connection and opens new one
+        raise exc.DisconnectionError("Snapshot was replaced")
+
+
+class RoutingSession(SignallingSession):
+    """Session that sends reads of GET requests to replica or read-only pool
+
+    Once session flushed anything in current transaction all further
+    queries go to the writer, so request can read its own writes. With
+    READ_YOUR_WRITES, commits of request remember time of write in Flask
+    session and later requests of that client read from replica only when
+    it was synced after that write.
+    """
+
+    def __init__(self, db, **options):
+        super().__init__(db, **options)
+        self.db = db
+        self._wrote = False
+        event.listen(self, "after_flush", self._mark_wrote)
+        event.listen(self, "after_commit", self._record_write)
+        event.listen(self, "after_rollback", self._reset_wrote)
+
+    def _mark_wrote(self, session, flush_context):
+        self._wrote = True
+
+    def _reset_wrote(self, session):
+        self._wrote = False
+
+    def _record_write(self, db_session):
+        if (
+            self._wrote
+            and has_request_context()
+            and self.app.config["READ_YOUR_WRITES"]
+            and self.db.get_replica_engine(self.app) is not None
+        ):
+            session[LAST_WRITE_KEY] = time.time()
+        self._wrote = False
+
+    def _replica_engine(self):
+        engine = self.db.get_replica_engine(self.app)
+        if engine is None:
+            return None
+        synced_at = self.db.replica_synced_at(self.app)
+        if synced_at is None:
+            return None
+        if self.app.config["READ_YOUR_WRITES"]:
+            last_write = session.get(LAST_WRITE_KEY)
+            if last_write is not None and last_write > synced_at:
+                return None
+        return engine
+
+    def get_bind(self, mapper=None, clause=None):
+        if getattr(clause, "is_dml", False):
+            # writes run with session.execute don't flush
+            self._wrote = True
+        options = clause.get_execution_options() if clause is not None else {}
+        if (
+            not self._wrote
+            and not options.get(PRIMARY_OPTION)
+            and not self._flushing
+            and has_request_context()
+            and request.method in READ_METHODS
+        ):
+            read_engine = self._replica_engine() or self.db.get_read_engine(self.app)
+            if read_engine is not None:
+                # models with own bind_key keep default routing
+                table = getattr(mapper, "persist_selectable", None)
+                if table is None or table.info.get("bind_key") is None:
+                    return read_engine
+        return super().get_bind(mapper, clause)
+
+
+class SQLAlchemy(_SQLAlchemy):
+    """Flask-SQLAlchemy tuned for SQLite
+
+    File databases get pooled connections with pragmas from SQLITE_PROFILE
+    (updated with SQLITE_PRAGMAS). When journal mode is WAL, reads of GET
+    requests use separate query_only pool, so they never wait on the writer.
+
+    With "replica" in SQLALCHEMY_BINDS reads of GET requests go to that
+    database instead. It is replica lagging at most REPLICA_MAX_LAG seconds,
+    or with SNAPSHOT_INTERVAL set, SQLite file with snapshot of primary
+    refreshed by api.replica.
+    """
+
+    def init_app(self, app):
+        app.config.setdefault("SQLITE_PROFILE", "production")
+        app.config.setdefault("SQLITE_PRAGMAS", {})
+        app.config.setdefault("SQLITE_POOL_SIZE", 5)
+        app.config.setdefault("SQLITE_MAX_OVERFLOW", 10)
+        app.config.setdefault("SQLITE_READ_POOL", True)
+        app.config.setdefault("SQLITE_READ_POOL_SIZE", 10)
+        app.config.setdefault("READ_YOUR_WRITES", True)
+        app.config.setdefault("REPLICA_MAX_LAG", 1.0)
+        app.config.setdefault("SNAPSHOT_INTERVAL", None)
+        app.extensions["sqlite_read_engines"] = {}
+        app.extensions["sqlite_replica_engines"] = {}
+        super().init_app(app)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def sqlite_pragmas(self, app):
+        pragmas = dict(SQLITE_REQUIRED_PRAGMAS)
+        pragmas.update(SQLITE_PROFILES[app.config["SQLITE_PROFILE"]])
+        pragmas.update(app.config["SQLITE_PRAGMAS"])
+        return pragmas
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        sa_url, options = super().apply_driver_hacks(app, sa_url, options)
+        if is_file_sqlite(sa_url):
+            # replace NullPool with pool of connections kept open per worker
+            options["poolclass"] = QueuePool
+            options["pool_size"] = app.config["SQLITE_POOL_SIZE"]
+            options["max_overflow"] = app.config["SQLITE_MAX_OVERFLOW"]
+            options.setdefault("connect_args", {})["check_same_thread"] = False
+        if sa_url.drivername.startswith("sqlite"):
+            options["_pragmas"] = self.sqlite_pragmas(app)
+        return sa_url, options
+
+    def create_engine(self, sa_url, engine_opts):
+        pragmas = engine_opts.pop("_pragmas", None)
+        engine = super().create_engine(sa_url, engine_opts)
+        if pragmas:
+            event.listen(engine, "connect", pragma_listener(pragmas))
+        return engine
+
+    def get_read_engine(self, app=None):
+        """Return query_only engine for current DB or None if reads can't be split"""
+        app = self.get_app(app)
+        if not app.config["SQLITE_READ_POOL"]:
+            return None
+        pragmas = self.sqlite_pragmas(app)
+        if str(pragmas.get("journal_mode", "")).upper() != "WAL":
+            return None
+
+        uri = app.config["SQLALCHEMY_DATABASE_URI"]
+        engines = app.extensions["sqlite_read_engines"]
+        with self._engine_lock:
+            if uri not in engines:
+                sa_url = make_url(uri)
+                if not is_file_sqlite(sa_url):
+                    engines[uri] = None
+                else:
+                    sa_url, options = self.apply_driver_hacks(app, sa_url, {})
+                    options["pool_size"] = app.config["SQLITE_READ_POOL_SIZE"]
+                    options["_pragmas"] = dict(options["_pragmas"], query_only="ON")
+                    options.update(app.config["SQLALCHEMY_ENGINE_OPTIONS"])
+                    engines[uri] = self.create_engine(sa_url, options)
+            return engines[uri]
+
+    def get_replica_engine(self, app=None):
+        """Return query_only engine of replica bind or None if there is none"""
+        app = self.get_app(app)
+        uri = (app.config["SQLALCHEMY_BINDS"] or {}).get(REPLICA_BIND)
+        if uri is None:
+            return None
+
+        engines = app.extensions["sqlite_replica_engines"]
+        with self._engine_lock:
+            if uri not in engines:
+                sa_url, options = self.apply_driver_hacks(app, make_url(uri), {})
+                options["pool_size"] = app.config["SQLITE_READ_POOL_SIZE"]
+                options.update(app.config["SQLALCHEMY_ENGINE_OPTIONS"])
+                if is_file_sqlite(sa_url):
+                    # replica is only read, journal and cache pragmas are the
+                    # primary's business
+                    options["_pragmas"] = dict(SQLITE_REQUIRED_PRAGMAS, query_only="ON")
+                if app.config["SNAPSHOT_INTERVAL"]:
+                    options["creator"] = snapshot_creator(sa_url.database)
+                engines[uri] = self.create_engine(sa_url, options)
+                if app.config["SNAPSHOT_INTERVAL"]:
+                    event.listen(engines[uri], "checkout", drop_stale_snapshots)
+            return engines[uri]
+
+    def replica_synced_at(self, app=None):
+        """Return unix time replica has all writes up to, None if it is missing"""
+        app = self.get_app(app)
+        if not app.config["SNAPSHOT_INTERVAL"]:
+            return time.time() - app.config["REPLICA_MAX_LAG"]
+        path = make_url(app.config["SQLALCHEMY_BINDS"][REPLICA_BIND]).database
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return None
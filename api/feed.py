@@ -0,0 +1,198 @@
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+from .models import Post, db
+from .queries import posts_by_ids
+
+
+class RingBuffer:
+    """Fixed size buffer of ascending post ids, oldest id is dropped when full"""
+
+    def __init__(self, size):
+        self.size = size
+        self._items = [0] * size
+        self._start = 0
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, index):
+        """Return id at index, 0 is the oldest"""
+        return self._items[(self._start + index) % self.size]
+
+    def __iter__(self):
+        return (self[i] for i in range(self._len))
+
+    def bisect(self, value):
+        """Return number of ids lower than value"""
+        low, high = 0, self._len
+        while low < high:
+            middle = (low + high) // 2
+            if self[middle] < value:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def append(self, value):
+        if self._len and value <= self[self._len - 1]:
+            # out of order write from concurrent request, rare so just rebuild
+            position = self.bisect(value)
+            if position < self._len and self[position] == value:
+                return
+            items = list(self)
+            items.insert(position, value)
+            self.extend(items, clear=True)
+            return
+
+        if self._len < self.size:
+            self._items[(self._start + self._len) % self.size] = value
+            self._len += 1
+        else:
+            self._items[self._start] = value
+            self._start = (self._start + 1) % self.size
+
+    def extend(self, values, clear=False):
+        if clear:
+            self._start = 0
+            self._len = 0
+        for value in values[-self.size :]:
+            self.append(value)
+
+    def page(self, limit, after=None):
+        """Return up to limit ids newest first, older than after if given
+
+        Second value is True when buffer holds more ids after this page.
+        """
+        end = self._len if after is None else self.bisect(after)
+        start = max(end - limit, 0)
+        return [self[i] for i in range(end - 1, start - 1, -1)], start > 0
+
+
+class _FeedState:
+    def __init__(self, app):
+        self.size = app.config.get("FEED_SIZE", 1000)
+        self.user_size = app.config.get("FEED_USER_SIZE", 200)
+        self.max_users = app.config.get("FEED_MAX_USERS", 10000)
+        # seconds after which timelines are reloaded, None keeps them forever
+        self.max_age = app.config.get("FEED_MAX_AGE")
+        self.built = 0.0
+        self.timeline = None
+        # user timelines, least recently used are dropped and reloaded on demand
+        self.user_timelines = OrderedDict()
+        self.lock = threading.Lock()
+
+
+def _recent_ids(size, author=None):
+    query = db.select(Post.id)
+    if author is not None:
+        query = query.where(Post.author == author)
+    query = query.order_by(Post.date_created.desc(), Post.id.desc()).limit(size)
+    return sorted(db.session.execute(query).scalars())
+
+
+class Feed:
+    """Precomputed timelines of recent post ids
+
+    Global timeline keeps FEED_SIZE newest posts and every author timeline
+    FEED_USER_SIZE newest posts of that author. Timelines are updated when
+    posts are written (fan-out on write) and loaded from DB on first use, so
+    reading a page costs one primary key lookup of page size. Timelines live
+    in worker memory, posts written by other workers show up after rebuild,
+    which happens every FEED_MAX_AGE seconds when it is set.
+    """
+
+    def init_app(self, app):
+        app.extensions["feed"] = _FeedState(app)
+
+    @property
+    def _state(self):
+        return current_app.extensions["feed"]
+
+    def rebuild(self):
+        """Reload global timeline from DB and drop author timelines"""
+        state = self._state
+        timeline = RingBuffer(state.size)
+        timeline.extend(_recent_ids(state.size))
+        with state.lock:
+            state.timeline = timeline
+            state.built = time.monotonic()
+            state.user_timelines.clear()
+
+    def clear(self):
+        """Drop all timelines, they are loaded from DB again on next read"""
+        state = self._state
+        with state.lock:
+            state.timeline = None
+            state.user_timelines.clear()
+
+    def _timeline(self, author=None):
+        state = self._state
+        if (
+            state.max_age is not None
+            and state.timeline is not None
+            and time.monotonic() - state.built > state.max_age
+        ):
+            self.rebuild()
+        with state.lock:
+            if author is None:
+                timeline = state.timeline
+            else:
+                timeline = state.user_timelines.get(author)
+                if timeline is not None:
+                    state.user_timelines.move_to_end(author)
+        if timeline is not None:
+            return timeline
+
+        if author is None:
+            self.rebuild()
+            return state.timeline
+        timeline = RingBuffer(state.user_size)
+        timeline.extend(_recent_ids(state.user_size, author))
+        with state.lock:
+            state.user_timelines[author] = timeline
+            while len(state.user_timelines) > state.max_users:
+                state.user_timelines.popitem(last=False)
+        return timeline
+
+    def add_posts(self, posts):
+        """Fan out (post id, author id) pairs of committed posts to timelines"""
+        state = self._state
+        with state.lock:
+            for post_id, author in posts:
+                # timelines not loaded yet will read the post from DB
+                if state.timeline is not None:
+                    state.timeline.append(post_id)
+                if author in state.user_timelines:
+                    state.user_timelines[author].append(post_id)
+
+    def forget_user(self, author):
+        state = self._state
+        with state.lock:
+            state.user_timelines.pop(author, None)
+
+    def page(self, limit, after=None, author=None):
+        """Return post ids of one page newest first and next page cursor id"""
+        timeline = self._timeline(author)
+        with self._state.lock:
+            ids, more = timeline.page(limit, after)
+        return ids, ids[-1] if more and ids else None
+
+    def posts(self, ids):
+        """Load rows of given posts with author names, keeping order of ids"""
+        if not ids:
+            return []
+        return in_order(db.session.execute(posts_by_ids(ids)), ids)
+
+
+def in_order(rows, ids):
+    """Sort post rows by given ids, deleted posts are skipped"""
+    rows = {row.id: row for row in rows}
+    return [rows[post_id] for post_id in ids if post_id in rows]
+
+
+feed = Feed()
@@ -0,0 +1,115 @@
+import os
+import threading
+
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from .instrumentation import timed
+
+DEFAULT_ITERATIONS = 260000
+
+
+class HashingBusyError(Exception):
+    """Raised when too many hashing jobs are waiting for the pool"""
+
+
+class _HasherState:
+    def __init__(self, app):
+        self.app = app
+        self.workers = app.config.get("PASSWORD_HASH_WORKERS", os.cpu_count())
+        self.slots = threading.BoundedSemaphore(
+            app.config.get("PASSWORD_HASH_MAX_PENDING", 4 * (self.workers or 1))
+        )
+        self.pool = None
+        self.lock = threading.Lock()
+
+    def get_pool(self):
+        with self.lock:
+            if self.pool is None:
+                # multiprocessing is imported only by apps hashing in pool
+                from concurrent.futures import ProcessPoolExecutor
+
+                self.pool = ProcessPoolExecutor(self.workers)
+            return self.pool
+
+    def run(self, func, *args):
+        """Run func in process pool, or inline when PASSWORD_HASH_WORKERS is 0"""
+        with timed("hashing"):
+            if not self.workers:
+                return func(*args)
+            wait = self.app.config.get("PASSWORD_HASH_WAIT", 5)
+            if not self.slots.acquire(timeout=wait):
+                raise HashingBusyError("Too many password hashing requests")
+            try:
+                return self.get_pool().submit(func, *args).result()
+            finally:
+                self.slots.release()
+
+    def run_many(self, func, *iterables):
+        """Run func for every tuple of args, each pending call holds one slot"""
+        with timed("hashing"):
+            if not self.workers:
+                return list(map(func, *iterables))
+            wait = self.app.config.get("PASSWORD_HASH_WAIT", 5)
+            futures = []
+            for args in zip(*iterables):
+                if not self.slots.acquire(timeout=wait):
+                    raise HashingBusyError("Too many password hashing requests")
+                try:
+                    future = self.get_pool().submit(func, *args)
+                except BaseException:
+                    self.slots.release()
+                    raise
+                future.add_done_callback(lambda future: self.slots.release())
+                futures.append(future)
+            return [future.result() for future in futures]
+
+
+class PasswordHasher:
+    """Password hashing service backed by bounded process pool
+
+    Hashes use pbkdf2 with PASSWORD_HASH_ITERATIONS rounds. Hashing runs in
+    PASSWORD_HASH_WORKERS processes so request threads don't hold the GIL,
+    with at most PASSWORD_HASH_MAX_PENDING jobs waiting.
+    """
+
+    def init_app(self, app):
+        app.extensions["password_hasher"] = _HasherState(app)
+
+    @property
+    def _state(self):
+        return current_app.extensions["password_hasher"]
+
+    @property
+    def method(self):
+        iterations = current_app.config.get(
+            "PASSWORD_HASH_ITERATIONS", DEFAULT_ITERATIONS
+        )
+        return f"pbkdf2:sha256:{iterations}"
+
+    def hash(self, password):
+        return self._state.run(generate_password_hash, password, self.method)
+
+    def hash_many(self, passwords):
+        """Hash list of passwords in shared pool, for bulk imports"""
+        return self._state.run_many(
+            generate_password_hash, passwords, [self.method] * len(passwords)
+        )
+
+    def check(self, pwhash, password):
+        return self._state.run(check_password_hash, pwhash, password)
+
+    def shutdown(self):
+        """Stop hashing processes, pool is started again on next use"""
+        state = self._state
+        with state.lock:
+            pool, state.pool = state.pool, None
+        if pool:
+            pool.shutdown()
+
+    def needs_rehash(self, pwhash):
+        """Return True if hash was made with other method or cost than current"""
+        return pwhash.split("$", 1)[0] != self.method
+
+
+password_hasher = PasswordHasher()
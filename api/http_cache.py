@@ -0,0 +1,159 @@
+"""Conditional GETs and compression for api read endpoints
+
+Every write to a tracked table bumps its row in table_versions through
+triggers, so validators of a response cost one primary key lookup of a tiny
+table, whoever wrote the data. Responses carry weak ETag derived from the
+versions and request URL plus Last-Modified, and matching If-None-Match or
+If-Modified-Since gets 304 without running the view. Large bodies are
+compressed with brotli (when installed) or gzip.
+"""
+import gzip
+import hashlib
+from datetime import timezone
+from functools import wraps
+
+from flask import current_app, request
+from sqlalchemy import DDL, event
+
+from .models import db
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+TRACKED_TABLES = ("user", "post")
+
+# updates of other columns (post counters of user) don't change responses
+TRACKED_UPDATE_COLUMNS = {"user": ("username", "email", "password")}
+
+table_versions = db.Table(
+    "table_versions",
+    db.Column("name", db.String(50), primary_key=True),
+    db.Column("version", db.Integer, nullable=False, default=0),
+    db.Column("updated_at", db.DateTime, nullable=False),
+)
+
+
+def _version_ddl():
+    statements = [
+        "INSERT OR IGNORE INTO table_versions (name, version, updated_at) VALUES "
+        + ", ".join(f"('{table}', 0, CURRENT_TIMESTAMP)" for table in TRACKED_TABLES)
+    ]
+    for table in TRACKED_TABLES:
+        for operation in ("INSERT", "UPDATE", "DELETE"):
+            event = operation
+            if operation == "UPDATE" and table in TRACKED_UPDATE_COLUMNS:
+                event += " OF " + ", ".join(TRACKED_UPDATE_COLUMNS[table])
+            statements.append(
+                f"CREATE TRIGGER IF NOT EXISTS {table}_version_{operation.lower()} "
+                f'AFTER {event} ON "{table}" BEGIN '
+                "UPDATE table_versions SET version = version + 1, "
+                f"updated_at = CURRENT_TIMESTAMP WHERE name = '{table}'; END"
+            )
+    return statements
+
+
+VERSION_DDL = _version_ddl()
+
+# db.create_all creates version rows and triggers once all tables exist
+for statement in VERSION_DDL:
+    event.listen(
+        db.metadata, "after_create", DDL(statement).execute_if(dialect="sqlite")
+    )
+
+
+def versions_query(tables):
+    return db.select(table_versions).where(table_versions.c.name.in_(tables))
+
+
+def validators(rows):
+    """Return weak ETag and Last-Modified of current request for version rows"""
+    key = request.full_path + "|" + ",".join(f"{r.name}:{r.version}" for r in rows)
+    etag = hashlib.sha1(key.encode()).hexdigest()
+    last_modified = max((row.updated_at for row in rows), default=None)
+    if last_modified:
+        # CURRENT_TIMESTAMP is UTC
+        last_modified = last_modified.replace(tzinfo=timezone.utc)
+    return etag, last_modified
+
+
+def not_modified(etag, last_modified):
+    """Return 304 response if request validators match, None otherwise"""
+    if request.if_none_match:
+        match = request.if_none_match.contains_weak(etag)
+    else:
+        since = request.if_modified_since
+        match = bool(since and last_modified and last_modified <= since)
+    if not match:
+        return None
+    response = current_app.response_class(status=304)
+    return add_validators(response, etag, last_modified)
+
+
+def add_validators(response, etag, last_modified, private=False):
+    """Add validators to successful response, clients must revalidate"""
+    if response.status_code in (200, 304):
+        response.set_etag(etag, weak=True)
+        if last_modified:
+            response.last_modified = last_modified
+        response.cache_control.no_cache = True
+        if private:
+            response.cache_control.private = True
+    return response
+
+
+def conditional(*tables, private=False):
+    """Answer view with 304 while given tables did not change
+
+    Versions are read before view runs, so data changed meanwhile only makes
+    next request fetch again.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            rows = db.session.execute(versions_query(tables)).all()
+            if len(rows) < len(tables):
+                # version rows missing, DB is not migrated
+                return view(*args, **kwargs)
+            etag, last_modified = validators(rows)
+            response = not_modified(etag, last_modified)
+            if response is None:
+                response = current_app.make_response(view(*args, **kwargs))
+                add_validators(response, etag, last_modified, private)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def _encode(data, encoding):
+    level = current_app.config.get("API_COMPRESS_LEVEL", 6)
+    if encoding == "br":
+        return brotli.compress(data, quality=min(level, 11))
+    return gzip.compress(data, compresslevel=level)
+
+
+def compress_response(response):
+    """Compress response body when client accepts it and body is large enough"""
+    if (
+        response.status_code != 200
+        or response.is_streamed
+        or response.direct_passthrough
+        or "Content-Encoding" in response.headers
+        or response.content_length is None
+        or response.content_length
+        < current_app.config.get("API_COMPRESS_MIN_SIZE", 500)
+    ):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    offered = ["br", "gzip"] if brotli is not None else ["gzip"]
+    encoding = request.accept_encodings.best_match(offered)
+    if not encoding:
+        return response
+    response.set_data(_encode(response.get_data(), encoding))
+    response.headers["Content-Encoding"] = encoding
+    return response
@@ -0,0 +1,243 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy.exc import SQLAlchemyError
+
+from .feed import feed
+from .models import Post, db
+
+logger = logging.getLogger(__name__)
+
+ACK_ON_ENQUEUE = "enqueue"
+ACK_ON_FLUSH = "flush"
+
+# 3 bound parameters per row, stays under SQLite limit of 999
+INSERT_CHUNK_SIZE = 300
+
+
+class QueueFullError(Exception):
+    """Raised when write-behind queue can't accept more posts"""
+
+
+class FlushError(Exception):
+    """Raised to submitter waiting for flush when batch couldn't be committed"""
+
+
+class _Batch:
+    """Posts submitted in one call, lets submitter wait until they are committed"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.done = threading.Event()
+        self.error = None
+
+
+class _WriterState:
+    """Queue, flusher thread and metrics of write-behind writer for one app"""
+
+    def __init__(self, app):
+        self.app = app
+        self.queue = queue.Queue()
+        # bound is in posts, one big batch weighs as much as many small ones
+        self.max_posts = app.config.get("POST_QUEUE_MAX_SIZE", 10000)
+        self.pending_posts = 0
+        self.lock = threading.Lock()
+        self.thread = None
+        self.flushes = 0
+        self.flushed_posts = 0
+        self.failed_posts = 0
+        self.flush_seconds_total = 0.0
+        self.last_flush_seconds = 0.0
+
+    @property
+    def max_batch(self):
+        return self.app.config.get("POST_QUEUE_MAX_BATCH", 500)
+
+    @property
+    def max_delay(self):
+        return self.app.config.get("POST_QUEUE_MAX_DELAY", 0.05)
+
+    @property
+    def ack(self):
+        return self.app.config.get("POST_QUEUE_ACK", ACK_ON_ENQUEUE)
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name="post-writer", daemon=True
+                )
+                self.thread.start()
+                atexit.register(self.drain)
+
+    def run(self):
+        while True:
+            self.flush(self.collect())
+
+    def put(self, batch):
+        with self.lock:
+            if self.pending_posts + len(batch.rows) > self.max_posts:
+                raise QueueFullError("Post queue is full")
+            self.pending_posts += len(batch.rows)
+        self.queue.put(batch)
+
+    def collect(self):
+        """Block for first batch, then gather more until size or time threshold"""
+        batches = [self.queue.get()]
+        size = len(batches[0].rows)
+        deadline = time.monotonic() + self.max_delay
+        while size < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batches.append(batch)
+            size += len(batch.rows)
+        return batches
+
+    def drain(self):
+        """Flush everything left in queue in calling thread"""
+        batches = []
+        while True:
+            try:
+                batches.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if batches:
+            self.flush(batches)
+
+    def flush(self, batches):
+        """Insert all rows of given batches with single commit
+
+        When commit fails, batches are retried one by one, so only the bad
+        ones fail and posts of other submitters are saved.
+        """
+        start = time.perf_counter()
+        with self.app.app_context():
+            try:
+                self.insert(batches)
+            except SQLAlchemyError as e:
+                if len(batches) == 1:
+                    batches[0].error = e
+                else:
+                    for batch in batches:
+                        try:
+                            self.insert([batch])
+                        except Exception as e:
+                            batch.error = e
+            except Exception as e:
+                for batch in batches:
+                    batch.error = e
+        elapsed = time.perf_counter() - start
+
+        total = sum(len(batch.rows) for batch in batches)
+        failed = sum(len(batch.rows) for batch in batches if batch.error)
+        with self.lock:
+            self.flushes += 1
+            self.last_flush_seconds = elapsed
+            self.flush_seconds_total += elapsed
+            self.failed_posts += failed
+            self.flushed_posts += total - failed
+            self.pending_posts -= total
+        for batch in batches:
+            batch.done.set()
+            self.queue.task_done()
+
+    def insert(self, batches):
+        """Insert rows of given batches with single commit and add them to feed"""
+        rows = [row for batch in batches for row in batch.rows]
+        posts = []
+        try:
+            connection = db.session.connection()
+            column_type = Post.__table__.c.date_created.type
+            process = column_type.dialect_impl(connection.dialect).bind_processor(
+                connection.dialect
+            )
+            date_created = process(datetime.now())
+            for offset in range(0, len(rows), INSERT_CHUNK_SIZE):
+                chunk = rows[offset : offset + INSERT_CHUNK_SIZE]
+                params = []
+                for row in chunk:
+                    params += [row["text"], row["author"], date_created]
+                # ids come from RETURNING, other writers may insert in between
+                posts += connection.exec_driver_sql(
+                    "INSERT INTO post (text, author, date_created) VALUES "
+                    + ", ".join(["(?, ?, ?)"] * len(chunk))
+                    + " RETURNING id, author",
+                    tuple(params),
+                ).fetchall()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            logger.exception("Failed to flush %d posts", len(rows))
+            raise
+        finally:
+            db.session.remove()
+        # RETURNING order is unspecified, timelines are kept in id order
+        feed.add_posts(sorted((post_id, author) for post_id, author in posts))
+
+
+class PostWriter:
+    """Write-behind writer that group commits posts in batches
+
+    Posts are put in in-process queue holding at most POST_QUEUE_MAX_SIZE
+    posts and flushed by background thread when POST_QUEUE_MAX_BATCH posts
+    are waiting or POST_QUEUE_MAX_DELAY seconds passed. With POST_QUEUE_ACK
+    = "flush" submit waits until posts are committed, with "enqueue"
+    (default) it returns right away.
+    """
+
+    def init_app(self, app):
+        app.extensions["post_writer"] = _WriterState(app)
+
+    @property
+    def _state(self):
+        return current_app.extensions["post_writer"]
+
+    @property
+    def ack(self):
+        return self._state.ack
+
+    def submit(self, rows, timeout=30):
+        """Queue post rows (dicts with text and author) for insert"""
+        state = self._state
+        state.start()
+        batch = _Batch(rows)
+        state.put(batch)
+
+        if state.ack == ACK_ON_FLUSH:
+            if not batch.done.wait(timeout):
+                raise FlushError("Timed out waiting for flush")
+            if batch.error:
+                raise FlushError("Failed to save posts") from batch.error
+
+    def flush(self):
+        """Wait until all queued posts are flushed"""
+        state = self._state
+        if state.thread is None:
+            state.drain()
+        else:
+            state.queue.join()
+
+    def metrics(self):
+        state = self._state
+        with state.lock:
+            return {
+                "queue_depth": state.pending_posts,
+                "flushes": state.flushes,
+                "flushed_posts": state.flushed_posts,
+                "failed_posts": state.failed_posts,
+                "last_flush_seconds": state.last_flush_seconds,
+                "flush_seconds_total": state.flush_seconds_total,
+            }
+
+
+post_writer = PostWriter()
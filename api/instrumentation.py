@@ -0,0 +1,387 @@
+"""Per-request timing, SQL query counts and Prometheus metrics
+
+Every request gets RequestTimings in a context variable. SQLAlchemy cursor
+events, template rendering, JSON serialization and password hashing add
+their time to it, nested phases are excluded from outer ones, rest of
+request time is "other". At end of request totals go to in-process metrics
+served in Prometheus text format at /metrics. INSTRUMENTATION_ENABLED set
+to False turns it off.
+
+Views decorated with query_budget(n) log a warning when a request runs more
+than n SQL queries, QUERY_BUDGET_ENFORCED set to True (as in tests) raises
+QueryBudgetExceeded instead, so N+1 query patterns fail the test suite.
+
+With PROFILE_SLOW_REQUEST_SECONDS set, background thread samples stacks of
+threads serving requests every PROFILE_INTERVAL seconds and requests slower
+than threshold dump collapsed stacks (flamegraph.pl or speedscope input)
+to PROFILE_DIR.
+"""
+import contextvars
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import current_app, request
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+PHASES = ("sql", "serialization", "render", "hashing", "other")
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Request or block ran more SQL queries than its budget"""
+
+    def __init__(self, name, budget, statements):
+        self.budget = budget
+        self.statements = statements
+        super().__init__(
+            f"{name} ran {len(statements)} queries, budget is {budget}:\n"
+            + "\n".join(statements)
+        )
+
+
+class RequestTimings:
+    """Time spent in each phase of one request, nested phases are exclusive"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.queries = 0
+        self.statements = []
+        self.samples = Counter()
+        self._stack = []
+
+    def enter(self, phase):
+        now = time.perf_counter()
+        if self._stack:
+            parent, started = self._stack[-1]
+            self.phases[parent] += now - started
+        self._stack.append((phase, now))
+
+    def exit(self, phase=None):
+        if not self._stack or phase and self._stack[-1][0] != phase:
+            return
+        now = time.perf_counter()
+        phase, started = self._stack.pop()
+        self.phases[phase] += now - started
+        if self._stack:
+            self._stack[-1] = (self._stack[-1][0], now)
+
+    def finish(self):
+        duration = time.perf_counter() - self.start
+        self.phases["other"] = max(
+            duration - sum(v for k, v in self.phases.items() if k != "other"), 0.0
+        )
+        return duration
+
+
+@contextmanager
+def timed(phase):
+    """Count time of block to given phase of current request"""
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+    timings.enter(phase)
+    try:
+        yield
+    finally:
+        timings.exit()
+
+
+@contextmanager
+def untimed():
+    """Leave block out of timings and query count of current request"""
+    token = _timings.set(None)
+    try:
+        yield
+    finally:
+        _timings.reset(token)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timings = _timings.get()
+    if timings is not None:
+        timings.queries += 1
+        timings.statements.append(statement)
+        timings.enter("sql")
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timings = _timings.get()
+    if timings is not None:
+        timings.exit("sql")
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(context):
+    timings = _timings.get()
+    if timings is not None:
+        timings.exit("sql")
+
+
+@contextmanager
+def assert_max_queries(budget):
+    """Raise QueryBudgetExceeded if block runs more than budget SQL queries
+
+    Counts queries of every engine run by current thread, for use in tests:
+
+        with assert_max_queries(2):
+            client.get("/")
+    """
+    statements = []
+    thread = threading.get_ident()
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == thread:
+            statements.append(statement)
+
+    event.listen(Engine, "before_cursor_execute", count)
+    try:
+        yield statements
+    finally:
+        event.remove(Engine, "before_cursor_execute", count)
+    if len(statements) > budget:
+        raise QueryBudgetExceeded("block", budget, statements)
+
+
+class TimedTemplate(Template):
+    """Template counting its rendering to render phase"""
+
+    def render(self, *args, **kwargs):
+        with timed("render"):
+            return super().render(*args, **kwargs)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.values = {}
+
+    def observe(self, labels, value):
+        counts, total, count = self.values.get(labels) or (
+            [0] * len(self.buckets),
+            0.0,
+            0,
+        )
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        self.values[labels] = (counts, total + value, count + 1)
+
+    def lines(self, name, label_names):
+        for labels, (counts, total, count) in sorted(self.values.items()):
+            base = _labels(label_names, labels)
+            for bound, bucket in zip(self.buckets, counts):
+                yield f'{name}_bucket{{{base},le="{bound}"}} {bucket}'
+            yield f'{name}_bucket{{{base},le="+Inf"}} {count}'
+            yield f"{name}_sum{{{base}}} {total}"
+            yield f"{name}_count{{{base}}} {count}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+class _InstrumentationState:
+    def __init__(self, app):
+        self.app = app
+        self.lock = threading.Lock()
+        self.durations = Histogram(DURATION_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.phase_seconds = Counter()
+        self.collectors = []
+        # thread id -> timings of requests in progress, sampled by profiler
+        self.active = {}
+        self.sampler = None
+
+    @property
+    def profile_threshold(self):
+        return self.app.config.get("PROFILE_SLOW_REQUEST_SECONDS")
+
+    def record(self, endpoint, method, status, timings, duration):
+        with self.lock:
+            self.durations.observe((endpoint, method, status), duration)
+            self.queries.observe((endpoint,), timings.queries)
+            for phase, seconds in timings.phases.items():
+                self.phase_seconds[endpoint, phase] += seconds
+
+    def start_sampler(self):
+        with self.lock:
+            if self.sampler is None:
+                self.sampler = threading.Thread(
+                    target=self.sample, name="request-profiler", daemon=True
+                )
+                self.sampler.start()
+
+    def sample(self):
+        interval = self.app.config.get("PROFILE_INTERVAL", 0.005)
+        own = threading.get_ident()
+        while True:
+            time.sleep(interval)
+            with self.lock:
+                if not self.active:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, timings in self.active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None and thread_id != own:
+                        timings.samples[collapse(frame)] += 1
+
+    def dump(self, endpoint, timings, duration):
+        directory = self.app.config.get("PROFILE_DIR", "profiles")
+        os.makedirs(directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(
+            directory, f"{stamp}-{endpoint}-{duration * 1000:.0f}ms.folded"
+        )
+        with open(path, "w") as file:
+            for stack, count in timings.samples.items():
+                file.write(f"{stack} {count}\n")
+        logger.warning(
+            "Slow request %s took %.3fs, profile in %s", endpoint, duration, path
+        )
+
+
+def collapse(frame):
+    """Return stack of frame as root first, semicolon separated frame names"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        filename = os.path.basename(code.co_filename)
+        names.append(f"{code.co_name} ({filename}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Instrumentation:
+    """Request timing metrics exported at /metrics and slow request profiler"""
+
+    def init_app(self, app):
+        state = _InstrumentationState(app)
+        app.extensions["instrumentation"] = state
+        app.jinja_env.template_class = TimedTemplate
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.add_url_rule("/metrics", "metrics", self.metrics_view)
+
+    @property
+    def _state(self):
+        return current_app.extensions["instrumentation"]
+
+    def collector(self, app, prefix, func):
+        """Export numbers of dict returned by func as gauges named prefix_key"""
+        app.extensions["instrumentation"].collectors.append((prefix, func))
+
+    def query_budget(self, budget):
+        """Decorator setting maximum number of SQL queries of view
+
+        Put it right under route decorator, request over budget is logged or
+        with QUERY_BUDGET_ENFORCED raises QueryBudgetExceeded.
+        """
+
+        def decorator(view):
+            view.query_budget = budget
+            return view
+
+        return decorator
+
+    def _check_budget(self, endpoint, timings):
+        view = current_app.view_functions.get(endpoint)
+        budget = getattr(view, "query_budget", None)
+        if budget is None or timings.queries <= budget:
+            return
+        if current_app.config.get("QUERY_BUDGET_ENFORCED"):
+            raise QueryBudgetExceeded(endpoint, budget, timings.statements)
+        logger.warning(
+            "Request %s ran %d queries, budget is %d",
+            endpoint,
+            timings.queries,
+            budget,
+        )
+
+    def _before_request(self):
+        if not current_app.config.get("INSTRUMENTATION_ENABLED", True):
+            return
+        timings = RequestTimings()
+        _timings.set(timings)
+        state = self._state
+        if state.profile_threshold is not None:
+            state.start_sampler()
+            with state.lock:
+                state.active[threading.get_ident()] = timings
+
+    def _after_request(self, response):
+        timings = _timings.get()
+        if timings is None:
+            return response
+        _timings.set(None)
+        state = self._state
+        with state.lock:
+            state.active.pop(threading.get_ident(), None)
+        duration = timings.finish()
+        endpoint = request.endpoint or "unknown"
+        state.record(endpoint, request.method, response.status_code, timings, duration)
+        threshold = state.profile_threshold
+        if threshold is not None and duration >= threshold and timings.samples:
+            state.dump(endpoint, timings, duration)
+        self._check_budget(endpoint, timings)
+        return response
+
+    def metrics_view(self):
+        """Route that returns metrics in Prometheus text format"""
+        return current_app.response_class(
+            self.render(), mimetype="text/plain; version=0.0.4"
+        )
+
+    def render(self):
+        state = self._state
+        lines = []
+        with state.lock:
+            lines += [
+                "# HELP redditlo_request_duration_seconds Request duration",
+                "# TYPE redditlo_request_duration_seconds histogram",
+            ]
+            lines += state.durations.lines(
+                "redditlo_request_duration_seconds", ("endpoint", "method", "status")
+            )
+            lines += [
+                "# HELP redditlo_request_sql_queries SQL queries run by one request",
+                "# TYPE redditlo_request_sql_queries histogram",
+            ]
+            lines += state.queries.lines("redditlo_request_sql_queries", ("endpoint",))
+            lines += [
+                "# HELP redditlo_request_phase_seconds_total Request time by phase",
+                "# TYPE redditlo_request_phase_seconds_total counter",
+            ]
+            for (endpoint, phase), seconds in sorted(state.phase_seconds.items()):
+                labels = _labels(("endpoint", "phase"), (endpoint, phase))
+                lines.append(
+                    f"redditlo_request_phase_seconds_total{{{labels}}} {seconds}"
+                )
+        for prefix, func in state.collectors:
+            for key, value in func().items():
+                if isinstance(value, (int, float)):
+                    lines.append(f"# TYPE {prefix}_{key} gauge")
+                    lines.append(f"{prefix}_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+
+instrumentation = Instrumentation()
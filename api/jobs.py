@@ -0,0 +1,292 @@
+"""Durable background jobs stored in SQLite
+
+Jobs are rows of job table written in the same transaction as the change
+that needs them, so they are never lost and never run for rolled back
+writes. Triggers can enqueue jobs too with job_sql. JOB_WORKERS threads in
+every app process with file database (started by first request) or
+dedicated `flask api run-jobs` processes claim due jobs for JOB_LEASE
+seconds and run handler registered with job_queue.handler. Handler gets
+payload dict and runs in app context, job is deleted in its transaction
+after it returns, so jobs run at least once.
+
+Failed jobs are retried up to JOB_MAX_ATTEMPTS times with exponential
+backoff from JOB_RETRY_DELAY seconds, then moved to dead_job table. Job
+with key isn't enqueued while one with the same key waits to run, so
+handler of keyed job must process everything outstanding, not one event.
+"""
+import json
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.engine import make_url
+
+from .database import is_file_sqlite
+from .models import db
+
+logger = logging.getLogger(__name__)
+
+# worker threads per app process with file database
+DEFAULT_WORKERS = 1
+
+# current unix time in SQLite, unixepoch() needs newer SQLite
+SQL_NOW = "((julianday('now') - 2440587.5) * 86400.0)"
+
+
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), nullable=False)
+    # dedups jobs waiting to run, cleared when job is claimed
+    key = db.Column(db.String(100), unique=True)
+    payload = db.Column(db.Text, nullable=False, default="{}")
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    # unix times, plain numbers keep claiming and backoff simple SQL
+    run_at = db.Column(db.Float, nullable=False)
+    locked_until = db.Column(db.Float)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+    __table_args__ = (db.Index("ix_job_run_at", run_at),)
+
+
+class DeadJob(db.Model):
+    __tablename__ = "dead_job"
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    attempts = db.Column(db.Integer, nullable=False)
+    error = db.Column(db.Text)
+    failed_at = db.Column(db.DateTime, default=datetime.now)
+
+
+def job_sql(name, key=None, payload="{}"):
+    """Return SQL statement enqueuing job, for use in triggers"""
+    key_sql = "NULL" if key is None else f"'{key}'"
+    return (
+        "INSERT INTO job (name, key, payload, attempts, run_at) "
+        f"VALUES ('{name}', {key_sql}, '{payload}', 0, {SQL_NOW}) "
+        "ON CONFLICT (key) DO NOTHING"
+    )
+
+
+class _JobQueueState:
+    def __init__(self, app):
+        self.app = app
+        self.lock = threading.Lock()
+        self.threads = []
+        self.started = False
+        self.stopping = threading.Event()
+        self.counts = Counter()
+
+    @property
+    def workers(self):
+        workers = self.app.config.get("JOB_WORKERS")
+        if workers is None:
+            # in-memory database can't be shared with worker threads
+            uri = make_url(self.app.config["SQLALCHEMY_DATABASE_URI"])
+            workers = DEFAULT_WORKERS if is_file_sqlite(uri) else 0
+        return workers
+
+    @property
+    def lease(self):
+        return self.app.config.get("JOB_LEASE", 300)
+
+    @property
+    def max_attempts(self):
+        return self.app.config.get("JOB_MAX_ATTEMPTS", 5)
+
+    @property
+    def retry_delay(self):
+        return self.app.config.get("JOB_RETRY_DELAY", 1)
+
+    @property
+    def poll_interval(self):
+        return self.app.config.get("JOB_POLL_INTERVAL", 0.2)
+
+    def start(self):
+        if self.started:
+            return
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+            for i in range(self.workers):
+                thread = threading.Thread(
+                    target=self.run, name=f"job-worker-{i}", daemon=True
+                )
+                thread.start()
+                self.threads.append(thread)
+
+    def run(self):
+        while not self.stopping.is_set():
+            with self.app.app_context():
+                try:
+                    ran = run_next(self)
+                except Exception:
+                    logger.exception("Job worker failed")
+                    ran = False
+                finally:
+                    db.session.remove()
+            if not ran:
+                self.stopping.wait(self.poll_interval)
+
+    def count(self, outcome):
+        with self.lock:
+            self.counts[outcome] += 1
+
+
+def claim(state, now):
+    """Lease oldest due job, return it or None if there is nothing to run"""
+    due = db.or_(Job.locked_until.is_(None), Job.locked_until < now)
+    row = db.session.execute(
+        db.select(Job.id)
+        .where(Job.run_at <= now, due)
+        .order_by(Job.run_at, Job.id)
+        .limit(1)
+    ).first()
+    if row is None:
+        db.session.commit()
+        return None
+    # other worker may have claimed it since select
+    claimed = db.session.execute(
+        db.update(Job)
+        .where(Job.id == row.id, due)
+        .values(locked_until=now + state.lease, attempts=Job.attempts + 1, key=None)
+    ).rowcount
+    db.session.commit()
+    if not claimed:
+        return None
+    return db.session.execute(db.select(Job.__table__).where(Job.id == row.id)).one()
+
+
+def run_next(state):
+    """Run one due job, return False if there was none"""
+    job = claim(state, time.time())
+    if job is None:
+        return False
+    handler = job_queue.handlers.get(job.name)
+    try:
+        if handler is None:
+            raise LookupError(f"No handler for job {job.name}")
+        handler(json.loads(job.payload))
+        db.session.execute(db.delete(Job).where(Job.id == job.id))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        fail(state, job, e)
+        return True
+    state.count("completed")
+    return True
+
+
+def fail(state, job, error):
+    """Schedule retry of failed job or move it to dead_job"""
+    message = f"{type(error).__name__}: {error}"
+    if job.attempts >= state.max_attempts:
+        logger.error("Job %s %d failed for good: %s", job.name, job.id, message)
+        db.session.execute(
+            db.insert(DeadJob).values(
+                name=job.name,
+                payload=job.payload,
+                attempts=job.attempts,
+                error=message,
+            )
+        )
+        db.session.execute(db.delete(Job).where(Job.id == job.id))
+        state.count("dead")
+    else:
+        logger.warning("Job %s %d failed, retrying: %s", job.name, job.id, message)
+        delay = state.retry_delay * 2 ** (job.attempts - 1)
+        db.session.execute(
+            db.update(Job)
+            .where(Job.id == job.id)
+            .values(run_at=time.time() + delay, locked_until=None, last_error=message)
+        )
+        state.count("retried")
+    db.session.commit()
+
+
+class JobQueue:
+    """Queue of jobs run by background workers with retries"""
+
+    def __init__(self):
+        self.handlers = {}
+
+    def init_app(self, app):
+        app.extensions["job_queue"] = _JobQueueState(app)
+        app.before_request(self._start)
+
+    @property
+    def _state(self):
+        return current_app.extensions["job_queue"]
+
+    def _start(self):
+        # threads started before fork of preforking server would be lost
+        self._state.start()
+
+    def handler(self, name):
+        """Decorator registering function run for jobs of given name"""
+
+        def decorator(func):
+            self.handlers[name] = func
+            return func
+
+        return decorator
+
+    def enqueue(self, name, payload=None, key=None, delay=0, connection=None):
+        """Add job to current session, it is saved by next commit
+
+        With connection job is added in transaction of that connection.
+        """
+        (connection or db.session).execute(
+            insert(Job)
+            .values(
+                name=name,
+                key=key,
+                payload=json.dumps(payload or {}),
+                run_at=time.time() + delay,
+            )
+            .on_conflict_do_nothing(index_elements=["key"])
+        )
+
+    def run_pending(self):
+        """Run due jobs in calling thread until none is left, return their number"""
+        state = self._state
+        ran = 0
+        while run_next(state):
+            ran += 1
+        return ran
+
+    def run_forever(self):
+        """Run jobs in calling thread until stop, for dedicated worker processes"""
+        state = self._state
+        state.stopping.clear()
+        state.run()
+
+    def stop(self, timeout=None):
+        """Let workers finish their job and stop them"""
+        state = self._state
+        state.stopping.set()
+        for thread in state.threads:
+            thread.join(timeout)
+
+    def metrics(self):
+        state = self._state
+        with state.lock:
+            metrics = {
+                "completed": state.counts["completed"],
+                "retried": state.counts["retried"],
+                "dead": state.counts["dead"],
+            }
+        metrics["queue_depth"] = db.session.scalar(
+            db.select(db.func.count()).select_from(Job)
+        )
+        return metrics
+
+
+job_queue = JobQueue()
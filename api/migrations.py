@@ -0,0 +1,244 @@
+from datetime import datetime
+
+from .models import db
+from .jobs import DeadJob, Job
+from .search import SEARCH_TABLE_DDL
+
+schema_migrations = db.Table(
+    "schema_migrations",
+    db.Column("version", db.Integer, primary_key=True),
+    db.Column("description", db.String(200)),
+    db.Column("applied_at", db.DateTime, default=datetime.now),
+)
+
+POST_INDEX_DDL = [
+    "CREATE INDEX IF NOT EXISTS ix_post_author_date_created "
+    "ON post (author, date_created DESC, id DESC)",
+    "CREATE INDEX IF NOT EXISTS ix_post_date_created_id "
+    "ON post (date_created DESC, id DESC)",
+]
+
+
+def add_column(table, column, definition):
+    """Migration step adding column unless table already has it"""
+
+    def step(connection):
+        columns = connection.exec_driver_sql(f'PRAGMA table_info("{table}")')
+        if column not in {row[1] for row in columns}:
+            connection.exec_driver_sql(
+                f'ALTER TABLE "{table}" ADD COLUMN {column} {definition}'
+            )
+
+    return step
+
+
+def create_table(model):
+    """Migration step creating table of model with its indexes"""
+
+    def step(connection):
+        model.__table__.create(connection, checkfirst=True)
+
+    return step
+
+
+# SQL of migrations is written out as it was when they were added, current
+# DDL of other modules only goes to create_all and newest migration
+
+# search index updated by triggers in transaction of write
+SEARCH_DDL_V2 = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS post_search USING fts5("
+    "text, content='post', content_rowid='id', tokenize='porter unicode61')",
+    "CREATE TRIGGER IF NOT EXISTS post_search_insert AFTER INSERT ON post BEGIN "
+    "INSERT INTO post_search (rowid, text) VALUES (new.id, new.text); END",
+    "CREATE TRIGGER IF NOT EXISTS post_search_delete AFTER DELETE ON post BEGIN "
+    "INSERT INTO post_search (post_search, rowid, text) "
+    "VALUES ('delete', old.id, old.text); END",
+    "CREATE TRIGGER IF NOT EXISTS post_search_update AFTER UPDATE OF text ON post "
+    "BEGIN "
+    "INSERT INTO post_search (post_search, rowid, text) "
+    "VALUES ('delete', old.id, old.text); "
+    "INSERT INTO post_search (rowid, text) VALUES (new.id, new.text); END",
+]
+
+# versions bumped by every write to user and post
+VERSION_DDL_V3 = [
+    "INSERT OR IGNORE INTO table_versions (name, version, updated_at) "
+    "VALUES ('user', 0, CURRENT_TIMESTAMP), ('post', 0, CURRENT_TIMESTAMP)",
+    'CREATE TRIGGER IF NOT EXISTS user_version_insert AFTER INSERT ON "user" '
+    "BEGIN UPDATE table_versions SET version = version + 1, "
+    "updated_at = CURRENT_TIMESTAMP WHERE name = 'user'; END",
+    'CREATE TRIGGER IF NOT EXISTS user_version_update AFTER UPDATE ON "user" '
+    "BEGIN UPDATE table_versions SET version = version + 1, "
+    "updated_at = CURRENT_TIMESTAMP WHERE name = 'user'; END",
+    'CREATE TRIGGER IF NOT EXISTS user_version_delete AFTER DELETE ON "user" '
+    "BEGIN UPDATE table_versions SET version = version + 1, "
+    "updated_at = CURRENT_TIMESTAMP WHERE name = 'user'; END",
+    'CREATE TRIGGER IF NOT EXISTS post_version_insert AFTER INSERT ON "post" '
+    "BEGIN UPDATE table_versions SET version = version + 1, "
+    "updated_at = CURRENT_TIMESTAMP WHERE name = 'post'; END",
+    'CREATE TRIGGER IF NOT EXISTS post_version_update AFTER UPDATE ON "post" '
+    "BEGIN UPDATE table_versions SET version = version + 1, "
+    "updated_at = CURRENT_TIMESTAMP WHERE name = 'post'; END",
+    'CREATE TRIGGER IF NOT EXISTS post_version_delete AFTER DELETE ON "post" '
+    "BEGIN UPDATE table_versions SET version = version + 1, "
+    "updated_at = CURRENT_TIMESTAMP WHERE name = 'post'; END",
+]
+
+# (version, description, statements) applied in order, never edit applied ones,
+# statement is SQL string or function called with connection
+MIGRATIONS = [
+    (1, "Index posts by author and by recency", POST_INDEX_DDL),
+    (
+        2,
+        "Full-text search index of posts",
+        SEARCH_DDL_V2 + ["INSERT INTO post_search (post_search) VALUES ('rebuild')"],
+    ),
+    (
+        3,
+        "Table versions for HTTP validators",
+        [
+            "CREATE TABLE IF NOT EXISTS table_versions ("
+            "name VARCHAR(50) NOT NULL PRIMARY KEY, version INTEGER NOT NULL, "
+            "updated_at DATETIME NOT NULL)"
+        ]
+        + VERSION_DDL_V3,
+    ),
+    (
+        4,
+        "Cascade deletes of users to their posts",
+        [
+            # posts left behind by deletes before foreign keys were enforced
+            "DELETE FROM post WHERE author NOT IN (SELECT id FROM user)",
+            # SQLite can't alter constraints, table is rebuilt with same ids
+            "CREATE TABLE post_new (id INTEGER NOT NULL, date_created DATETIME, "
+            "text TEXT NOT NULL, author INTEGER NOT NULL, PRIMARY KEY (id), "
+            "FOREIGN KEY(author) REFERENCES user (id) ON DELETE CASCADE)",
+            "INSERT INTO post_new (id, date_created, text, author) "
+            "SELECT id, date_created, text, author FROM post",
+            "DROP TABLE post",
+            "ALTER TABLE post_new RENAME TO post",
+        ]
+        # indexes and triggers were dropped with old table
+        + POST_INDEX_DDL + SEARCH_DDL_V2 + VERSION_DDL_V3,
+    ),
+    (
+        5,
+        "Post counters of users",
+        [
+            add_column("user", "post_count", "INTEGER NOT NULL DEFAULT 0"),
+            add_column("user", "last_post_at", "DATETIME"),
+            "UPDATE user SET "
+            "post_count = (SELECT count(*) FROM post WHERE author = user.id), "
+            "last_post_at = "
+            "(SELECT max(date_created) FROM post WHERE author = user.id)",
+            "CREATE TRIGGER IF NOT EXISTS post_counter_insert AFTER INSERT ON post "
+            "BEGIN UPDATE user SET post_count = post_count + 1, "
+            "last_post_at = max(coalesce(last_post_at, new.date_created), "
+            "new.date_created) WHERE id = new.author; END",
+            "CREATE TRIGGER IF NOT EXISTS post_counter_delete AFTER DELETE ON post "
+            "BEGIN UPDATE user SET post_count = post_count - 1, "
+            "last_post_at = CASE WHEN last_post_at = old.date_created THEN "
+            "(SELECT max(date_created) FROM post WHERE author = old.author) "
+            "ELSE last_post_at END WHERE id = old.author; END",
+            # counter updates must not change validators of users
+            "DROP TRIGGER IF EXISTS user_version_update",
+            "CREATE TRIGGER IF NOT EXISTS user_version_update "
+            'AFTER UPDATE OF username, email, password ON "user" BEGIN '
+            "UPDATE table_versions SET version = version + 1, "
+            "updated_at = CURRENT_TIMESTAMP WHERE name = 'user'; END",
+        ],
+    ),
+    (
+        6,
+        "Job queue and search indexing in background",
+        [
+            create_table(Job),
+            create_table(DeadJob),
+            "DROP TRIGGER IF EXISTS post_search_insert",
+            "DROP TRIGGER IF EXISTS post_search_delete",
+            "DROP TRIGGER IF EXISTS post_search_update",
+        ]
+        + SEARCH_TABLE_DDL,
+    ),
+]
+
+
+def applied_versions(connection):
+    """Return set of migration versions recorded in schema_migrations"""
+    schema_migrations.create(connection, checkfirst=True)
+    return {
+        row.version
+        for row in connection.execute(db.select(schema_migrations.c.version))
+    }
+
+
+def migrate(engine=None):
+    """Apply pending migrations, each in its own transaction
+
+    Returns list of applied versions.
+    """
+    engine = engine or db.engine
+    with engine.begin() as connection:
+        done = applied_versions(connection)
+
+    applied = []
+    for version, description, statements in MIGRATIONS:
+        if version in done:
+            continue
+        with engine.begin() as connection:
+            for statement in statements:
+                if callable(statement):
+                    statement(connection)
+                else:
+                    connection.exec_driver_sql(statement)
+            connection.execute(
+                schema_migrations.insert(),
+                {"version": version, "description": description},
+            )
+        applied.append(version)
+    return applied
+
+
+def create_schema(engine=None):
+    """Create all tables for new DB and mark every migration as applied"""
+    engine = engine or db.engine
+    db.metadata.create_all(engine)
+    with engine.begin() as connection:
+        done = applied_versions(connection)
+        pending = [
+            {"version": version, "description": description}
+            for version, description, _ in MIGRATIONS
+            if version not in done
+        ]
+        if pending:
+            connection.execute(schema_migrations.insert(), pending)
+
+
+def query_plan(connection, statement, params=None):
+    """Return detail lines of SQLite EXPLAIN QUERY PLAN for statement
+
+    Statements are planned with bound parameters as they are run, literal
+    values would let SQLite simplify conditions real queries can't.
+    """
+    if not isinstance(statement, str):
+        compiled = statement.compile(dialect=connection.dialect)
+        values = compiled.construct_params()
+        params = []
+        for name in compiled.positiontup:
+            column_type = compiled.binds[name].type.dialect_impl(connection.dialect)
+            process = column_type.bind_processor(connection.dialect)
+            params.append(process(values[name]) if process else values[name])
+        statement = str(compiled)
+    rows = connection.exec_driver_sql(
+        "EXPLAIN QUERY PLAN " + statement, tuple(params or ())
+    )
+    return [row[-1] for row in rows]
+
+
+def scans(plan):
+    """Return plan lines that read whole table or whole index
+
+    SCAN ... USING COVERING INDEX still reads every entry unless LIMIT
+    stops it early, only SEARCH seeks to matching rows.
+    """
+    return [line for line in plan if line.startswith("SCAN") and "CONSTANT" not in line]
@@ -1,7 +1,8 @@
 from datetime import datetime
 from dataclasses import dataclass
-from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy import DDL, event
+from .database import SQLAlchemy
 
 db = SQLAlchemy()
 
@@ -18,9 +19,18 @@ class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(15), unique=True)
     email = db.Column(db.String(50), unique=True)
-    password = db.Column(db.String(60))
-    date_created = db.Column(db.DateTime(timezone=True), default=datetime.now())
-    posts = db.relationship("Post", backref="user", passive_deletes=True)
+    password = db.Column(db.String(255))
+    date_created = db.Column(db.DateTime(timezone=True), default=datetime.now)
+    # maintained by triggers on post, see POST_COUNTER_DDL
+    post_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    last_post_at = db.Column(db.DateTime(timezone=True))
+    # load with queries.LOADING strategies, lazy load would run query per row
+    posts = db.relationship(
+        "Post",
+        backref=db.backref("user", lazy="raise_on_sql"),
+        lazy="raise_on_sql",
+        passive_deletes=True,
+    )
 
 
 @dataclass
@@ -29,8 +39,37 @@ class Post(db.Model):
     text: str
 
     id = db.Column(db.Integer, primary_key=True)
-    date_created = db.Column(db.DateTime(timezone=True), default=datetime.now())
+    date_created = db.Column(db.DateTime(timezone=True), default=datetime.now)
     text = db.Column(db.Text, nullable=False)
     author = db.Column(
-        db.Integer, db.ForeignKey("user.id", on_delete="CASCADE"), nullable=False
+        db.Integer, db.ForeignKey("user.id", ondelete="CASCADE"), nullable=False
+    )
+
+    # hot paths: posts of one author by recency and global feed by recency,
+    # both match ORDER BY date_created DESC, id DESC used by keyset pagination
+    __table_args__ = (
+        db.Index("ix_post_author_date_created", author, date_created.desc(), id.desc()),
+        db.Index("ix_post_date_created_id", date_created.desc(), id.desc()),
+    )
+
+
+# every way of writing posts (ORM, bulk insert, cascade) keeps
+# user counters right in the same transaction
+POST_COUNTER_DDL = [
+    "CREATE TRIGGER IF NOT EXISTS post_counter_insert AFTER INSERT ON post BEGIN "
+    "UPDATE user SET post_count = post_count + 1, "
+    "last_post_at = max(coalesce(last_post_at, new.date_created), new.date_created) "
+    "WHERE id = new.author; END",
+    # latest post is looked up only when it was the one deleted
+    "CREATE TRIGGER IF NOT EXISTS post_counter_delete AFTER DELETE ON post BEGIN "
+    "UPDATE user SET post_count = post_count - 1, "
+    "last_post_at = CASE WHEN last_post_at = old.date_created THEN "
+    "(SELECT max(date_created) FROM post WHERE author = old.author) "
+    "ELSE last_post_at END "
+    "WHERE id = old.author; END",
+]
+
+for statement in POST_COUNTER_DDL:
+    event.listen(
+        Post.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite")
     )
@@ -0,0 +1,74 @@
+import base64
+import json
+from datetime import datetime
+
+from flask import request
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+class PaginationError(ValueError):
+    """Raised when limit, cursor or fields query parameters are malformed"""
+
+
+def encode_cursor(*values):
+    """Encode last row key values into an opaque url-safe cursor"""
+    raw = json.dumps(
+        [v.isoformat() if isinstance(v, datetime) else v for v in values],
+        separators=(",", ":"),
+    )
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, *types):
+    """Decode cursor created by encode_cursor, converting values to given types"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, list) or len(values) != len(types):
+            raise PaginationError("Invalid cursor")
+        return tuple(
+            datetime.fromisoformat(v) if t is datetime else t(v)
+            for v, t in zip(values, types)
+        )
+    except (TypeError, ValueError) as e:
+        raise PaginationError("Invalid cursor") from e
+
+
+def page_args(*types, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    """Read limit and after query parameters from current request
+
+    Returns (limit, after) where after is None or a decoded cursor tuple.
+    Limit is capped at maximum so one request can't fetch the whole table.
+    """
+    limit = request.args.get("limit", default, type=int)
+    if limit is None or limit < 1:
+        raise PaginationError("Invalid limit")
+    limit = min(limit, maximum)
+
+    after = request.args.get("after")
+    if after:
+        after = decode_cursor(after, *types)
+    else:
+        after = None
+    return limit, after
+
+
+def fields_arg(allowed, default):
+    """Read comma separated fields query parameter, allowing only given fields"""
+    fields = request.args.get("fields")
+    if not fields:
+        return default
+    fields = tuple(fields.split(","))
+    for field in fields:
+        if field not in allowed:
+            raise PaginationError("Unknown field: " + field)
+    return fields
+
+
+def set_next_cursor(response, cursor):
+    """Attach next page cursor to response headers, list bodies stay unchanged"""
+    if cursor:
+        response.headers["X-Next-Cursor"] = cursor
+    return response
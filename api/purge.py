@@ -0,0 +1,126 @@
+"""Chunked deletion of users with long post histories
+
+Deleting user cascades to all their posts in one statement, which holds
+SQLite write lock until every post and its search index entry is gone.
+Purge deletes posts PURGE_CHUNK_SIZE at a time, each chunk in its own
+short transaction with PURGE_PAUSE seconds between them so other writers
+get the lock, and deletes the user last. Purges run as background jobs,
+so they survive restarts and failed ones are retried.
+"""
+import threading
+import time
+
+from flask import current_app
+
+from .cache import user_cache
+from .feed import feed
+from .jobs import Job, job_queue
+from .models import Post, User, db
+
+
+def delete_posts_chunk(user_id, size):
+    """Delete up to size posts of user, return number of deleted posts"""
+    ids = db.select(Post.id).where(Post.author == user_id).limit(size)
+    result = db.session.execute(
+        Post.__table__.delete().where(Post.id.in_(ids.scalar_subquery()))
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def purge_user(user_id, username, chunk_size=1000, pause=0.0):
+    """Delete posts of user chunk by chunk, then the user
+
+    Returns number of deleted posts. Posts written meanwhile are removed by
+    cascade together with the user.
+    """
+    deleted = 0
+    while True:
+        count = delete_posts_chunk(user_id, chunk_size)
+        deleted += count
+        if count < chunk_size:
+            break
+        time.sleep(pause)
+    db.session.execute(User.__table__.delete().where(User.id == user_id))
+    db.session.commit()
+    user_cache.invalidate(user_id, username)
+    feed.forget_user(user_id)
+    return deleted
+
+
+class _PurgerState:
+    def __init__(self, app):
+        self.app = app
+        self.lock = threading.Lock()
+        self.purged_users = 0
+        self.purged_posts = 0
+        self.failed_users = 0
+
+    @property
+    def chunk_size(self):
+        return self.app.config.get("PURGE_CHUNK_SIZE", 1000)
+
+    @property
+    def pause(self):
+        return self.app.config.get("PURGE_PAUSE", 0.01)
+
+
+@job_queue.handler("purge_user")
+def purge_job(payload):
+    state = user_purger._state
+    try:
+        posts = purge_user(
+            payload["user_id"], payload["username"], state.chunk_size, state.pause
+        )
+    except Exception:
+        with state.lock:
+            state.failed_users += 1
+        raise
+    with state.lock:
+        state.purged_users += 1
+        state.purged_posts += posts
+
+
+class UserPurger:
+    """Background deletion of users in chunks of posts"""
+
+    def init_app(self, app):
+        app.extensions["user_purger"] = _PurgerState(app)
+
+    @property
+    def _state(self):
+        return current_app.extensions["user_purger"]
+
+    def purge(self, user_id, username):
+        """Purge user in calling thread, return number of deleted posts"""
+        state = self._state
+        return purge_user(user_id, username, state.chunk_size, state.pause)
+
+    def submit(self, user_id, username):
+        """Queue job purging user, repeated submits of the same user are ignored"""
+        job_queue.enqueue(
+            "purge_user",
+            {"user_id": user_id, "username": username},
+            key=f"purge_user:{user_id}",
+        )
+        db.session.commit()
+
+    def flush(self):
+        """Run queued purges and other due jobs in calling thread"""
+        job_queue.run_pending()
+
+    def metrics(self):
+        state = self._state
+        with state.lock:
+            metrics = {
+                "purged_users": state.purged_users,
+                "purged_posts": state.purged_posts,
+                "failed_users": state.failed_users,
+            }
+        metrics["queue_depth"] = db.session.scalar(
+            db.select(db.func.count()).select_from(Job).where(Job.name == "purge_user")
+        )
+        return metrics
+
+
+user_purger = UserPurger()
@@ -0,0 +1,93 @@
+"""Queries of each access pattern of views
+
+Pages and JSON responses select only needed columns. Where ORM objects
+with related rows are needed, relationship is loaded with one of LOADING
+strategies, lazy loading raises instead of running query per object.
+"""
+from sqlalchemy.orm import joinedload, selectinload
+
+from .models import Post, User, db
+from .pagination import encode_cursor
+
+# columns that can be requested with ?fields=, password hash is never listed
+USER_FIELDS = ("id", "username", "email", "date_created")
+USER_DEFAULT_FIELDS = ("id", "username", "email")
+POST_FIELDS = ("id", "text")
+SEARCH_FIELDS = ("id", "text", "date_created")
+USER_POST_FIELDS = ("id", "text", "date_created")
+
+
+def users_page(fields, limit, after=None):
+    """Select requested user columns (and id for cursor) ordered by id"""
+    columns = [User.id] + [getattr(User, field) for field in fields if field != "id"]
+    query = db.select(*columns)
+    if after:
+        query = query.where(User.id > after[0])
+    # one extra row tells if there is another page
+    return query.order_by(User.id).limit(limit + 1)
+
+
+def posts_page(limit=None, after=None, author=None):
+    """Select posts newest first using keyset condition on (date_created, id)
+
+    With author only posts of that user are selected, by author index.
+    """
+    query = db.select(Post.id, Post.text, Post.date_created)
+    if author is not None:
+        query = query.where(Post.author == author)
+    if after:
+        date_created, post_id = after
+        # leading <= lets SQLite seek in index, OR alone scans all of it
+        query = query.where(
+            Post.date_created <= date_created,
+            db.or_(Post.date_created < date_created, Post.id < post_id),
+        )
+    query = query.order_by(Post.date_created.desc(), Post.id.desc())
+    if limit:
+        query = query.limit(limit + 1)
+    return query
+
+
+def posts_by_ids(ids):
+    """Select posts with given ids and their author names, by primary key"""
+    return (
+        db.select(Post.id, Post.text, Post.date_created, User.username.label("author"))
+        .join(User, User.id == Post.author)
+        .where(Post.id.in_(ids))
+    )
+
+
+# joined adds related columns to the same query, selectin runs one more
+# IN query for all related rows, better for collections of many rows
+LOADING = {"joined": joinedload, "selectin": selectinload}
+
+
+def posts_with_authors(ids, loading="joined"):
+    """Select Post objects with given ids and username of their user loaded"""
+    loader = LOADING[loading](Post.user).load_only(User.username)
+    return db.select(Post).options(loader).where(Post.id.in_(ids))
+
+
+def users_with_posts(usernames, loading="selectin"):
+    """Select User objects with given usernames and their posts loaded"""
+    loader = LOADING[loading](User.posts).load_only(Post.text, Post.date_created)
+    return db.select(User).options(loader).where(User.username.in_(usernames))
+
+
+def post_counters(user_id):
+    """Select denormalized post_count and last_post_at of user"""
+    return db.select(User.post_count, User.last_post_at).where(User.id == user_id)
+
+
+def user_by_username(username, fields=USER_DEFAULT_FIELDS):
+    """Select requested user columns of user with username"""
+    columns = [getattr(User, field) for field in fields]
+    return db.select(*columns).where(User.username == username)
+
+
+def split_page(rows, limit, *key):
+    """Cut extra row fetched by page query, return rows and next page cursor"""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(*(getattr(rows[-1], column) for column in key))
@@ -0,0 +1,271 @@
+"""Rate limiting and admission control of write and auth endpoints
+
+Every limited endpoint has token bucket per client IP and, when request
+has a user, per user. Buckets hold up to burst tokens refilled at rate
+tokens per second, request takes one token from each. Buckets live in
+worker memory or, with RATELIMIT_STORAGE set to file path, in SQLite file
+shared by all workers on the host, in directory only the server user can
+access. Endpoint can also cap requests running
+at once in worker, requests over cap are shed right away instead of
+queueing behind SQLite writer or password hashing. Streamed responses hold
+their slot until body is sent. Rejected requests get 429 with Retry-After.
+
+Limits given to limiter.limit can be changed per endpoint with RATELIMITS
+config, e.g. {"create_post": {"rate": 10, "burst": 50}}, and
+RATELIMIT_ENABLED set to False turns limiting off.
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from functools import wraps
+
+from flask import Response, current_app, request
+from flask_login import current_user
+
+from .cache import private_directory
+
+
+class RateLimitExceeded(Exception):
+    """Raised when request is over rate limit or concurrency cap"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class MemoryBucketStore:
+    """Token buckets of one worker, least recently used are dropped"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, key, rate, burst, now=None):
+        """Take token from bucket, return 0 or seconds until one is available"""
+        now = time.time() if now is None else now
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            self.buckets[key] = (tokens, now)
+            # dropped buckets start full again
+            while len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+            return wait
+
+    def clear(self):
+        with self.lock:
+            self.buckets.clear()
+
+
+class SQLiteBucketStore:
+    """Token buckets in SQLite file shared by workers on one host
+
+    Taking token is single upsert, so concurrent workers can't both take
+    the last one. Buckets are throwaway state, file is not synced to disk.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        # buckets of other user's file could be forged to lock clients out
+        private_directory(os.path.dirname(os.path.abspath(path)))
+        with self.connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limit_buckets "
+                "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+
+    def connect(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=OFF")
+            self.local.connection = connection
+        return connection
+
+    def take(self, key, rate, burst, now=None):
+        """Take token from bucket, return 0 or seconds until one is available"""
+        now = time.time() if now is None else now
+        connection = self.connect()
+        refilled = "min(:burst, tokens + (:now - updated) * :rate)"
+        taken = connection.execute(
+            "INSERT INTO rate_limit_buckets (key, tokens, updated) "
+            "VALUES (:key, :burst - 1, :now) "
+            f"ON CONFLICT (key) DO UPDATE SET tokens = {refilled} - 1, updated = :now "
+            f"WHERE {refilled} >= 1",
+            {"key": key, "rate": rate, "burst": burst, "now": now},
+        ).rowcount
+        if taken:
+            return 0.0
+        row = connection.execute(
+            f"SELECT {refilled} FROM rate_limit_buckets WHERE key = :key",
+            {"key": key, "rate": rate, "burst": burst, "now": now},
+        ).fetchone()
+        return (1 - row[0]) / rate if row else 0.0
+
+    def clear(self):
+        self.connect().execute("DELETE FROM rate_limit_buckets")
+
+
+class _RateLimitState:
+    def __init__(self, app):
+        self.app = app
+        path = app.config.get("RATELIMIT_STORAGE")
+        self.store = SQLiteBucketStore(path) if path else MemoryBucketStore()
+        self.lock = threading.Lock()
+        self.slots = {}
+        self.limited = Counter()
+        self.shed = Counter()
+
+    def limits(self, name, defaults):
+        limits = dict(defaults)
+        limits.update(self.app.config.get("RATELIMITS", {}).get(name, {}))
+        return limits
+
+    def get_slots(self, name, concurrency):
+        with self.lock:
+            if name not in self.slots:
+                self.slots[name] = threading.BoundedSemaphore(concurrency)
+            return self.slots[name]
+
+
+class _ReleasingIterable:
+    """Response body that releases concurrency slot once sent or closed"""
+
+    def __init__(self, iterable, slots):
+        self.iterable = iterable
+        self.slots = slots
+        self.released = False
+
+    def __iter__(self):
+        try:
+            yield from self.iterable
+        finally:
+            self.close()
+
+    def close(self):
+        if not self.released:
+            self.released = True
+            self.slots.release()
+            if hasattr(self.iterable, "close"):
+                self.iterable.close()
+
+
+def _default_user_key():
+    if current_user and current_user.is_authenticated:
+        return current_user.get_id()
+    return None
+
+
+class RateLimiter:
+    """Token bucket rate limits and concurrency caps for views"""
+
+    def init_app(self, app):
+        app.extensions["rate_limiter"] = _RateLimitState(app)
+
+    @property
+    def _state(self):
+        return current_app.extensions["rate_limiter"]
+
+    def check(self, name, rate, burst, user_key=None):
+        """Take token of client IP and user, raise RateLimitExceeded if empty"""
+        state = self._state
+        keys = [f"{name}:ip:{request.remote_addr}"]
+        user = (user_key or _default_user_key)()
+        if user:
+            keys.append(f"{name}:user:{user}")
+        wait = max(state.store.take(key, rate, burst) for key in keys)
+        if wait:
+            with state.lock:
+                state.limited[name] += 1
+            raise RateLimitExceeded("Too many requests", wait)
+
+    def admit(self, name, concurrency):
+        """Return acquired slot of endpoint, raise RateLimitExceeded when full"""
+        state = self._state
+        slots = state.get_slots(name, concurrency)
+        if not slots.acquire(blocking=False):
+            with state.lock:
+                state.shed[name] += 1
+            raise RateLimitExceeded("Server is busy, try again later", 1)
+        return slots
+
+    def limit(
+        self,
+        name,
+        rate,
+        burst,
+        concurrency=None,
+        methods=("POST",),
+        user_key=None,
+    ):
+        """Limit view to rate requests per second per IP and user
+
+        Burst requests can come at once, at most concurrency requests run at
+        once in worker. user_key returns user to limit by, default is
+        logged in user. Requests with other methods are not limited.
+        """
+
+        def enter():
+            if not current_app.config.get("RATELIMIT_ENABLED", True):
+                return None
+            if request.method not in methods:
+                return None
+            limits = self._state.limits(
+                name, {"rate": rate, "burst": burst, "concurrency": concurrency}
+            )
+            self.check(name, limits["rate"], limits["burst"], user_key)
+            if limits["concurrency"]:
+                return self.admit(name, limits["concurrency"])
+            return None
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                slots = enter()
+                try:
+                    response = view(*args, **kwargs)
+                except BaseException:
+                    if slots:
+                        slots.release()
+                    raise
+                if slots:
+                    if isinstance(response, Response) and response.is_streamed:
+                        # streamed body does its work after view returns
+                        response.response = _ReleasingIterable(response.response, slots)
+                    else:
+                        slots.release()
+                return response
+
+            return wrapper
+
+        return decorator
+
+    def clear(self):
+        self._state.store.clear()
+
+    def metrics(self):
+        state = self._state
+        with state.lock:
+            return {
+                "limited_requests": sum(state.limited.values()),
+                "shed_requests": sum(state.shed.values()),
+            }
+
+
+def retry_after(e):
+    """Retry-After header value of RateLimitExceeded, whole seconds"""
+    return str(max(1, math.ceil(e.retry_after)))
+
+
+limiter = RateLimiter()
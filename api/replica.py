@@ -0,0 +1,119 @@
+"""SQLite snapshot of primary database used as read replica
+
+With SQLALCHEMY_BINDS["replica"] set to SQLite file and SNAPSHOT_INTERVAL
+set, refresh_snapshot job copies primary to that file with SQLite backup
+API every SNAPSHOT_INTERVAL seconds. Copy is made next to it and renamed
+over it, so readers never see half copied file, and its modification time
+is set to start of copy, which RoutingSession compares with time of last
+write of client for read-your-writes. First request of every worker
+schedules the job, key makes one worker refresh snapshot for all.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import SQLAlchemyError
+
+from .database import REPLICA_BIND
+from .instrumentation import untimed
+from .jobs import job_queue
+from .models import db
+
+logger = logging.getLogger(__name__)
+
+
+def refresh_snapshot(app):
+    """Copy primary database to replica file, return seconds it took"""
+    source_path = make_url(app.config["SQLALCHEMY_DATABASE_URI"]).database
+    path = make_url(app.config["SQLALCHEMY_BINDS"][REPLICA_BIND]).database
+    started = time.time()
+    temporary = f"{path}.{os.getpid()}.tmp"
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(temporary)
+    try:
+        source.backup(target)
+        # readers open snapshot read-only, WAL would need writable -shm file
+        target.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        target.close()
+        source.close()
+    os.utime(temporary, (started, started))
+    os.replace(temporary, path)
+    # pooled connections still read old file, in other workers they are
+    # dropped on checkout
+    db.get_replica_engine(app).dispose()
+    return time.time() - started
+
+
+class _ReplicaState:
+    def __init__(self, app):
+        self.app = app
+        self.lock = threading.Lock()
+        self.scheduled = False
+        self.refreshes = 0
+        self.refresh_seconds = 0.0
+
+    @property
+    def interval(self):
+        return self.app.config.get("SNAPSHOT_INTERVAL")
+
+
+@job_queue.handler("refresh_snapshot")
+def refresh_job(payload):
+    state = replica._state
+    seconds = refresh_snapshot(state.app)
+    with state.lock:
+        state.refreshes += 1
+        state.refresh_seconds = seconds
+    # saved together with deletion of this job
+    job_queue.enqueue("refresh_snapshot", key="refresh_snapshot", delay=state.interval)
+
+
+class Replica:
+    """Periodic refresh of snapshot replica"""
+
+    def init_app(self, app):
+        app.extensions["replica"] = _ReplicaState(app)
+        app.before_request(self._schedule)
+
+    @property
+    def _state(self):
+        return current_app.extensions["replica"]
+
+    def _schedule(self):
+        state = self._state
+        if state.scheduled or not state.interval:
+            return
+        with state.lock:
+            if state.scheduled:
+                return
+            state.scheduled = True
+        # own transaction, request session would count it as write of client,
+        # and not part of query budget of request that happens to be first
+        try:
+            with untimed(), db.engine.begin() as connection:
+                job_queue.enqueue(
+                    "refresh_snapshot", key="refresh_snapshot", connection=connection
+                )
+        except SQLAlchemyError as e:
+            logger.warning("Failed to schedule snapshot refresh: %s", e)
+            state.scheduled = False
+
+    def metrics(self):
+        state = self._state
+        if db.get_replica_engine(state.app) is None:
+            return {}
+        synced_at = db.replica_synced_at(state.app)
+        with state.lock:
+            return {
+                "refreshes": state.refreshes,
+                "refresh_seconds": state.refresh_seconds,
+                "lag_seconds": time.time() - synced_at if synced_at else -1,
+            }
+
+
+replica = Replica()
@@ -1,33 +1,115 @@
+import json
+from datetime import datetime
+import click
+from .bulk import import_users, read_records
+from .cache import user_cache
+from .feed import feed, in_order
+from .hashing import password_hasher
+from .http_cache import compress_response, conditional
+from .ingest import FlushError, QueueFullError, post_writer, ACK_ON_FLUSH
+from .instrumentation import instrumentation
+from .jobs import job_queue
+from .migrations import create_schema, migrate
 from .models import User, Post, db
-from ..frontend.forms import SignUpForm, AddPostForm
-from flask import Blueprint, jsonify
+from .purge import user_purger
+from .ratelimit import limiter
+from .pagination import (
+    PaginationError,
+    encode_cursor,
+    fields_arg,
+    page_args,
+    set_next_cursor,
+)
+from .queries import (
+    USER_DEFAULT_FIELDS,
+    USER_FIELDS,
+    POST_FIELDS,
+    SEARCH_FIELDS,
+    USER_POST_FIELDS,
+    post_counters,
+    posts_by_ids,
+    posts_page,
+    split_page,
+    user_by_username,
+    users_page,
+)
+from .search import match_expression, rebuild, search_posts
+from .serializers import json_response, ndjson_chunk, row_serializer
+from flask import (
+    Blueprint,
+    Response,
+    jsonify,
+    request,
+    stream_with_context,
+)
 from flask_login import login_required
-from werkzeug.security import generate_password_hash
+from sqlalchemy.exc import IntegrityError
 
 api = Blueprint("api", __name__, url_prefix="/api")
+api.after_request(compress_response)
+
+# number of rows fetched from DB cursor at once in streaming mode
+STREAM_CHUNK_SIZE = 1000
+
+
+@api.errorhandler(PaginationError)
+def handle_pagination_error(e):
+    """Return 400 on malformed limit or cursor"""
+    return jsonify({"status": "error", "message": str(e)}), 400
+
+
+USER_MAX_PAGE_SIZE = 500
 
 
 @api.route("/users/all")
+@instrumentation.query_budget(3)
 @login_required
+@conditional("user", private=True)
 def get_all_users():
-    """Route that returns all users from DB"""
-    users = User.query.all()
-    return jsonify(users)
+    """Route that returns one page of users ordered by id
+
+    Use ?fields=id,username to select columns, ?limit= and ?after= with cursor
+    from X-Next-Cursor header to get next page.
+    """
+    fields = fields_arg(USER_FIELDS, USER_DEFAULT_FIELDS)
+    limit, after = page_args(int, maximum=USER_MAX_PAGE_SIZE)
+    # select only requested columns, no ORM instances
+    query = users_page(fields, limit, after)
+    rows = db.session.execute(query).all()
+    rows, next_cursor = split_page(rows, limit, "id")
+    serialize = row_serializer(query, fields)
+    response = json_response([serialize(row) for row in rows])
+    return set_next_cursor(response, next_cursor)
 
 
 @api.route("/users/<username>")
+@instrumentation.query_budget(2)
+@conditional("user")
 def get_user(username):
-    """Route that returns user if they exist"""
-    user = User.query.filter_by(username=username).first()
-    if user:
-        return jsonify(user), 200
+    """Route that returns user if they exist, ?fields= selects columns"""
+    fields = fields_arg(USER_FIELDS, USER_DEFAULT_FIELDS)
+    # not from user_cache, body must match ETag from DB versions
+    query = user_by_username(username, fields)
+    row = db.session.execute(query).first()
+    if row:
+        return json_response(row_serializer(query)(row))
     else:
         return {}, 204
 
 
+@api.route("/users/cache/metrics")
+def user_cache_metrics():
+    """Route that returns user cache hit and miss counters"""
+    return jsonify(user_cache.metrics())
+
+
 @api.route("/users/add_user", methods=["POST"])
+@limiter.limit("add_user", rate=0.1, burst=10, concurrency=4)
 def add_user(data=None):
     """Route to validate user data and add user"""
+    # forms pull in wtforms, email_validator and dnspython, loaded on first use
+    from ..frontend.forms import SignUpForm
+
     form = SignUpForm()
 
     # check if there is data in request
@@ -58,25 +140,120 @@ def add_user(data=None):
         )
 
     # create new user and save them in DB
-    hashed_password = generate_password_hash(form.password.data, method="sha256")
+    hashed_password = password_hasher.hash(form.password.data)
     new_user = User(
         email=form.email.data, username=form.username.data, password=hashed_password
     )
     db.session.add(new_user)
     db.session.commit()
+    user_cache.invalidate(new_user.id, new_user.username)
     return (
         jsonify({"status": "success", "message": "User added successfully"}),
         200,
     )
 
 
+@api.route("/users/bulk", methods=["POST"])
+@login_required
+@limiter.limit("add_users_bulk", rate=0.05, burst=5, concurrency=2)
+def add_users_bulk():
+    """Route that imports users from csv, ndjson or json list body
+
+    Result of every row is streamed back as NDJSON line.
+    """
+    if request.mimetype == "text/csv":
+        records = read_records(request.stream, "csv")
+    elif request.mimetype == "application/json":
+        records = request.get_json(silent=True)
+        if not isinstance(records, list):
+            return (
+                jsonify({"status": "error", "message": "Expected list of users"}),
+                400,
+            )
+    else:
+        records = read_records(request.stream, "ndjson")
+
+    results = import_users(records)
+    return Response(
+        stream_with_context(json.dumps(result) + "\n" for result in results),
+        mimetype="application/x-ndjson",
+    )
+
+
+@api.cli.command("import-users")
+@click.argument("file", type=click.File("rb"))
+@click.option("--format", "fmt", type=click.Choice(["csv", "ndjson"]), default=None)
+def import_users_command(file, fmt):
+    """Import users from csv or ndjson FILE"""
+    if not fmt:
+        fmt = "csv" if file.name.endswith(".csv") else "ndjson"
+    added = failed = 0
+    for result in import_users(read_records(file, fmt)):
+        if result["status"] == "success":
+            added += 1
+        else:
+            failed += 1
+            click.echo(f"row {result['row']}: {result['message']}", err=True)
+    click.echo(f"Added {added} users, {failed} failed")
+
+
+@api.cli.command("init-db")
+def init_db_command():
+    """Create tables of new DB and mark all migrations as applied"""
+    create_schema()
+    click.echo("Database created")
+
+
+@api.cli.command("migrate")
+def migrate_command():
+    """Apply pending schema migrations"""
+    applied = migrate()
+    if applied:
+        click.echo("Applied migrations: " + ", ".join(map(str, applied)))
+    else:
+        click.echo("Database is up to date")
+
+
+@api.cli.command("rebuild-search")
+def rebuild_search_command():
+    """Rebuild full-text search index of posts"""
+    with db.engine.begin() as connection:
+        rebuild(connection)
+    click.echo("Search index rebuilt")
+
+
+@api.cli.command("run-jobs")
+def run_jobs_command():
+    """Run background jobs until interrupted, for dedicated worker processes"""
+    click.echo("Running jobs")
+    try:
+        job_queue.run_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+@api.cli.command("purge-user")
+@click.argument("username")
+def purge_user_command(username):
+    """Delete user and their posts in chunks of PURGE_CHUNK_SIZE"""
+    user = user_cache.get_by_username(username)
+    if not user:
+        raise click.ClickException("User doesn't exist")
+    posts = user_purger.purge(user.id, username)
+    click.echo(f"Deleted user {username} and {posts} posts")
+
+
 @api.route("/users/delete_user/<username>")
 def delete_user(username):
     """Route that deletes user if they exist"""
-    user = User.query.filter_by(username=username).first()
+    user = user_cache.get_by_username(username)
     if user:
-        db.session.delete(user)
+        user_id = user.id
+        # posts go in the same statement by ON DELETE CASCADE, not through ORM
+        db.session.execute(User.__table__.delete().where(User.id == user_id))
         db.session.commit()
+        user_cache.invalidate(user_id, username)
+        feed.forget_user(user_id)
         return (
             jsonify({"status": "success", "message": "User deleted successfully"}),
             200,
@@ -88,16 +265,155 @@ def delete_user(username):
         )
 
 
+@api.route("/users/purge_user/<username>")
+def purge_user(username):
+    """Route that queues deletion of user with many posts in chunks"""
+    user = user_cache.get_by_username(username)
+    if not user:
+        return (
+            jsonify({"status": "error", "message": "User doesn't exist"}),
+            404,
+        )
+    user_purger.submit(user.id, username)
+    return jsonify({"status": "success", "message": "User purge queued"}), 202
+
+
 @api.route("/posts/all")
+@instrumentation.query_budget(2)
+@conditional("post")
 def get_all_posts():
-    """Route that returns all posts from DB"""
-    posts = Post.query.all()
-    return jsonify(posts)
+    """Route that returns one page of posts, newest first
+
+    Use ?limit= and ?after= with cursor from X-Next-Cursor header to get next
+    page. With ?stream=1 all posts after cursor are sent as NDJSON.
+    """
+    if request.args.get("stream", type=int):
+        return stream_posts()
+
+    limit, after = page_args(datetime, int)
+    query = posts_page(limit, after)
+    rows = db.session.execute(query).all()
+    rows, next_cursor = split_page(rows, limit, "date_created", "id")
+    serialize = row_serializer(query, POST_FIELDS)
+    response = json_response([serialize(row) for row in rows])
+    return set_next_cursor(response, next_cursor)
+
+
+def stream_posts():
+    """Stream posts as NDJSON from server-side cursor in constant memory"""
+    _, after = page_args(datetime, int)
+    query = posts_page(after=after)
+    serialize = row_serializer(query, POST_FIELDS)
+
+    def generate():
+        result = db.session.execute(query, execution_options={"stream_results": True})
+        for rows in result.partitions(STREAM_CHUNK_SIZE):
+            yield ndjson_chunk(rows, serialize)
+        result.close()
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+SEARCH_MAX_PAGE_SIZE = 100
+
+
+USER_POSTS_MAX_PAGE_SIZE = 100
+
+
+@api.route("/users/<username>/posts")
+@instrumentation.query_budget(4)
+@conditional("user", "post")
+def get_user_posts(username):
+    """Route that returns one page of posts of user, newest first
+
+    Use ?limit= and ?after= with cursor from X-Next-Cursor header to get next
+    page. X-Total-Count header has number of posts of user.
+    """
+    user = user_cache.get_by_username(username)
+    if not user:
+        return (
+            jsonify({"status": "error", "message": "User doesn't exist"}),
+            404,
+        )
+    limit, after = page_args(
+        datetime, int, default=20, maximum=USER_POSTS_MAX_PAGE_SIZE
+    )
+    query = posts_page(limit, after, author=user.id)
+    rows = db.session.execute(query).all()
+    rows, next_cursor = split_page(rows, limit, "date_created", "id")
+    serialize = row_serializer(query, USER_POST_FIELDS)
+    response = json_response([serialize(row) for row in rows])
+    counters = db.session.execute(post_counters(user.id)).one()
+    response.headers["X-Total-Count"] = str(counters.post_count)
+    return set_next_cursor(response, next_cursor)
+
+
+@api.route("/posts/search")
+@instrumentation.query_budget(1)
+def search():
+    """Route that returns posts matching all words of ?q=, best match first
+
+    Use ?limit= and ?after= with cursor from X-Next-Cursor header to get next
+    page.
+    """
+    expression = match_expression(request.args.get("q"))
+    # return error if there is nothing to search for
+    if not expression:
+        return (
+            jsonify({"status": "error", "message": "Search query cannot be empty"}),
+            400,
+        )
+    limit, after = page_args(float, int, default=20, maximum=SEARCH_MAX_PAGE_SIZE)
+    query = search_posts(expression, limit, after)
+    rows = db.session.execute(query).all()
+    rows, next_cursor = split_page(rows, limit, "rank", "id")
+    serialize = row_serializer(query, SEARCH_FIELDS)
+    response = json_response([serialize(row) for row in rows])
+    return set_next_cursor(response, next_cursor)
+
+
+FEED_MAX_PAGE_SIZE = 100
+
+
+def feed_page(author=None):
+    """Serve one page of feed timeline, cursor is id of last post"""
+    limit, after = page_args(int, default=20, maximum=FEED_MAX_PAGE_SIZE)
+    ids, next_id = feed.page(limit, after[0] if after else None, author)
+    if not ids:
+        return json_response([])
+    query = posts_by_ids(ids)
+    rows = in_order(db.session.execute(query), ids)
+    serialize = row_serializer(query)
+    response = json_response([serialize(row) for row in rows])
+    return set_next_cursor(response, next_id and encode_cursor(next_id))
+
+
+@api.route("/posts/feed")
+@instrumentation.query_budget(2)
+def get_feed():
+    """Route that returns recent posts of everyone from precomputed feed"""
+    return feed_page()
+
+
+@api.route("/users/<username>/feed")
+@instrumentation.query_budget(4)
+def get_user_feed(username):
+    """Route that returns recent posts of user from precomputed feed"""
+    user = user_cache.get_by_username(username)
+    if not user:
+        return (
+            jsonify({"status": "error", "message": "User doesn't exist"}),
+            404,
+        )
+    return feed_page(user.id)
 
 
 @api.route("/posts/create_post", methods=["POST"])
+@limiter.limit("create_post", rate=2, burst=20, concurrency=8)
 def create_post(data=None, user_id=None):
     """Route to validate post data and add user"""
+    from ..frontend.forms import AddPostForm
+
     form = AddPostForm()
 
     # check if there is data in request
@@ -120,9 +436,86 @@ def create_post(data=None, user_id=None):
     if form.author.data:
         new_post = Post(text=form.text.data, author=form.author.data)
     db.session.add(new_post)
+    try:
+        db.session.flush()
+    except IntegrityError:
+        # foreign key of author failed
+        db.session.rollback()
+        return (
+            jsonify({"status": "error", "message": "User doesn't exist"}),
+            404,
+        )
+    posted = (new_post.id, int(new_post.author))
     db.session.commit()
+    feed.add_posts([posted])
 
     return (
         jsonify({"status": "success", "message": "Post added successfully"}),
         200,
     )
+
+
+@api.route("/posts/bulk", methods=["POST"])
+@limiter.limit("create_posts_bulk", rate=1, burst=20, concurrency=4)
+def create_posts_bulk():
+    """Route that queues list of posts for batched insert
+
+    Returns 202 when posts are only queued and 200 when app is configured
+    to acknowledge after posts are committed.
+    """
+    posts = request.get_json(silent=True)
+    if not isinstance(posts, list):
+        return (
+            jsonify({"status": "error", "message": "Expected list of posts"}),
+            400,
+        )
+
+    rows = []
+    for post in posts:
+        if not isinstance(post, dict) or not post.get("text"):
+            return (
+                jsonify({"status": "error", "message": "Post text cannot be empty"}),
+                400,
+            )
+        if not isinstance(post["text"], str):
+            return (
+                jsonify({"status": "error", "message": "Post text must be string"}),
+                400,
+            )
+        # bool is int too, true would be saved as post of user 1
+        author = post.get("author")
+        if not isinstance(author, int) or isinstance(author, bool):
+            return (
+                jsonify({"status": "error", "message": "User id missing"}),
+                400,
+            )
+        rows.append({"text": post["text"], "author": post["author"]})
+
+    # return error if author doesn't exist, it would fail flush of other posts
+    authors = {row["author"] for row in rows}
+    found = db.session.scalars(db.select(User.id).where(User.id.in_(authors))).all()
+    if len(found) < len(authors):
+        return (
+            jsonify({"status": "error", "message": "User doesn't exist"}),
+            404,
+        )
+
+    try:
+        post_writer.submit(rows)
+    except QueueFullError as e:
+        return jsonify({"status": "error", "message": str(e)}), 503
+    except FlushError as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+    if post_writer.ack == ACK_ON_FLUSH:
+        return (
+            jsonify({"status": "success", "message": "Posts added successfully"}),
+            200,
+        )
+    return jsonify({"status": "success", "message": "Posts queued"}), 202
+
+
+@api.route("/posts/bulk/metrics")
+def post_queue_metrics():
+    """Route that returns write-behind queue depth and flush latency"""
+    return jsonify(post_writer.metrics())
@@ -0,0 +1,136 @@
+"""Full-text search over posts with SQLite FTS5
+
+post_search is external content FTS5 table indexing post.text. Triggers on
+post put new posts to post_search_pending and enqueue index_posts job in
+the same transaction, so writing posts costs the same whatever is indexed.
+The job adds up to INDEX_CHUNK_SIZE pending posts to index and enqueues
+itself again while more wait, so backlog never holds write lock for long.
+Search finds new posts after it runs. Deletes and updates of indexed posts
+update index right away. Results are ranked with bm25, best match first.
+"""
+import re
+
+from sqlalchemy import DDL, event
+
+from .jobs import job_queue, job_sql
+from .models import Post, db
+
+PENDING = "SELECT 1 FROM post_search_pending WHERE post_id = old.id"
+
+# pending posts indexed by one job in one transaction
+INDEX_CHUNK_SIZE = 1000
+
+SEARCH_TABLE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS post_search USING fts5("
+    "text, content='post', content_rowid='id', tokenize='porter unicode61')",
+    "CREATE TABLE IF NOT EXISTS post_search_pending "
+    "(post_id INTEGER NOT NULL PRIMARY KEY)",
+    "CREATE TRIGGER IF NOT EXISTS post_search_insert AFTER INSERT ON post BEGIN "
+    "INSERT INTO post_search_pending (post_id) VALUES (new.id); "
+    + job_sql("index_posts", key="index_posts")
+    + "; END",
+    # posts not indexed yet are only dropped from pending, FTS5 index would
+    # break on delete of row it doesn't have
+    "CREATE TRIGGER IF NOT EXISTS post_search_delete AFTER DELETE ON post BEGIN "
+    "INSERT INTO post_search (post_search, rowid, text) "
+    f"SELECT 'delete', old.id, old.text WHERE NOT EXISTS ({PENDING}); "
+    "DELETE FROM post_search_pending WHERE post_id = old.id; END",
+    "CREATE TRIGGER IF NOT EXISTS post_search_update AFTER UPDATE OF text ON post "
+    f"WHEN NOT EXISTS ({PENDING}) BEGIN "
+    "INSERT INTO post_search (post_search, rowid, text) "
+    "VALUES ('delete', old.id, old.text); "
+    "INSERT INTO post_search (rowid, text) VALUES (new.id, new.text); END",
+]
+
+# db.create_all creates search index together with post table
+for statement in SEARCH_TABLE_DDL:
+    event.listen(
+        Post.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite")
+    )
+event.listen(
+    Post.__table__,
+    "after_drop",
+    DDL("DROP TABLE IF EXISTS post_search").execute_if(dialect="sqlite"),
+)
+event.listen(
+    Post.__table__,
+    "after_drop",
+    DDL("DROP TABLE IF EXISTS post_search_pending").execute_if(dialect="sqlite"),
+)
+
+post_search = db.table(
+    "post_search", db.column("rowid"), db.column("post_search"), db.column("rank")
+)
+
+TERM_RE = re.compile(r"\w+")
+
+
+def match_expression(q):
+    """Turn user query into FTS5 query matching posts with all words
+
+    Words are quoted, so FTS5 operators and syntax in query are ignored.
+    Returns None when query has no words.
+    """
+    terms = TERM_RE.findall(q or "")
+    if not terms:
+        return None
+    return " ".join(f'"{term}"' for term in terms)
+
+
+def search_posts(expression, limit=None, after=None):
+    """Select posts matching FTS5 expression, best first, keyset on (rank, id)"""
+    query = (
+        db.select(Post.id, Post.text, Post.date_created, post_search.c.rank)
+        .select_from(post_search)
+        .join(Post, Post.id == post_search.c.rowid)
+        .where(post_search.c.post_search.op("MATCH")(expression))
+    )
+    if after:
+        rank, post_id = after
+        query = query.where(
+            db.or_(
+                post_search.c.rank > rank,
+                db.and_(post_search.c.rank == rank, Post.id > post_id),
+            )
+        )
+    query = query.order_by(post_search.c.rank, Post.id)
+    if limit:
+        query = query.limit(limit + 1)
+    return query
+
+
+@job_queue.handler("index_posts")
+def index_pending(payload):
+    """Add chunk of posts waiting in post_search_pending to search index"""
+    chunk = "SELECT post_id FROM post_search_pending ORDER BY post_id LIMIT :limit"
+    params = {"limit": INDEX_CHUNK_SIZE}
+    # write lock taken by first statement keeps chunk the same until commit
+    db.session.execute(
+        db.text(
+            "INSERT INTO post_search (rowid, text) SELECT id, text FROM post "
+            f"WHERE id IN ({chunk})"
+        ),
+        params,
+    )
+    db.session.execute(
+        db.text(f"DELETE FROM post_search_pending WHERE post_id IN ({chunk})"),
+        params,
+    )
+    left = db.session.execute(
+        db.text("SELECT EXISTS (SELECT 1 FROM post_search_pending)")
+    ).scalar()
+    if left:
+        # saved together with deletion of this job, runs in next transaction
+        job_queue.enqueue("index_posts", key="index_posts")
+
+
+def rebuild(connection):
+    """Rebuild whole search index from post table and merge its segments"""
+    connection.exec_driver_sql(
+        "INSERT INTO post_search (post_search) VALUES ('rebuild')"
+    )
+    # rebuild indexed pending posts too
+    connection.exec_driver_sql("DELETE FROM post_search_pending")
+    connection.exec_driver_sql(
+        "INSERT INTO post_search (post_search) VALUES ('optimize')"
+    )
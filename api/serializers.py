@@ -0,0 +1,75 @@
+"""Fast serialization of query rows to JSON
+
+Row serializers are generated once per column layout and turn result rows
+(plain tuples) straight into dicts, without ORM instances or dataclass
+reflection. JSON is encoded with orjson when it is installed and
+JSON_ORJSON is enabled, with stdlib json otherwise.
+"""
+import json
+from functools import lru_cache
+
+from flask import current_app
+from sqlalchemy import DateTime
+from werkzeug.http import http_date
+
+from .instrumentation import timed
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+
+@lru_cache(maxsize=256)
+def _compile(names, dates, fields):
+    """Generate function building dict of fields from row with given columns"""
+    items = []
+    for field in fields:
+        index = names.index(field)
+        value = f"row[{index}]"
+        if dates[index]:
+            # same format as Flask jsonify uses for datetimes
+            value = f"(None if row[{index}] is None else http_date(row[{index}]))"
+        items.append(f"{field!r}: {value}")
+    source = "def serialize(row):\n    return {" + ", ".join(items) + "}\n"
+    namespace = {"http_date": http_date}
+    exec(compile(source, f"<serializer {','.join(fields)}>", "exec"), namespace)
+    return namespace["serialize"]
+
+
+def row_serializer(statement, fields=None):
+    """Return function turning rows of select statement into dicts of fields
+
+    Fields default to all selected columns, in select order.
+    """
+    columns = statement.selected_columns
+    names = tuple(column.key for column in columns)
+    dates = tuple(isinstance(column.type, DateTime) for column in columns)
+    return _compile(names, dates, tuple(fields) if fields else names)
+
+
+def use_orjson():
+    return orjson is not None and current_app.config.get("JSON_ORJSON", True)
+
+
+def dumps(data):
+    """Encode data as compact JSON bytes"""
+    if use_orjson():
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":")).encode()
+
+
+def json_response(data, status=200):
+    """Build JSON response like jsonify, without going through JSONEncoder"""
+    with timed("serialization"):
+        body = dumps(data) + b"\n"
+    return current_app.response_class(body, status=status, mimetype="application/json")
+
+
+def ndjson_chunk(rows, serialize):
+    """Encode rows as newline delimited JSON bytes"""
+    if use_orjson():
+        return b"".join(orjson.dumps(serialize(row)) + b"\n" for row in rows)
+    return "".join(
+        json.dumps(serialize(row), separators=(",", ":")) + "\n" for row in rows
+    ).encode()
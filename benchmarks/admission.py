@@ -0,0 +1,82 @@
+"""Benchmark of read latency during signup burst with and without rate limits
+
+Serves app with threaded server, drives post reads from some clients and
+signups (password hashing and SQLite writes) from others at the same time.
+Run from directory containing the package, e.g.:
+
+    python -m RedditLo.benchmarks.admission --duration 5
+"""
+import argparse
+import itertools
+import os
+import tempfile
+import threading
+from urllib.parse import urlencode
+
+from .. import create_app
+from ..api.migrations import create_schema
+from ..api.models import db
+from .indexes import seed
+from .loadgen import format_stats, run_load, serve
+
+FORM = {"Content-Type": "application/x-www-form-urlencoded"}
+
+
+def run(uri, limited, readers, writers, duration):
+    """Return (read stats, write stats) of concurrent read and signup load"""
+    app = create_app(
+        {
+            "SQLALCHEMY_DATABASE_URI": uri,
+            "WTF_CSRF_ENABLED": False,
+            "RATELIMIT_ENABLED": limited,
+        }
+    )
+    server, url = serve(app)
+    unique = itertools.count()
+
+    def signup():
+        i = f"{limited:d}{next(unique)}"
+        fields = {"username": f"s{i}", "email": f"s{i}@test.com", "password": "x" * 8}
+        return "POST", "/api/users/add_user", urlencode(fields), FORM
+
+    results = {}
+
+    def writes():
+        results["writes"] = run_load(url, [signup], writers, duration)
+
+    thread = threading.Thread(target=writes)
+    thread.start()
+    results["reads"] = run_load(url, ["/api/posts/all?limit=20"], readers, duration)
+    thread.join()
+    server.shutdown()
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+    return results["reads"], results["writes"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        uri = "sqlite:///" + os.path.join(tmp, "bench.db")
+        app = create_app({"SQLALCHEMY_DATABASE_URI": uri})
+        with app.app_context():
+            create_schema()
+            with db.engine.begin() as connection:
+                seed(connection, 1000, 10000)
+            db.engine.dispose()
+
+        for limited in (False, True):
+            reads, writes = run(uri, limited, args.readers, args.writers, args.duration)
+            label = "limited" if limited else "unlimited"
+            print(format_stats(f"reads {label}", reads))
+            print(format_stats(f"signups {label}", writes))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Benchmark of home feed read latency as number of posts grows
+
+Compares precomputed feed with indexed keyset query and OFFSET paging
+of the same page. Run from directory containing the package, e.g.:
+
+    python -m RedditLo.benchmarks.feed --posts 10000 100000 1000000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from .. import create_app
+from ..api.feed import feed
+from ..api.models import Post, db
+from ..api.queries import posts_page
+from .indexes import seed
+from .loadgen import percentile
+
+PAGE_SIZE = 20
+
+
+def latencies(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return sorted(timings)
+
+
+def run(posts, users=1000, repeat=200, depth=10):
+    """Return p50 and p99 in seconds of reading page at given depth per method"""
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app(
+            {"SQLALCHEMY_DATABASE_URI": "sqlite:///" + os.path.join(tmp, "bench.db")}
+        )
+        with app.app_context():
+            db.create_all()
+            with db.engine.begin() as connection:
+                seed(connection, users, posts)
+
+            # cursor of first post on page at given depth, same for all methods
+            offset = PAGE_SIZE * depth
+            ids, _ = feed.page(offset)
+            after = ids[-1] if ids else None
+            last = (
+                db.session.execute(posts_page(1).offset(offset - 1)).first()
+                if offset
+                else None
+            )
+
+            def feed_page():
+                page, _ = feed.page(PAGE_SIZE, after)
+                feed.posts(page)
+
+            def keyset_page():
+                query = posts_page(PAGE_SIZE, last and (last.date_created, last.id))
+                db.session.execute(query).all()
+
+            def offset_page():
+                query = (
+                    db.select(Post.id, Post.text, Post.date_created)
+                    .order_by(Post.date_created.desc(), Post.id.desc())
+                    .limit(PAGE_SIZE)
+                    .offset(offset)
+                )
+                db.session.execute(query).all()
+
+            results = {}
+            for name, func in (
+                ("feed", feed_page),
+                ("keyset", keyset_page),
+                ("offset", offset_page),
+            ):
+                timings = latencies(func, repeat)
+                results[name] = (percentile(timings, 0.5), percentile(timings, 0.99))
+            db.session.remove()
+            db.engine.dispose()
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--posts", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--depth", type=int, default=10, help="page number to read")
+    args = parser.parse_args()
+
+    print(f"{'posts':>10} {'method':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for posts in args.posts:
+        results = run(posts, args.users, args.repeat, args.depth)
+        for name, (p50, p99) in results.items():
+            print(f"{posts:>10} {name:>8} {p50 * 1000:>8.3f} {p99 * 1000:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
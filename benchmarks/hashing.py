@@ -0,0 +1,57 @@
+"""Benchmark of password checks (logins) per second at each hashing cost
+
+Run from directory containing the package, e.g.:
+
+    python -m RedditLo.benchmarks.hashing --iterations 50000 260000 600000
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+def logins_per_second(pwhash, seconds, pool=None, workers=1):
+    """Count password checks done in given time, in pool if given"""
+    done = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        if pool:
+            checks = [
+                pool.submit(check_password_hash, pwhash, "benchmark")
+                for _ in range(workers)
+            ]
+            done += sum(1 for future in checks if future.result())
+        else:
+            check_password_hash(pwhash, "benchmark")
+            done += 1
+    return done / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--iterations", type=int, nargs="+", default=[1000, 50000, 260000, 600000]
+    )
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--seconds", type=float, default=2)
+    args = parser.parse_args()
+
+    print(
+        f"{'iterations':>10} {'ms/login':>10} "
+        f"{'logins/s/core':>14} {'pool logins/s':>14}"
+    )
+    with ProcessPoolExecutor(args.workers) as pool:
+        for iterations in args.iterations:
+            pwhash = generate_password_hash("benchmark", f"pbkdf2:sha256:{iterations}")
+            single = logins_per_second(pwhash, args.seconds)
+            pooled = logins_per_second(pwhash, args.seconds, pool, args.workers)
+            print(
+                f"{iterations:>10} {1000 / single:>10.2f} "
+                f"{single:>14.1f} {pooled:>14.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
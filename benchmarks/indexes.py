@@ -0,0 +1,107 @@
+"""Benchmark of hot post queries before and after index migration
+
+Run from directory containing the package, e.g.:
+
+    python -m RedditLo.benchmarks.indexes --posts 200000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from .. import create_app
+from ..api.migrations import migrate, query_plan, scans
+from ..api.models import Post, User, db
+
+QUERIES = {
+    "user by username": ("SELECT id FROM user WHERE username = ?", ("user500",)),
+    "posts by author": (
+        "SELECT id, text FROM post WHERE author = ? "
+        "ORDER BY date_created DESC, id DESC LIMIT 20",
+        (7,),
+    ),
+    "recent posts": (
+        "SELECT id, text FROM post ORDER BY date_created DESC, id DESC LIMIT 20",
+        (),
+    ),
+    "posts after cursor": (
+        "SELECT id, text FROM post WHERE date_created <= ? "
+        "AND (date_created < ? OR id < ?) "
+        "ORDER BY date_created DESC, id DESC LIMIT 20",
+        ("2022-01-01 12:00:00", "2022-01-01 12:00:00", 50000),
+    ),
+}
+
+
+SEED_CHUNK_SIZE = 10000
+
+
+def seed(connection, users, posts):
+    """Insert users user1..userN and posts by random authors, in chunks"""
+    for offset in range(1, users + 1, SEED_CHUNK_SIZE):
+        connection.execute(
+            User.__table__.insert(),
+            [
+                {"username": f"user{i}", "email": f"user{i}@test.com", "password": "x"}
+                for i in range(offset, min(offset + SEED_CHUNK_SIZE, users + 1))
+            ],
+        )
+    start = datetime(2022, 1, 1)
+    for offset in range(0, posts, SEED_CHUNK_SIZE):
+        connection.execute(
+            Post.__table__.insert(),
+            [
+                {
+                    "text": f"post {i}",
+                    "author": random.randint(1, users),
+                    "date_created": start + timedelta(seconds=i),
+                }
+                for i in range(offset, min(offset + SEED_CHUNK_SIZE, posts))
+            ],
+        )
+
+
+def run_queries(engine, repeat):
+    with engine.connect() as connection:
+        for name, (sql, params) in QUERIES.items():
+            plan = query_plan(connection, sql, params)
+            start = time.perf_counter()
+            for _ in range(repeat):
+                connection.exec_driver_sql(sql, params).fetchall()
+            elapsed = (time.perf_counter() - start) / repeat
+            scan = " SCAN" if scans(plan) else ""
+            print(f"  {name:20} {elapsed * 1000:8.3f} ms{scan}  {'; '.join(plan)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--posts", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app()
+        app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + os.path.join(
+            tmp, "bench.db"
+        )
+        with app.app_context():
+            db.create_all()
+            with db.engine.begin() as connection:
+                # start from schema as it was before migration 1
+                connection.exec_driver_sql("DROP INDEX ix_post_author_date_created")
+                connection.exec_driver_sql("DROP INDEX ix_post_date_created_id")
+                seed(connection, args.users, args.posts)
+
+            print(f"{args.users} users, {args.posts} posts")
+            print("before migration:")
+            run_queries(db.engine, args.repeat)
+            migrate()
+            print("after migration:")
+            run_queries(db.engine, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Small concurrent HTTP load generator used by benchmarks"""
+import http.client
+import statistics
+import threading
+import time
+from collections import Counter
+from itertools import cycle
+from urllib.parse import urlsplit
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    # headers and body go out in separate writes, with Nagle the body waits
+    # for delayed ACK and every response takes 40 ms
+    disable_nagle_algorithm = True
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def serve(app):
+    """Serve app with threaded werkzeug server in background, return server and url"""
+    server = make_server(
+        "127.0.0.1", 0, app, threaded=True, request_handler=QuietRequestHandler
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def percentile(latencies, fraction):
+    if not latencies:
+        return 0.0
+    return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))]
+
+
+def _request(item):
+    """Return (method, path, body, headers) of request described by item
+
+    Item is GET path, (method, path, body, headers) tuple or function
+    returning one of those, called for every request.
+    """
+    if callable(item):
+        item = item()
+    if isinstance(item, str):
+        return "GET", item, None, {}
+    method, path, body, headers = item
+    return method, path, body, headers
+
+
+def run_load(
+    base_url, paths, concurrency=16, duration=5.0, headers=None, expected=None
+):
+    """Request paths in round robin from concurrent clients for duration seconds
+
+    Items of paths are described in _request, headers are sent with every
+    request. Responses with status not in expected are errors, without it
+    only 5xx are. Returns dict with request count, errors, count of every
+    status, requests per second and latency percentiles in milliseconds.
+    """
+    host = urlsplit(base_url).netloc
+    latencies = []
+    errors = [0]
+    statuses = Counter()
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(offset):
+        own = []
+        failed = 0
+        seen = Counter()
+        connection = http.client.HTTPConnection(host, timeout=30)
+        requests = cycle(paths[offset % len(paths) :] + paths[: offset % len(paths)])
+        while time.perf_counter() < deadline:
+            method, path, body, extra = _request(next(requests))
+            start = time.perf_counter()
+            try:
+                connection.request(method, path, body, {**(headers or {}), **extra})
+                response = connection.getresponse()
+                response.read()
+                seen[response.status] += 1
+                if (
+                    response.status not in expected
+                    if expected
+                    else response.status >= 500
+                ):
+                    failed += 1
+                # dev server doesn't drain body of rejected request, it would
+                # be read as next request on this connection
+                if response.will_close or response.status == 429:
+                    connection.close()
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                connection.close()
+            own.append(time.perf_counter() - start)
+        connection.close()
+        with lock:
+            latencies.extend(own)
+            errors[0] += failed
+            statuses.update(seen)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "rps": len(latencies) / elapsed,
+        "p50": percentile(latencies, 0.50) * 1000,
+        "p95": percentile(latencies, 0.95) * 1000,
+        "p99": percentile(latencies, 0.99) * 1000,
+        "mean": (statistics.fmean(latencies) * 1000) if latencies else 0.0,
+    }
+
+
+def format_stats(name, stats):
+    return (
+        f"{name:30} {stats['rps']:9.1f} req/s  p50 {stats['p50']:7.2f} ms  "
+        f"p95 {stats['p95']:7.2f} ms  p99 {stats['p99']:7.2f} ms  "
+        f"errors {stats['errors']}"
+    )
@@ -0,0 +1,90 @@
+"""Benchmark of rendered frontend pages per second with and without page cache
+
+Run from directory containing the package, e.g.:
+
+    python -m RedditLo.benchmarks.pages --seconds 2
+"""
+import argparse
+import time
+
+from werkzeug.security import generate_password_hash
+
+from .. import create_app
+from ..api.models import Post, User, db
+
+PAGES = ["/", "/login", "/sign_up", "/my_profile"]
+
+
+def pages_per_second(client, path, seconds):
+    done = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        response = client.get(path)
+        assert response.status_code == 200, (path, response.status_code)
+        done += 1
+    return done / (time.perf_counter() - start)
+
+
+def run(seconds=2.0, posts=20):
+    """Return pages per second of each page without and with cache"""
+    results = {}
+    for enabled in (False, True):
+        app = create_app(
+            {
+                "SQLALCHEMY_DATABASE_URI": "sqlite://",
+                "PAGE_CACHE_ENABLED": enabled,
+                "PASSWORD_HASH_WORKERS": 0,
+                "PASSWORD_HASH_ITERATIONS": 1000,
+            }
+        )
+        with app.app_context():
+            db.create_all()
+            db.session.add(
+                User(
+                    username="bench",
+                    email="bench@test.com",
+                    password=generate_password_hash("benchmark", "pbkdf2:sha256:1000"),
+                )
+            )
+            db.session.execute(
+                Post.__table__.insert(),
+                [{"text": f"post {i}", "author": 1} for i in range(posts)],
+            )
+            db.session.commit()
+
+        client = app.test_client()
+        for path in PAGES:
+            if path == "/my_profile":
+                # profile is only for logged in users and never cached
+                token = client.get("/login").data.split(b'name="csrf_token"')[1]
+                token = token.split(b'value="')[1].split(b'"')[0].decode()
+                client.post(
+                    "/login",
+                    data={
+                        "username": "bench",
+                        "password": "benchmark",
+                        "csrf_token": token,
+                    },
+                )
+            results.setdefault(path, {})[enabled] = pages_per_second(
+                client, path, seconds
+            )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=2)
+    parser.add_argument("--posts", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'page':12} {'no cache/s':>12} {'cache/s':>12} {'speedup':>8}")
+    for path, rates in run(args.seconds, args.posts).items():
+        print(
+            f"{path:12} {rates[False]:>12.1f} {rates[True]:>12.1f}"
+            f" {rates[True] / rates[False]:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
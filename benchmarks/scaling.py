@@ -0,0 +1,134 @@
+"""Benchmark of throughput of preforking server from 1 to N worker processes
+
+Seeds database, then for every worker count starts serve module in new
+process, drives read routes from client processes and reports requests per
+second and speedup over one worker. On N cores throughput of read routes
+should grow close to linearly up to N workers, writes are serialized by
+SQLite and don't scale. Run from directory containing the package, e.g.:
+
+    python -m RedditLo.benchmarks.scaling --workers 1 2 4 8 --duration 10
+
+Clients need CPU too, give them own cores with --clients or run them
+from another machine with loadgen.
+"""
+import argparse
+import os
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from ..serve import DEFAULT_THREADS, default_workers
+from .loadgen import format_stats, run_load
+from .suite import SCALES, prepare
+
+READ_PATHS = [
+    "/api/posts/all?limit=20",
+    "/api/posts/feed",
+    "/api/users/user1",
+    "/",
+]
+
+LISTENING_RE = re.compile(r"Listening on (http://\S+)")
+
+
+def package_name():
+    return __package__.split(".")[0]
+
+
+def start_server(uri, workers, threads=DEFAULT_THREADS, package=None):
+    """Start serve module on free port, return process and its url"""
+    package = package or package_name()
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            f"{package}.serve",
+            "--port",
+            "0",
+            "--workers",
+            str(workers),
+            "--threads",
+            str(threads),
+            "--set",
+            f"SQLALCHEMY_DATABASE_URI={uri}",
+            "--set",
+            "RATELIMIT_ENABLED=false",
+        ],
+        cwd=root,
+        env=dict(os.environ, PYTHONPATH=root),
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    for line in process.stderr:
+        match = LISTENING_RE.search(line)
+        if match:
+            # keep reading log, full pipe would block server
+            threading.Thread(target=process.stderr.read, daemon=True).start()
+            return process, match.group(1)
+    process.wait()
+    raise RuntimeError(f"Server exited with code {process.returncode}")
+
+
+def stop_server(process, timeout=30):
+    """Stop server gracefully, return its exit code"""
+    process.send_signal(signal.SIGTERM)
+    return process.wait(timeout)
+
+
+def _client(args):
+    return run_load(*args)
+
+
+def run(url, clients, concurrency, duration):
+    """Load url from client processes, return merged stats"""
+    args = [(url, READ_PATHS, concurrency, duration)] * clients
+    with ProcessPoolExecutor(clients) as pool:
+        results = list(pool.map(_client, args))
+    # percentiles can't be merged exactly, report worst client
+    return {
+        "requests": sum(result["requests"] for result in results),
+        "errors": sum(result["errors"] for result in results),
+        "rps": sum(result["rps"] for result in results),
+        "p50": max(result["p50"] for result in results),
+        "p95": max(result["p95"] for result in results),
+        "p99": max(result["p99"] for result in results),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    counts = [1]
+    while counts[-1] * 2 <= default_workers():
+        counts.append(counts[-1] * 2)
+    parser.add_argument("--workers", type=int, nargs="+", default=counts)
+    parser.add_argument("--threads", type=int, default=DEFAULT_THREADS)
+    parser.add_argument("--clients", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--scale", choices=SCALES, default="10k")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        uri = "sqlite:///" + os.path.join(tmp, "bench.db")
+        prepare(uri, *SCALES[args.scale])
+        base = None
+        for workers in args.workers:
+            process, url = start_server(uri, workers, args.threads)
+            try:
+                stats = run(url, args.clients, args.concurrency, args.duration)
+            finally:
+                stop_server(process)
+            base = base or stats["rps"]
+            print(
+                format_stats(f"{workers} workers", stats)
+                + f"  speedup {stats['rps'] / base:.2f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
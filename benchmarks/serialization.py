@@ -0,0 +1,89 @@
+"""Microbenchmarks of serializing users and posts to JSON
+
+Run from directory containing the package, e.g.:
+
+    python -m RedditLo.benchmarks.serialization --rows 10000
+"""
+import argparse
+import time
+
+from flask import jsonify
+
+from .. import create_app
+from ..api.models import Post, User, db
+from ..api.queries import POST_FIELDS, USER_DEFAULT_FIELDS
+from ..api.serializers import json_response, row_serializer
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run(rows=10000, repeat=3):
+    """Return best time in seconds of each serialization path per model"""
+    app = create_app({"SQLALCHEMY_DATABASE_URI": "sqlite://"})
+    results = {}
+    with app.app_context():
+        db.create_all()
+        db.session.execute(
+            User.__table__.insert(),
+            [
+                {"username": f"user{i}", "email": f"user{i}@test.com", "password": "x"}
+                for i in range(rows)
+            ],
+        )
+        db.session.execute(
+            Post.__table__.insert(),
+            [{"text": f"post {i}", "author": 1} for i in range(rows)],
+        )
+        db.session.commit()
+
+        for model, fields in ((User, USER_DEFAULT_FIELDS), (Post, POST_FIELDS)):
+            name = model.__tablename__
+            query = db.select(*(getattr(model, field) for field in fields))
+            data = db.session.execute(query).all()
+            serialize = row_serializer(query, fields)
+
+            def orm_jsonify():
+                db.session.expunge_all()
+                jsonify(model.query.all())
+
+            def rows_json():
+                app.config["JSON_ORJSON"] = False
+                json_response([serialize(row) for row in data])
+
+            def rows_orjson():
+                app.config["JSON_ORJSON"] = True
+                json_response([serialize(row) for row in data])
+
+            results[name] = {
+                "orm + jsonify": best_of(orm_jsonify, repeat),
+                "rows + json": best_of(rows_json, repeat),
+                "rows + orjson": best_of(rows_orjson, repeat),
+            }
+        db.session.remove()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for name, timings in run(args.rows, args.repeat).items():
+        baseline = timings["orm + jsonify"]
+        for path, seconds in timings.items():
+            print(
+                f"{args.rows} {name:5} {path:15} {seconds * 1000:9.2f} ms"
+                f"  {baseline / seconds:5.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
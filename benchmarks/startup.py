@@ -0,0 +1,123 @@
+"""Benchmark of cold start: package import time and app creation
+
+Runs fresh interpreter with -X importtime, importing the package and
+calling create_app, keeps the fastest of several runs, then reports slowest
+imports and exits with code 1 when startup is over budget or modules meant
+to load lazily were imported.
+Run from directory containing the package, e.g.:
+
+    python -m RedditLo.benchmarks.startup --budget 1.5
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+# seconds to import package and create app, tests enforce it
+STARTUP_BUDGET = 1.5
+
+# heavy modules only some requests or configurations need
+LAZY_MODULES = ("wtforms", "email_validator", "dns.resolver", "multiprocessing")
+
+IMPORT_RE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+SCRIPT = """
+import time
+start = time.perf_counter()
+import {package}
+imported = time.perf_counter()
+{package}.create_app()
+print(imported - start, time.perf_counter() - imported)
+"""
+
+
+def package_name():
+    return __package__.split(".")[0]
+
+
+def parse_importtime(output):
+    """Return dict of module -> (self, cumulative) microseconds and top level list"""
+    modules = {}
+    top_level = []
+    for line in output.splitlines():
+        match = IMPORT_RE.match(line)
+        if not match:
+            continue
+        own, cumulative, indent, name = match.groups()
+        modules[name] = (int(own), int(cumulative))
+        if not indent:
+            top_level.append(name)
+    return modules, top_level
+
+
+def measure(package=None):
+    """Import package and create app in new interpreter, return timings"""
+    package = package or package_name()
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = dict(os.environ, PYTHONPATH=root)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", SCRIPT.format(package=package)],
+        cwd=root,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    import_seconds, create_seconds = map(float, result.stdout.split())
+    modules, top_level = parse_importtime(result.stderr)
+    return {
+        "import_seconds": import_seconds,
+        "create_seconds": create_seconds,
+        "modules": modules,
+        "top_level": top_level,
+    }
+
+
+def fastest(runs=3, package=None):
+    """Return timings of fastest of several cold starts
+
+    Single runs are noisy when other processes compete for CPU, e.g. tests
+    run with pytest -n, the fastest is closest to real cost of startup.
+    """
+    results = [measure(package) for _ in range(runs)]
+    return min(results, key=lambda r: r["import_seconds"] + r["create_seconds"])
+
+
+def lazy_imported(modules):
+    """Return modules of LAZY_MODULES that were imported at startup"""
+    return [name for name in LAZY_MODULES if name in modules]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget", type=float, default=STARTUP_BUDGET)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    result = fastest(args.runs)
+    slowest = sorted(result["modules"].items(), key=lambda item: -item[1][0])
+    print(f"{'module':50} {'self ms':>9} {'cumulative ms':>14}")
+    for name, (own, cumulative) in slowest[: args.top]:
+        print(f"{name:50} {own / 1000:9.1f} {cumulative / 1000:14.1f}")
+    total = result["import_seconds"] + result["create_seconds"]
+    print(
+        f"import {result['import_seconds'] * 1000:.0f} ms, "
+        f"create_app {result['create_seconds'] * 1000:.0f} ms, "
+        f"budget {args.budget * 1000:.0f} ms"
+    )
+
+    failed = False
+    if total > args.budget:
+        print(f"OVER BUDGET by {(total - args.budget) * 1000:.0f} ms")
+        failed = True
+    for name in lazy_imported(result["modules"]):
+        print(f"EAGER IMPORT {name}")
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+"""Load test of every api and frontend route against seeded database
+
+Seeds users and posts at chosen scale, serves app with threaded server and
+drives each route with concurrent clients, reporting requests per second
+and p50/p95/p99 latency. Results can be saved as baseline, later runs
+compared with it fail (exit code 1) when a route got slower than tolerance.
+Run from directory containing the package, e.g.:
+
+    python -m RedditLo.benchmarks.suite --scale 100k --save-baseline base.json
+    python -m RedditLo.benchmarks.suite --scale 100k --baseline base.json
+
+Seeding large scales takes long, use --db to keep seeded database and reuse
+it in next runs (write routes add rows to it).
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import sys
+import tempfile
+from urllib.parse import urlencode, urlsplit
+
+from sqlalchemy import inspect
+
+from .. import create_app
+from ..api.migrations import create_schema
+from ..api.models import db
+from .indexes import seed
+from .loadgen import format_stats, run_load, serve
+
+# scale name -> (users, posts)
+SCALES = {
+    "1k": (100, 1000),
+    "10k": (1000, 10000),
+    "100k": (10000, 100000),
+    "1m": (100000, 1000000),
+    "10m": (1000000, 10000000),
+}
+
+BENCH_USER = {"username": "benchuser", "email": "bench@test.com"}
+BENCH_PASSWORD = "benchmark1"
+FORM = {"Content-Type": "application/x-www-form-urlencoded"}
+# any other status of scenario is error, e.g. 401 of failed login or 404 of
+# user deleted already, those are fast and would look like speed-up
+OK = (200,)
+
+
+def scenarios(users):
+    """Return list of (name, requests, logged_in, expected) for every route
+
+    Requests are items accepted by loadgen.run_load, expected are statuses
+    of successful response. Read routes come first, routes deleting users
+    last.
+    """
+    counter = itertools.count(1)
+    unique = itertools.count(1)
+    deleted = itertools.count()
+
+    def user_path(template):
+        return lambda: template.format(next(counter) % users + 1)
+
+    def form(path, fields):
+        return lambda: ("POST", path, urlencode(fields(next(unique))), FORM)
+
+    def new_user(i):
+        return {"username": f"b{i}", "email": f"b{i}@test.com", "password": "x" * 8}
+
+    def bulk_users():
+        rows = [new_user(f"bulk{next(unique)}") for _ in range(10)]
+        body = "username,email,password\n" + "".join(
+            f"{r['username']},{r['email']},{r['password']}\n" for r in rows
+        )
+        return "POST", "/api/users/bulk", body, {"Content-Type": "text/csv"}
+
+    def bulk_posts():
+        posts = [{"text": f"bulk post {next(unique)}", "author": 1} for _ in range(50)]
+        return (
+            "POST",
+            "/api/posts/bulk",
+            json.dumps(posts),
+            {"Content-Type": "application/json"},
+        )
+
+    login = urlencode({**BENCH_USER, "password": BENCH_PASSWORD})
+    return [
+        ("api.get_all_users", ["/api/users/all?limit=50"], True, OK),
+        ("api.get_user", [user_path("/api/users/user{}")], False, OK),
+        ("api.get_all_posts", ["/api/posts/all?limit=20"], False, OK),
+        ("api.get_all_posts stream", ["/api/posts/all?stream=1&limit=1"], False, OK),
+        ("api.get_feed", ["/api/posts/feed"], False, OK),
+        ("api.get_user_feed", [user_path("/api/users/user{}/feed")], False, OK),
+        ("api.search", [user_path("/api/posts/search?q=post+{}")], False, OK),
+        ("api.user_cache_metrics", ["/api/users/cache/metrics"], False, OK),
+        ("api.post_queue_metrics", ["/api/posts/bulk/metrics"], False, OK),
+        ("metrics", ["/metrics"], False, OK),
+        ("frontend.index", ["/"], False, OK),
+        ("frontend.index logged in", ["/"], True, OK),
+        ("frontend.login", ["/login"], False, OK),
+        ("frontend.sign_up", ["/sign_up"], False, OK),
+        ("frontend.my_profile", ["/my_profile"], True, OK),
+        # successful login redirects to profile
+        (
+            "frontend.login POST",
+            [lambda: ("POST", "/login", login, FORM)],
+            False,
+            (302,),
+        ),
+        (
+            "api.create_post",
+            [
+                form(
+                    "/api/posts/create_post",
+                    lambda i: {"text": f"post {i}", "author": 1},
+                )
+            ],
+            False,
+            OK,
+        ),
+        ("api.create_posts_bulk", [bulk_posts], False, (202,)),
+        ("api.add_user", [form("/api/users/add_user", new_user)], False, OK),
+        ("api.add_users_bulk", [bulk_users], True, OK),
+        # users are purged in background when they have many posts
+        (
+            "api.delete_user",
+            [lambda: "/api/users/delete_user/user{}".format(users - next(deleted))],
+            False,
+            (200, 202),
+        ),
+    ]
+
+
+def prepare(uri, users, posts):
+    """Create and seed DB unless it exists, add user benchmark logs in as"""
+    app = create_app({"SQLALCHEMY_DATABASE_URI": uri})
+    with app.app_context():
+        if not inspect(db.engine).has_table("user"):
+            create_schema()
+            with db.engine.begin() as connection:
+                seed(connection, users, posts)
+        client = app.test_client()
+        client.post(
+            "/api/users/add_user",
+            data={**BENCH_USER, "password": BENCH_PASSWORD},
+        )
+        db.session.remove()
+        db.engine.dispose()
+
+
+def session_cookie(base_url):
+    """Log in as benchmark user and return Cookie header of session"""
+    connection = http.client.HTTPConnection(urlsplit(base_url).netloc)
+    connection.request(
+        "POST",
+        "/login",
+        urlencode({**BENCH_USER, "password": BENCH_PASSWORD}),
+        FORM,
+    )
+    response = connection.getresponse()
+    response.read()
+    cookies = [
+        value.split(";")[0]
+        for name, value in response.getheaders()
+        if name.lower() == "set-cookie"
+    ]
+    connection.close()
+    return "; ".join(cookies)
+
+
+def run(uri, users, concurrency=16, duration=5.0, only=None):
+    """Run load on every scenario, return dict of name -> stats"""
+    app = create_app(
+        {
+            "SQLALCHEMY_DATABASE_URI": uri,
+            "WTF_CSRF_ENABLED": False,
+            # default 10s would turn page cache into the only thing measured
+            "PAGE_CACHE_TTL": 1,
+            # all clients share one IP, limits would turn writes into 429s
+            "RATELIMIT_ENABLED": False,
+        }
+    )
+    server, url = serve(app)
+    results = {}
+    try:
+        cookie = {"Cookie": session_cookie(url)}
+        for name, requests, logged_in, expected in scenarios(users):
+            if only and not any(pattern in name for pattern in only):
+                continue
+            results[name] = run_load(
+                url,
+                requests,
+                concurrency,
+                duration,
+                cookie if logged_in else None,
+                expected,
+            )
+            print(format_stats(name, results[name]), flush=True)
+    finally:
+        server.shutdown()
+        with app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+    return results
+
+
+def error_rate(stats):
+    return stats["errors"] / stats["requests"] if stats["requests"] else 0.0
+
+
+def compare(results, baseline, tolerance=0.2):
+    """Return messages about scenarios slower than baseline beyond tolerance
+
+    Higher share of errors than in baseline is regression too, failed
+    requests are usually faster than successful ones.
+    """
+    regressions = []
+    for name, stats in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if stats["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: {stats['rps']:.1f} req/s, baseline {base['rps']:.1f} req/s"
+            )
+        if stats["p95"] > base["p95"] * (1 + tolerance):
+            regressions.append(
+                f"{name}: p95 {stats['p95']:.2f} ms, baseline {base['p95']:.2f} ms"
+            )
+        rate, base_rate = error_rate(stats), error_rate(base)
+        if rate > base_rate:
+            regressions.append(f"{name}: {rate:.1%} errors, baseline {base_rate:.1%}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", choices=SCALES, default="10k")
+    parser.add_argument("--users", type=int, help="override users of scale")
+    parser.add_argument("--posts", type=int, help="override posts of scale")
+    parser.add_argument("--db", help="SQLite file to seed once and reuse")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--only", nargs="+", help="run scenarios containing text")
+    parser.add_argument("--baseline", help="JSON results to compare with")
+    parser.add_argument("--save-baseline", help="write results to JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    users, posts = SCALES[args.scale]
+    users = args.users or users
+    posts = args.posts or posts
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.abspath(args.db or os.path.join(tmp, "bench.db"))
+        uri = "sqlite:///" + path
+        print(f"seeding {users} users, {posts} posts in {path}", flush=True)
+        prepare(uri, users, posts)
+        results = run(uri, users, args.concurrency, args.duration, args.only)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for message in regressions:
+            print("REGRESSION " + message)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
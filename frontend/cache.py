@@ -0,0 +1,147 @@
+import threading
+from functools import wraps
+
+from flask import current_app, g, request, session
+from flask_login import current_user
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from ..api.cache import FileCache, LRUCache
+
+# stands for per-session CSRF token in cached pages
+CSRF_MARKER = "\x00csrf-token\x00"
+
+
+class _PageCacheState:
+    def __init__(self, app):
+        ttl = app.config.get("PAGE_CACHE_TTL", 10)
+        directory = app.config.get("PAGE_CACHE_DIR")
+        if directory:
+            self.backend = FileCache(directory, ttl)
+        else:
+            self.backend = LRUCache(app.config.get("PAGE_CACHE_SIZE", 1000), ttl)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def count(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+
+class FragmentCacheExtension(Extension):
+    """Jinja tag caching rendered block, {% cache ttl, key... %}...{% endcache %}"""
+
+    tags = {"cache"}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(["name:endcache"], drop_needle=True)
+        call = self.call_method("_render", [nodes.List(args)])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render(self, args, caller):
+        ttl, *keys = args
+        return page_cache.fragment(ttl, keys, caller)
+
+
+class PageCache:
+    """Cache of rendered pages for anonymous visitors and of template fragments
+
+    Whole GET responses of decorated views are cached for PAGE_CACHE_TTL
+    seconds while visitor is not logged in and has no flashed messages.
+    CSRF token is cut out of cached page and filled in for every visitor.
+    Uses in-process LRU with PAGE_CACHE_SIZE entries, or files in
+    PAGE_CACHE_DIR when set. Set PAGE_CACHE_ENABLED to False to disable.
+    """
+
+    def init_app(self, app):
+        app.extensions["page_cache"] = _PageCacheState(app)
+        app.jinja_env.add_extension(FragmentCacheExtension)
+
+    @property
+    def _state(self):
+        return current_app.extensions["page_cache"]
+
+    @property
+    def enabled(self):
+        return current_app.config.get("PAGE_CACHE_ENABLED", True)
+
+    def _cacheable(self):
+        return (
+            self.enabled
+            and request.method == "GET"
+            and "_flashes" not in session
+            and not current_user.is_authenticated
+        )
+
+    def cached(self, view):
+        """Decorate view to serve its anonymous GET responses from cache"""
+
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not self._cacheable():
+                return view(*args, **kwargs)
+
+            state = self._state
+            key = "page:" + request.full_path
+            body = state.backend.get(key)
+            state.count(body is not None)
+            if body is not None:
+                if CSRF_MARKER in body:
+                    from flask_wtf.csrf import generate_csrf
+
+                    body = body.replace(CSRF_MARKER, generate_csrf())
+                return current_app.response_class(body, mimetype="text/html")
+
+            response = current_app.make_response(view(*args, **kwargs))
+            # view may have flashed message meant only for this visitor
+            if (
+                response.status_code == 200
+                and response.mimetype == "text/html"
+                and "_flashes" not in session
+            ):
+                body = response.get_data(as_text=True)
+                token = g.get(
+                    current_app.config.get("WTF_CSRF_FIELD_NAME", "csrf_token")
+                )
+                if token:
+                    body = body.replace(token, CSRF_MARKER)
+                state.backend.set(key, body)
+            return response
+
+        return wrapper
+
+    def fragment(self, ttl, keys, render):
+        """Return cached fragment for keys, rendering and storing it on miss"""
+        if not self.enabled:
+            return render()
+        state = self._state
+        key = "fragment:" + ":".join(map(str, keys))
+        html = state.backend.get(key)
+        state.count(html is not None)
+        if html is None:
+            html = str(render())
+            state.backend.set(key, html, ttl)
+        return Markup(html)
+
+    def invalidate_fragment(self, *keys):
+        self._state.backend.delete("fragment:" + ":".join(map(str, keys)))
+
+    def clear(self):
+        self._state.backend.clear()
+
+    def metrics(self):
+        state = self._state
+        with state.lock:
+            return {"hits": state.hits, "misses": state.misses}
+
+
+page_cache = PageCache()
@@ -1,9 +1,14 @@
 import json
-from ..api.models import User
+from ..api.cache import user_cache
+from ..api.feed import feed
+from ..api.hashing import password_hasher
+from ..api.instrumentation import instrumentation
+from ..api.models import db
+from ..api.queries import post_counters, posts_page
+from ..api.ratelimit import limiter
 from ..api.routes import add_user
-from .forms import LoginForm, SignUpForm
+from .cache import page_cache
 from flask import render_template, redirect, url_for, request, Blueprint, flash
-from werkzeug.security import check_password_hash
 from flask_login import (
     login_user,
     login_required,
@@ -19,19 +24,28 @@ frontend = Blueprint(
     static_url_path="/frontend/static",
 )
 
+INDEX_PAGE_SIZE = 20
+
 
 @frontend.route("/")
+@instrumentation.query_budget(2)
+@page_cache.cached
 def index():
-    """home page"""
-    return render_template("index.html", user=current_user)
+    """home page with recent posts from precomputed feed"""
+    ids, _ = feed.page(INDEX_PAGE_SIZE)
+    return render_template("index.html", user=current_user, posts=feed.posts(ids))
 
 
 @frontend.route("/sign_up", methods=["GET", "POST"])
+@page_cache.cached
 def sign_up():
     """Signup/Register route"""
 
     # break glass in case of emergency
     # print(request.data, file=sys.stderr)
+    # forms pull in wtforms, email_validator and dnspython, loaded on first use
+    from .forms import SignUpForm
+
     form = SignUpForm()
     if request.method == "POST":
 
@@ -55,9 +69,21 @@ def sign_up():
     return render_template("sign_up.html", user=current_user, form=form)
 
 
+def login_username():
+    """Username of login attempt, guessing one account is limited on its own"""
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        return data.get("username")
+    return request.form.get("username")
+
+
 @frontend.route("/login", methods=["GET", "POST"])
+@limiter.limit("login", rate=0.5, burst=10, concurrency=4, user_key=login_username)
+@page_cache.cached
 def login():
     """Login route"""
+    from .forms import LoginForm
+
     form = LoginForm()
     if request.method == "POST":
         # return error if form data is missing
@@ -68,11 +94,16 @@ def login():
             # TODO change that to get_user from api
             # user = get_user(username=form.username.data)
 
-            user = User.query.filter_by(username=form.username.data).first()
+            user = user_cache.get_by_username(form.username.data)
             # check if user exists in DB
             if user:
                 # check if password matches
-                if check_password_hash(user.password, form.password.data):
+                if password_hasher.check(user.password, form.password.data):
+                    # upgrade hashes made with outdated method or cost
+                    if password_hasher.needs_rehash(user.password):
+                        user.password = password_hasher.hash(form.password.data)
+                        db.session.commit()
+                        user_cache.invalidate(user.id, user.username)
                     # login and redirect to my_profile if everything went well
                     login_user(user, remember=True)
                     return redirect(url_for("frontend.my_profile"))
@@ -91,10 +122,22 @@ def login():
     return render_template("login.html", user=current_user, form=form)
 
 
+PROFILE_POSTS = 5
+
+
 @frontend.route("/my_profile")
+@instrumentation.query_budget(3)
 @login_required
 def my_profile():
-    return render_template("my_profile.html", user=current_user)
+    """profile with post counters and latest posts, two queries for any user"""
+    counters, posts = None, []
+    if current_user.is_authenticated:
+        counters = db.session.execute(post_counters(current_user.id)).one()
+        query = posts_page(author=current_user.id).limit(PROFILE_POSTS)
+        posts = db.session.execute(query).all()
+    return render_template(
+        "my_profile.html", user=current_user, counters=counters, posts=posts
+    )
 
 
 @frontend.route("/logout")
@@ -1,6 +1,8 @@
 from . import create_app
 
-app = create_app()
+# WSGI servers import app from here, warm up makes first requests fast
+app = create_app({"WARM_UP": True})
 
 if __name__ == "__main__":
+    # development server, in production run preforking serve module instead
     app.run(debug=True, port=8000)
@@ -0,0 +1,358 @@
+"""Preforking production server
+
+Master process creates app once, warms it up and binds listening socket,
+then forks workers serving requests from that socket, each with fixed pool
+of threads. Workers inherit imported modules, compiled templates and loaded
+feed, but open their own DB connections after fork. Everything else kept in
+memory (caches, feed, metrics) is per worker and nothing is shared between
+them: with more than one worker rate limit buckets go to SQLite file, so
+limits hold per host, user cache goes to shared directory, so users deleted
+by one worker are logged out on all, both in new private temporary
+directory of every run, and feed is reloaded every FEED_MAX_AGE seconds, so
+posts written by other workers show up.
+
+Signals to master:
+
+    TERM, INT  stop accepting, finish requests in progress and exit
+    HUP        graceful reload, start new workers, then stop old ones
+
+Workers that exit on their own are replaced. Run from directory containing
+the package, e.g.:
+
+    python -m RedditLo.serve --workers 4 --threads 4 --port 8000 \\
+        --set SQLALCHEMY_DATABASE_URI=sqlite:////var/lib/redditlo.db
+"""
+import argparse
+import json
+import logging
+import os
+import select
+import signal
+import socket
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from socketserver import ThreadingMixIn
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+from . import create_app, warm_up
+from .api.hashing import password_hasher
+from .api.ingest import post_writer
+from .api.jobs import job_queue
+from .api.models import db
+
+logger = logging.getLogger(__name__)
+
+# requests mostly wait on SQLite and sockets, a few threads keep a core busy
+DEFAULT_THREADS = 4
+# seconds workers get to finish requests in progress before they are killed
+GRACEFUL_TIMEOUT = 30
+LISTEN_BACKLOG = 2048
+
+
+def default_workers():
+    """One worker per CPU, GIL lets one process use about one core"""
+    return os.cpu_count() or 1
+
+
+def production_config(workers, directory):
+    """Config of app served by more than one worker process
+
+    Files shared by workers go to directory, which must be private to the
+    server user, e.g. made by tempfile.mkdtemp.
+    """
+    if workers < 2:
+        return {}
+    return {
+        # every worker has own hashing pool, together they use all CPUs
+        "PASSWORD_HASH_WORKERS": max(1, default_workers() // workers),
+        "FEED_MAX_AGE": 5,
+        "RATELIMIT_STORAGE": os.path.join(directory, "ratelimit.db"),
+        # invalidation by one worker must reach all of them
+        "USER_CACHE_DIR": os.path.join(directory, "users"),
+    }
+
+
+class RequestHandler(WSGIRequestHandler):
+    # connection is closed after every response, so idle clients never hold
+    # one of the fixed number of threads
+    protocol_version = "HTTP/1.0"
+    disable_nagle_algorithm = True
+    # slow clients give up their thread after that many seconds
+    timeout = 30
+
+    def log_request(self, *args, **kwargs):
+        if self.server.access_log:
+            super().log_request(*args, **kwargs)
+
+
+class PooledWSGIServer(ThreadingMixIn, BaseWSGIServer):
+    """Werkzeug server handling requests in fixed pool of threads
+
+    Accept loop waits while all threads are busy, so new connections stay
+    in listen backlog, where idle workers take them.
+    """
+
+    multithread = True
+
+    def __init__(self, app, listener, threads, access_log=False):
+        host, port = listener.getsockname()[:2]
+        super().__init__(host, port, app, RequestHandler, fd=listener.fileno())
+        self.access_log = access_log
+        self.pool = ThreadPoolExecutor(threads, thread_name_prefix="request")
+        self.slots = threading.Semaphore(threads)
+
+    def process_request(self, request, client_address):
+        self.slots.acquire()
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self.slots.release()
+
+
+def after_fork(app):
+    """Drop DB connections inherited from master, worker opens its own"""
+    with app.app_context():
+        for engine in (
+            db.engine,
+            db.get_read_engine(app),
+            db.get_replica_engine(app),
+        ):
+            if engine is not None:
+                engine.dispose(close=False)
+
+
+def run_worker(app, listener, threads, access_log=False):
+    """Serve requests until TERM, then finish them and queued writes"""
+    after_fork(app)
+    server = PooledWSGIServer(app, listener, threads, access_log)
+
+    def stop(signum, frame):
+        # shutdown waits for serve_forever loop, which runs in this thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    # Ctrl+C goes to whole process group, master stops workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    server.serve_forever()
+    server.pool.shutdown()
+    with app.app_context():
+        post_writer.flush()
+        # jobs not started yet wait in DB for other workers
+        job_queue.stop(GRACEFUL_TIMEOUT)
+        password_hasher.shutdown()
+
+
+class Master:
+    """Forks workers and keeps their number, handles signals"""
+
+    def __init__(self, app, listener, workers, threads, **options):
+        self.app = app
+        self.listener = listener
+        self.count = workers
+        self.threads = threads
+        self.graceful_timeout = options.get("graceful_timeout", GRACEFUL_TIMEOUT)
+        self.access_log = options.get("access_log", False)
+        # pid -> generation of running workers, reload starts new generation
+        self.workers = {}
+        # pid -> time when worker asked to stop gets killed
+        self.stopping = {}
+        self.generation = 0
+        self.signals = []
+
+    def spawn(self):
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = self.generation
+            return pid
+        code = 0
+        try:
+            signal.set_wakeup_fd(-1)
+            os.close(self.wakeup[0])
+            os.close(self.wakeup[1])
+            run_worker(self.app, self.listener, self.threads, self.access_log)
+        except BaseException:
+            logger.exception("Worker %d failed", os.getpid())
+            code = 1
+        finally:
+            # skip cleanup of master inherited with its stack
+            os._exit(code)
+
+    def stop_workers(self, pids, sig=signal.SIGTERM):
+        deadline = time.monotonic() + self.graceful_timeout
+        for pid in pids:
+            if pid not in self.stopping:
+                self.stopping[pid] = deadline
+                self.kill(pid, sig)
+
+    def kill(self, pid, sig):
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            generation = self.workers.pop(pid, None)
+            if self.stopping.pop(pid, None) is None and generation is not None:
+                logger.warning(
+                    "Worker %d exited with status %d",
+                    pid,
+                    os.waitstatus_to_exitcode(status),
+                )
+
+    def current(self):
+        return [
+            pid
+            for pid, generation in self.workers.items()
+            if generation == self.generation and pid not in self.stopping
+        ]
+
+    def handle(self, signum):
+        if signum == signal.SIGHUP:
+            logger.info("Reloading workers")
+            old = list(self.workers)
+            self.generation += 1
+            for _ in range(self.count):
+                self.spawn()
+            self.stop_workers(old)
+            return False
+        return signum in (signal.SIGTERM, signal.SIGINT)
+
+    def run(self):
+        """Serve until TERM or INT, return when all workers exited"""
+        self.wakeup = os.pipe()
+        for fd in self.wakeup:
+            os.set_blocking(fd, False)
+        signal.set_wakeup_fd(self.wakeup[1])
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGCHLD):
+            signal.signal(signum, lambda signum, frame: self.signals.append(signum))
+        try:
+            self.loop()
+        finally:
+            self.stop_workers(list(self.workers))
+            while self.workers:
+                self.reap()
+                self.kill_overdue()
+                time.sleep(0.05)
+            signal.set_wakeup_fd(-1)
+            for fd in self.wakeup:
+                os.close(fd)
+            self.listener.close()
+
+    def loop(self):
+        while True:
+            self.reap()
+            self.kill_overdue()
+            for _ in range(self.count - len(self.current())):
+                self.spawn()
+            while self.signals:
+                if self.handle(self.signals.pop(0)):
+                    logger.info("Stopping workers")
+                    return
+            select.select([self.wakeup[0]], [], [], 1.0)
+            try:
+                while os.read(self.wakeup[0], 64):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def kill_overdue(self):
+        now = time.monotonic()
+        for pid, deadline in list(self.stopping.items()):
+            if now > deadline:
+                logger.warning("Killing worker %d after graceful timeout", pid)
+                self.kill(pid, signal.SIGKILL)
+                self.stopping[pid] = float("inf")
+
+
+def listen(host, port):
+    return socket.create_server((host, port), backlog=LISTEN_BACKLOG)
+
+
+def serve(app, listener, workers, threads, **options):
+    """Warm up app in this process and serve it from forked workers
+
+    Options are graceful_timeout and access_log.
+    """
+    warm_up(app)
+    with app.app_context():
+        # connections opened by warm up must not be shared with workers
+        for engine in (
+            db.engine,
+            db.get_read_engine(app),
+            db.get_replica_engine(app),
+        ):
+            if engine is not None:
+                engine.dispose()
+    host, port = listener.getsockname()[:2]
+    logger.info(
+        "Listening on http://%s:%d with %d workers of %d threads",
+        host,
+        port,
+        workers,
+        threads,
+    )
+    Master(app, listener, workers, threads, **options).run()
+
+
+def parse_setting(setting):
+    """Parse KEY=VALUE, value is JSON or plain string"""
+    key, _, value = setting.partition("=")
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=default_workers())
+    parser.add_argument("--threads", type=int, default=DEFAULT_THREADS)
+    parser.add_argument("--graceful-timeout", type=float, default=GRACEFUL_TIMEOUT)
+    parser.add_argument("--access-log", action="store_true")
+    parser.add_argument(
+        "--set",
+        dest="settings",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="app config, value is parsed as JSON when possible",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s [%(process)d] %(levelname)s %(message)s"
+    )
+
+    listener = listen(args.host, args.port)
+    # unpredictable name and mode 0700, other local users can't get at it
+    with tempfile.TemporaryDirectory(prefix="redditlo-") as directory:
+        config = production_config(args.workers, directory)
+        config.update(parse_setting(setting) for setting in args.settings)
+        serve(
+            create_app(config),
+            listener,
+            args.workers,
+            args.threads,
+            graceful_timeout=args.graceful_timeout,
+            access_log=args.access_log,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Shared fixtures running every test in rolled back transaction
+
+Each test process (every pytest-xdist worker too) creates one app with
+in-memory SQLite per test module and builds the schema once. Module can
+change config of its app by overriding app_config fixture. The app fixture
+binds session to connection in transaction with SAVEPOINT, commits and
+rollbacks of code under test only end the savepoint and whole transaction
+is rolled back after the test, so tests start with empty tables, don't
+depend on order and can run in parallel:
+
+    python -m pytest -n auto
+
+Tests of schema, migrations and engines use empty_app with database of its
+own instead.
+"""
+from .. import create_app, db
+from ..api.cache import user_cache
+from ..api import jobs
+from ..api.feed import feed
+from ..api.hashing import password_hasher
+from ..api.migrations import create_schema
+from ..api.ratelimit import limiter
+from ..frontend.cache import page_cache
+from sqlalchemy import event
+import pytest
+
+
+def _disable_pysqlite_transactions(dbapi_connection, connection_record):
+    # pysqlite begins and commits on its own, which breaks SAVEPOINTs
+    dbapi_connection.isolation_level = None
+
+
+def _begin(connection):
+    connection.exec_driver_sql("BEGIN")
+
+
+@pytest.fixture(scope="session", autouse=True)
+def no_job_workers():
+    # job threads of apps made by other tests would run on swapped db.session
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(jobs, "DEFAULT_WORKERS", 0)
+        yield
+
+
+# config of every test app, modules add to it by overriding app_config
+TEST_CONFIG = {
+    "TESTING": True,
+    "SQLALCHEMY_DATABASE_URI": "sqlite://",
+    "WTF_CSRF_ENABLED": False,
+    "LOGIN_DISABLED": True,
+    "PASSWORD_HASH_WORKERS": 0,
+    "PASSWORD_HASH_ITERATIONS": 1000,
+    "QUERY_BUDGET_ENFORCED": True,
+}
+
+
+@pytest.fixture(scope="module")
+def app_config():
+    """Config of test module added to TEST_CONFIG"""
+    return {}
+
+
+@pytest.fixture(scope="module")
+def database_app(app_config):
+    app = create_app(dict(TEST_CONFIG, **app_config))
+    with app.app_context():
+        event.listen(db.engine, "connect", _disable_pysqlite_transactions)
+        event.listen(db.engine, "begin", _begin)
+        create_schema()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+        password_hasher.shutdown()
+
+
+@pytest.fixture()
+def database(database_app):
+    """App with session in rolled back transaction, without app context
+
+    For tests whose requests must push their own app context.
+    """
+    with database_app.app_context():
+        connection = db.engine.connect()
+        transaction = connection.begin()
+        session = db.session
+        db.session = db.create_scoped_session({"bind": connection, "binds": {}})
+        savepoint = [connection.begin_nested()]
+
+        @event.listens_for(db.session, "after_transaction_end")
+        def restart_savepoint(session, transaction):
+            if not savepoint[0].is_active:
+                savepoint[0] = connection.begin_nested()
+
+        # state kept in memory would leak into next test
+        user_cache.clear()
+        page_cache.clear()
+        feed.clear()
+        limiter.clear()
+        for name in ("user_cache", "page_cache"):
+            database_app.extensions[name].hits = 0
+            database_app.extensions[name].misses = 0
+    try:
+        yield database_app
+    finally:
+        with database_app.app_context():
+            db.session.remove()
+            db.session = session
+            transaction.rollback()
+            connection.close()
+
+
+@pytest.fixture()
+def app(database):
+    with database.app_context():
+        yield database
+
+
+@pytest.fixture()
+def empty_app(app_config):
+    """App with its own empty database, for tests of schema and engines"""
+    app = create_app(dict(TEST_CONFIG, **app_config))
+    with app.app_context():
+        try:
+            yield app
+        finally:
+            db.session.remove()
+            for engine in (db.engine, db.get_read_engine(), db.get_replica_engine()):
+                if engine is not None:
+                    engine.dispose()
+            password_hasher.shutdown()
+
+
+@pytest.fixture()
+def client(app):
+    return app.test_client()
@@ -0,0 +1,59 @@
+from ..benchmarks.loadgen import run_load, serve
+from ..benchmarks.suite import compare, prepare, run
+
+
+def stats(rps, p95, errors=0, requests=100):
+    return {
+        "requests": requests,
+        "rps": rps,
+        "p50": p95 / 2,
+        "p95": p95,
+        "p99": p95,
+        "errors": errors,
+    }
+
+
+def test_compare_reports_regressions_beyond_tolerance():
+    baseline = {
+        "a": stats(100, 10),
+        "b": stats(100, 10),
+        "c": stats(100, 10, errors=1),
+        "d": stats(100, 10),
+    }
+    results = {
+        "a": stats(85, 11.5),
+        "b": stats(70, 13, errors=1),
+        # same share of errors in longer run
+        "c": stats(200, 10, errors=2, requests=200),
+        # every request fails fast
+        "d": stats(500, 2, errors=500, requests=500),
+        "new": stats(1, 1000),
+    }
+    assert compare(results, baseline, tolerance=0.2) == [
+        "b: 70.0 req/s, baseline 100.0 req/s",
+        "b: p95 13.00 ms, baseline 10.00 ms",
+        "b: 1.0% errors, baseline 0.0%",
+        "d: 100.0% errors, baseline 0.0%",
+    ]
+
+
+def test_suite_runs_scenarios_against_seeded_db(tmp_path):
+    uri = "sqlite:///" + str(tmp_path / "bench.db")
+    prepare(uri, users=10, posts=100)
+    results = run(
+        uri, users=10, concurrency=2, duration=0.2, only=["api.get_user", "my_profile"]
+    )
+    assert set(results) == {"api.get_user", "api.get_user_feed", "frontend.my_profile"}
+    for name, result in results.items():
+        assert result["requests"] > 0 and result["errors"] == 0, name
+
+
+def test_run_load_counts_unexpected_statuses_as_errors(app):
+    server, url = serve(app)
+    try:
+        result = run_load(url, ["/api/users/nobody/feed"], 1, 0.1, expected=(200,))
+    finally:
+        server.shutdown()
+    assert result["requests"] > 0
+    assert result["errors"] == result["requests"]
+    assert list(result["statuses"]) == ["404"]
@@ -0,0 +1,88 @@
+from .. import create_app, db
+from ..api.models import User
+from ..api.cache import FileCache, LRUCache, user_cache
+import os
+import pytest
+import time
+
+
+@pytest.fixture()
+def cache_user(app):
+    db.session.add(User(username="CacheUser", email="c@test.com", password="x"))
+    db.session.commit()
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(max_size=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+
+
+def test_lru_cache_expires_entries():
+    cache = LRUCache(ttl=0.01)
+    cache.set("a", 1)
+    time.sleep(0.02)
+    assert cache.get("a") is None
+
+
+def test_user_cache_serves_repeated_lookups_from_cache(app, cache_user):
+    user = user_cache.get_by_username("CacheUser")
+    db.session.remove()
+    # lookup by id is filled by username lookup as well
+    assert user_cache.get_by_id(user.id).username == "CacheUser"
+    assert user_cache.get_by_username("CacheUser").email == "c@test.com"
+    assert user_cache.metrics() == {"hits": 2, "misses": 1}
+
+
+def test_user_cache_invalidate(app, cache_user):
+    user = user_cache.get_by_username("CacheUser")
+    user.email = "changed@test.com"
+    db.session.commit()
+    user_cache.invalidate(user.id, user.username)
+    db.session.remove()
+    assert user_cache.get_by_username("CacheUser").email == "changed@test.com"
+
+
+def test_get_user_route_ignores_stale_cache(app, cache_user):
+    client = app.test_client()
+    user = user_cache.get_by_username("CacheUser")
+    # deleted by other process, its cache is not invalidated here
+    db.session.execute(User.__table__.delete().where(User.id == user.id))
+    db.session.commit()
+    assert client.get("/api/users/CacheUser").status_code == 204
+
+
+def test_user_cache_dir_is_shared_between_apps(app, cache_user, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, "USER_CACHE_DIR", str(tmp_path))
+    monkeypatch.setitem(app.extensions, "user_cache", None)
+    user_cache.init_app(app)
+    other = create_app({"USER_CACHE_DIR": str(tmp_path)})
+    user = user_cache.get_by_username("CacheUser")
+    with other.app_context():
+        # user deleted by other worker
+        user_cache.invalidate(user.id, user.username)
+    db.session.execute(User.__table__.delete().where(User.id == user.id))
+    db.session.commit()
+    assert user_cache.get_by_id(user.id) is None
+
+
+def test_file_cache_refuses_directory_others_can_access(tmp_path):
+    directory = tmp_path / "users"
+    FileCache(str(directory))
+    assert directory.stat().st_mode & 0o777 == 0o700
+    os.chmod(directory, 0o777)
+    with pytest.raises(PermissionError):
+        FileCache(str(directory))
+
+
+def test_file_cache_clear_skips_entries_it_cant_remove(tmp_path):
+    cache = FileCache(str(tmp_path / "users"))
+    cache.set("a", 1)
+    os.mkdir(tmp_path / "users" / "subdirectory")
+    cache.clear()
+    assert cache.get("a") is None
@@ -0,0 +1,30 @@
+from .. import db
+import pytest
+
+
+@pytest.fixture()
+def app_config(tmp_path):
+    return {"SQLALCHEMY_DATABASE_URI": "sqlite:///" + str(tmp_path / "db.db")}
+
+
+def test_production_profile_sets_pragmas(empty_app):
+    with db.engine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert connection.exec_driver_sql("PRAGMA synchronous").scalar() == 1
+        assert connection.exec_driver_sql("PRAGMA busy_timeout").scalar() == 5000
+
+
+def test_get_requests_read_from_query_only_pool(empty_app):
+    read_engine = db.get_read_engine()
+    with read_engine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA query_only").scalar() == 1
+
+    with empty_app.test_request_context(method="GET"):
+        assert db.session().get_bind() is read_engine
+    with empty_app.test_request_context(method="POST"):
+        assert db.session().get_bind() is db.engine
+
+
+def test_default_profile_does_not_split_reads(empty_app):
+    empty_app.config["SQLITE_PROFILE"] = "default"
+    assert db.get_read_engine() is None
@@ -0,0 +1,105 @@
+from .. import db
+from ..api.models import Post, User
+from ..api.feed import RingBuffer, feed
+from ..api.pagination import decode_cursor
+import pytest
+
+
+@pytest.fixture(scope="module")
+def app_config():
+    return {"FEED_SIZE": 5, "FEED_USER_SIZE": 3}
+
+
+@pytest.fixture()
+def users(app):
+    db.session.add(User(username="FeedUser", email="f@test.com", password="x"))
+    db.session.add(User(username="Other", email="o@test.com", password="x"))
+    db.session.commit()
+
+
+def add_posts(client, author, count):
+    for i in range(count):
+        response = client.post(
+            "/api/posts/create_post", data={"text": f"post {i}", "author": author}
+        )
+        assert response.status_code == 200
+
+
+def test_ring_buffer_keeps_newest_ids():
+    buffer = RingBuffer(3)
+    buffer.extend([1, 2, 3, 4, 5])
+    assert list(buffer) == [3, 4, 5]
+    buffer.append(7)
+    buffer.append(6)
+    buffer.append(6)
+    assert list(buffer) == [5, 6, 7]
+    assert buffer.page(2) == ([7, 6], True)
+    assert buffer.page(2, after=6) == ([5], False)
+
+
+def test_feed_is_rebuilt_from_db(app, users):
+    db.session.add_all(Post(text=f"post {i}", author=1) for i in range(8))
+    db.session.commit()
+    ids, next_id = feed.page(3)
+    assert ids == [8, 7, 6]
+    assert feed.page(3, after=next_id) == ([5, 4], None)
+
+
+def test_feed_route_pages_recent_posts(app, users):
+    client = app.test_client()
+    add_posts(client, 1, 3)
+    add_posts(client, 2, 4)
+
+    response = client.get("/api/posts/feed?limit=3")
+    assert [post["id"] for post in response.json] == [7, 6, 5]
+    assert response.json[0]["author"] == "Other"
+    cursor = response.headers["X-Next-Cursor"]
+    assert decode_cursor(cursor, int) == (5,)
+
+    # only FEED_SIZE newest posts are kept
+    response = client.get("/api/posts/feed?limit=3&after=" + cursor)
+    assert [post["id"] for post in response.json] == [4, 3]
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_user_feed_is_updated_on_write(app, users):
+    client = app.test_client()
+    add_posts(client, 1, 2)
+    response = client.get("/api/users/FeedUser/feed")
+    assert [post["id"] for post in response.json] == [2, 1]
+
+    add_posts(client, 2, 1)
+    add_posts(client, 1, 2)
+    response = client.get("/api/users/FeedUser/feed")
+    assert [post["id"] for post in response.json] == [5, 4, 2]
+    assert client.get("/api/users/Nobody/feed").status_code == 404
+
+
+def test_bulk_posts_are_added_to_feed(app, users, monkeypatch):
+    monkeypatch.setitem(app.config, "POST_QUEUE_ACK", "flush")
+    client = app.test_client()
+    feed.page(1)
+    response = client.post(
+        "/api/posts/bulk", json=[{"text": "a", "author": 1}, {"text": "b", "author": 2}]
+    )
+    assert response.status_code == 200
+    assert feed.page(5) == ([2, 1], None)
+
+
+def test_index_shows_recent_posts(app, users):
+    client = app.test_client()
+    add_posts(client, 1, 2)
+    response = client.get("/")
+    assert b"post 1" in response.data
+    assert b"FeedUser" in response.data
+
+
+def test_feed_is_reloaded_after_max_age(app, users, monkeypatch):
+    assert feed.page(3) == ([], None)
+    # posts written by another worker don't go through this feed
+    db.session.add_all(Post(text=f"post {i}", author=1) for i in range(2))
+    db.session.commit()
+    assert feed.page(3) == ([], None)
+
+    monkeypatch.setattr(app.extensions["feed"], "max_age", 0)
+    assert feed.page(3) == ([2, 1], None)
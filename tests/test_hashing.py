@@ -0,0 +1,53 @@
+from .. import db
+from ..api.models import User
+from ..api.hashing import password_hasher
+from werkzeug.security import generate_password_hash
+import pytest
+import json
+import threading
+
+
+@pytest.fixture(scope="module")
+def app_config():
+    # hash in process pool like production
+    return {"PASSWORD_HASH_WORKERS": 1}
+
+
+def test_hash_uses_configured_cost(app, monkeypatch):
+    pwhash = password_hasher.hash("testpassword")
+    assert pwhash.startswith("pbkdf2:sha256:1000$")
+    assert password_hasher.check(pwhash, "testpassword")
+    assert not password_hasher.needs_rehash(pwhash)
+
+    monkeypatch.setitem(app.config, "PASSWORD_HASH_ITERATIONS", 2000)
+    assert password_hasher.needs_rehash(pwhash)
+
+
+def test_login_rehashes_outdated_hash(app):
+    db.session.add(
+        User(
+            username="OldHash",
+            email="old@test.com",
+            password=generate_password_hash("testpassword", method="sha256"),
+        )
+    )
+    db.session.commit()
+
+    response = app.test_client().post(
+        "/login",
+        data=json.dumps({"username": "OldHash", "password": "testpassword"}),
+        headers={"Content-Type": "application/json"},
+    )
+    assert response.status_code == 302
+    assert response.location == "/my_profile"
+    user = User.query.filter_by(username="OldHash").first()
+    assert user.password.startswith("pbkdf2:sha256:1000$")
+
+
+def test_hash_many_shares_bounded_pool(app, monkeypatch):
+    state = app.extensions["password_hasher"]
+    monkeypatch.setattr(state, "slots", threading.BoundedSemaphore(1))
+    hashes = password_hasher.hash_many(["a", "b", "c"])
+    assert [password_hasher.check(*args) for args in zip(hashes, "abc")] == [True] * 3
+    # every slot is given back
+    assert state.slots.acquire(timeout=1)
@@ -0,0 +1,88 @@
+from .. import db
+from ..api.models import Post, User
+from ..api.migrations import migrate
+import gzip
+import pytest
+
+
+@pytest.fixture()
+def cache_user(app):
+    db.session.add(User(username="CacheUser", email="c@test.com", password="x"))
+    db.session.commit()
+
+
+def test_etag_changes_with_table_and_url(app, cache_user):
+    client = app.test_client()
+    response = client.get("/api/users/CacheUser")
+    etag = response.headers["ETag"]
+    assert etag.startswith('W/"')
+    assert response.headers["Cache-Control"] == "no-cache"
+    assert client.get("/api/users/Other").headers.get("ETag") is None
+    assert (
+        client.get("/api/users/CacheUser", headers={"If-None-Match": etag}).status_code
+        == 304
+    )
+
+    # posts don't change validators of users
+    db.session.add(Post(text="post", author=1))
+    db.session.commit()
+    response = client.get("/api/users/CacheUser", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    user = db.session.get(User, 1)
+    user.email = "changed@test.com"
+    db.session.commit()
+    response = client.get("/api/users/CacheUser", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_if_modified_since(app, cache_user):
+    client = app.test_client()
+    response = client.get("/api/posts/all")
+    last_modified = response.headers["Last-Modified"]
+    response = client.get(
+        "/api/posts/all", headers={"If-Modified-Since": last_modified}
+    )
+    assert response.status_code == 304
+    response = client.get(
+        "/api/posts/all", headers={"If-Modified-Since": "Sat, 01 Jan 2000 00:00:00 GMT"}
+    )
+    assert response.status_code == 200
+
+
+def test_large_bodies_are_gzipped(app, cache_user):
+    db.session.add_all(Post(text=f"post number {i}", author=1) for i in range(100))
+    db.session.commit()
+    client = app.test_client()
+    response = client.get("/api/posts/all", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert len(gzip.decompress(response.data).split(b"},{")) == 100
+
+    response = client.get("/api/posts/all")
+    assert "Content-Encoding" not in response.headers
+    response = client.get("/api/posts/all?limit=1", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
+    response = client.get(
+        "/api/posts/all?stream=1", headers={"Accept-Encoding": "gzip"}
+    )
+    assert "Content-Encoding" not in response.headers
+
+
+def test_migration_adds_table_versions(empty_app):
+    db.create_all()
+    db.session.add(User(username="CacheUser", email="c@test.com", password="x"))
+    db.session.commit()
+    with db.engine.begin() as connection:
+        connection.exec_driver_sql("DROP TABLE table_versions")
+        for table in ("user", "post"):
+            for operation in ("insert", "update", "delete"):
+                connection.exec_driver_sql(f"DROP TRIGGER {table}_version_{operation}")
+
+    assert 3 in migrate()
+    client = empty_app.test_client()
+    etag = client.get("/api/posts/all").headers["ETag"]
+    db.session.add(Post(text="post", author=1))
+    db.session.commit()
+    assert client.get("/api/posts/all").headers["ETag"] != etag
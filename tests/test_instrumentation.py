@@ -0,0 +1,74 @@
+from .. import db
+from ..api.models import User
+from ..api.instrumentation import RequestTimings
+import time
+
+
+def test_request_timings_exclude_nested_phases():
+    timings = RequestTimings()
+    timings.enter("render")
+    time.sleep(0.01)
+    timings.enter("sql")
+    time.sleep(0.05)
+    timings.exit("sql")
+    timings.exit("render")
+    timings.finish()
+    assert timings.phases["sql"] >= 0.05
+    # render would include sql if nested phases weren't excluded
+    assert 0.01 <= timings.phases["render"] < 0.05
+
+
+def test_metrics_endpoint_reports_phases_and_queries(app):
+    client = app.test_client()
+    client.get("/api/posts/all")
+    client.get("/")
+    metrics = client.get("/metrics").get_data(as_text=True)
+
+    assert (
+        'redditlo_request_duration_seconds_count{endpoint="api.get_all_posts",'
+        'method="GET",status="200"} 1' in metrics
+    )
+    # table versions and page of posts
+    assert (
+        'redditlo_request_sql_queries_bucket{endpoint="api.get_all_posts",le="2"} 1'
+        in metrics
+    )
+    assert (
+        'redditlo_request_sql_queries_bucket{endpoint="api.get_all_posts",le="1"} 0'
+        in metrics
+    )
+    phases = {
+        line.split('phase="')[1].split('"')[0]: float(line.split()[-1])
+        for line in metrics.splitlines()
+        if line.startswith(
+            'redditlo_request_phase_seconds_total{endpoint="frontend.index"'
+        )
+    }
+    assert set(phases) == {"sql", "serialization", "render", "hashing", "other"}
+    assert phases["render"] > 0 and phases["sql"] > 0
+    assert "redditlo_page_cache_misses 1" in metrics
+    assert "redditlo_post_writer_queue_depth 0" in metrics
+
+
+def test_slow_requests_dump_sampled_stacks(app, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setitem(app.config, "PROFILE_SLOW_REQUEST_SECONDS", 0.05)
+    monkeypatch.setitem(app.config, "PROFILE_INTERVAL", 0.001)
+    db.session.add(User(username="MetricsUser", email="m@test.com", password="x"))
+    db.session.commit()
+
+    @app.route("/slow")
+    def slow_view():
+        time.sleep(0.1)
+        return "done"
+
+    client = app.test_client()
+    client.get("/api/users/MetricsUser")
+    assert list(tmp_path.iterdir()) == []
+
+    client.get("/slow")
+    (profile,) = tmp_path.iterdir()
+    assert profile.name.endswith(".folded")
+    stacks = profile.read_text().splitlines()
+    assert any("slow_view (test_instrumentation.py" in line for line in stacks)
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in stacks)
@@ -0,0 +1,122 @@
+from .. import create_app, db
+from ..api.jobs import DeadJob, Job, claim, job_queue
+from ..api.migrations import create_schema
+import threading
+import time
+import pytest
+
+
+@pytest.fixture()
+def calls(monkeypatch):
+    calls = []
+    monkeypatch.setitem(job_queue.handlers, "record", calls.append)
+    return calls
+
+
+def test_job_runs_after_commit(app, calls):
+    job_queue.enqueue("record", {"n": 1})
+    db.session.commit()
+    assert job_queue.run_pending() == 1
+    assert calls == [{"n": 1}]
+    assert Job.query.count() == 0
+
+
+def test_rolled_back_job_never_runs(app, calls):
+    job_queue.enqueue("record", {"n": 1})
+    db.session.rollback()
+    assert job_queue.run_pending() == 0
+    assert calls == []
+
+
+def test_key_dedups_waiting_jobs(app, calls):
+    for n in range(3):
+        job_queue.enqueue("record", {"n": n}, key="record")
+    db.session.commit()
+    assert job_queue.run_pending() == 1
+    assert calls == [{"n": 0}]
+
+
+def test_delayed_job_waits(app, calls):
+    job_queue.enqueue("record", delay=60)
+    db.session.commit()
+    assert job_queue.run_pending() == 0
+
+
+def test_claimed_job_is_leased(app, calls):
+    job_queue.enqueue("record")
+    db.session.commit()
+    state = app.extensions["job_queue"]
+    now = time.time()
+    assert claim(state, now).attempts == 1
+    assert claim(state, now) is None
+    # worker that claimed it died, job runs again after lease
+    assert claim(state, now + state.lease + 1).attempts == 2
+
+
+def test_failing_job_is_retried_then_dead(app, monkeypatch):
+    attempts = []
+
+    def flaky(payload):
+        attempts.append(payload)
+        raise ValueError("broken")
+
+    monkeypatch.setitem(job_queue.handlers, "flaky", flaky)
+    monkeypatch.setitem(app.config, "JOB_MAX_ATTEMPTS", 3)
+    monkeypatch.setitem(app.config, "JOB_RETRY_DELAY", 0)
+    before = job_queue.metrics()
+    job_queue.enqueue("flaky", {"n": 1})
+    db.session.commit()
+
+    assert job_queue.run_pending() == 3
+    assert len(attempts) == 3
+    assert Job.query.count() == 0
+    dead = DeadJob.query.one()
+    assert (dead.name, dead.attempts) == ("flaky", 3)
+    assert dead.error == "ValueError: broken"
+    metrics = job_queue.metrics()
+    assert metrics["retried"] == before["retried"] + 2
+    assert metrics["dead"] == before["dead"] + 1
+
+
+def test_retry_backs_off(app, monkeypatch):
+    monkeypatch.setitem(job_queue.handlers, "flaky", lambda payload: 1 / 0)
+    job_queue.enqueue("flaky")
+    db.session.commit()
+    assert job_queue.run_pending() == 1
+    job = Job.query.one()
+    assert job.run_at > time.time() + 0.5
+    assert job.last_error.startswith("ZeroDivisionError")
+
+
+def test_purge_is_queued_once(client):
+    client.post(
+        "/api/users/add_user",
+        data={"username": "Twice", "email": "twice@test.com", "password": "x" * 8},
+    )
+    for _ in range(2):
+        assert client.get("/api/users/purge_user/Twice").status_code == 202
+    assert Job.query.filter_by(name="purge_user").count() == 1
+
+
+def test_worker_thread_runs_jobs(tmp_path, monkeypatch):
+    app = create_app(
+        {
+            "SQLALCHEMY_DATABASE_URI": "sqlite:///" + str(tmp_path / "jobs.db"),
+            "JOB_WORKERS": 1,
+            "JOB_POLL_INTERVAL": 0.01,
+        }
+    )
+    done = threading.Event()
+    monkeypatch.setitem(job_queue.handlers, "record", lambda payload: done.set())
+    with app.app_context():
+        create_schema()
+        try:
+            # first request starts workers
+            app.test_client().get("/api/posts/all")
+            job_queue.enqueue("record")
+            db.session.commit()
+            assert done.wait(5)
+        finally:
+            job_queue.stop()
+            db.session.remove()
+            db.engine.dispose()
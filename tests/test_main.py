@@ -1,8 +1,13 @@
-from .. import create_app, db, User
+from .. import db
+from ..api.models import Post, User
+from ..api.feed import feed
+from ..api.ingest import QueueFullError, _Batch, post_writer
 import pytest
 import json
+from datetime import datetime
 from flask_login import current_user
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash
+from sqlalchemy.exc import IntegrityError
 
 
 @pytest.fixture(scope="module")
@@ -21,34 +26,31 @@ def valid_user(valid_user_raw_password):
 
 
 @pytest.fixture()
-def test_with_authenticated_user(app):
-    @login_manager.request_loader
-    def load_user_from_request(request):
-        return User.query.first()
-
+def user(app, valid_user):
+    user = User(
+        email=valid_user.email,
+        username=valid_user.username,
+        password=valid_user.password,
+    )
+    db.session.add(user)
+    db.session.commit()
+    return user
 
-@pytest.fixture(scope="module")
-def app():
-    app = create_app()
-    with app.app_context():
-        app.config["TESTING"] = True
-        app.config["CSRF_ENABLED"] = False
-        app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + "test.db"
-        app.config["WTF_CSRF_ENABLED"] = False
-        app.config["LOGIN_DISABLED"] = True
-        db.init_app(app)
-        db.create_all()
 
-        yield app
-    with app.app_context():
-        db.session.remove()
-        db.close_all_sessions()
-        db.drop_all()
+@pytest.fixture()
+def post(user):
+    post = Post(text="Test Post", author=user.id)
+    db.session.add(post)
+    db.session.commit()
+    return post
 
 
-@pytest.fixture
-def client(app):
-    return app.test_client()
+def create_post(client, text):
+    return client.post(
+        "/api/posts/create_post",
+        data=json.dumps({"text": text, "author": 1}),
+        headers={"Content-Type": "application/json"},
+    )
 
 
 print("Test api:")
@@ -90,7 +92,9 @@ def test_sign_up_with_valid_user(client, valid_user, valid_user_raw_password):
     assert response.location == "/login"
 
 
-def test_sign_up_with_duplicate_username(client, valid_user, valid_user_raw_password):
+def test_sign_up_with_duplicate_username(
+    client, user, valid_user, valid_user_raw_password
+):
     response = client.post(
         "/sign_up",
         data=json.dumps(
@@ -106,7 +110,9 @@ def test_sign_up_with_duplicate_username(client, valid_user, valid_user_raw_pass
     assert response.location == "/sign_up"
 
 
-def test_sign_up_with_duplicate_email(client, valid_user, valid_user_raw_password):
+def test_sign_up_with_duplicate_email(
+    client, user, valid_user, valid_user_raw_password
+):
     response = client.post(
         "/sign_up",
         data=json.dumps(
@@ -156,7 +162,7 @@ def test_login_not_existing_user(client):
 
 
 def test_login_existing_user_wrong_password(
-    client, valid_user, valid_user_raw_password
+    client, user, valid_user, valid_user_raw_password
 ):
     response = client.post(
         "/login",
@@ -169,7 +175,7 @@ def test_login_existing_user_wrong_password(
     assert response.location == "/login"
 
 
-def test_login_existing_user(client, valid_user, valid_user_raw_password):
+def test_login_existing_user(client, user, valid_user, valid_user_raw_password):
     response = client.post(
         "/login",
         data=json.dumps(
@@ -181,7 +187,9 @@ def test_login_existing_user(client, valid_user, valid_user_raw_password):
     assert response.location == "/my_profile"
 
 
-def test_my_profile_loads_for_logged_user(client, valid_user, valid_user_raw_password):
+def test_my_profile_loads_for_logged_user(
+    client, user, valid_user, valid_user_raw_password
+):
     response = client.post(
         "/login",
         data=json.dumps(
@@ -195,17 +203,27 @@ def test_my_profile_loads_for_logged_user(client, valid_user, valid_user_raw_pas
     # assert client.current_user == "/login?next=%2Fmy_profile"
 
 
-def test_user_api_get_one(client, valid_user, valid_user_raw_password):
+def test_user_api_get_one(client, user, valid_user, valid_user_raw_password):
 
     response = client.get("/api/users/" + valid_user.username)
     assert response.status_code == 200
     data = json.loads(response.get_data(as_text=True))
     assert data["email"] == valid_user.email
     assert data["username"] == valid_user.username
-    check_password_hash(data["password"], valid_user_raw_password) == True
+    # password hash is never sent
+    assert set(data) == {"id", "username", "email"}
+
+
+def test_user_api_get_one_selects_fields(client, user, valid_user):
+    response = client.get(f"/api/users/{valid_user.username}?fields=username")
+    assert json.loads(response.get_data(as_text=True)) == {
+        "username": valid_user.username
+    }
+    response = client.get(f"/api/users/{valid_user.username}?fields=password")
+    assert response.status_code == 400
 
 
-def test_user_get_all(client, valid_user, valid_user_raw_password):
+def test_user_get_all(client, user, valid_user, valid_user_raw_password):
     response = client.post(
         "/login",
         data=json.dumps(
@@ -220,7 +238,21 @@ def test_user_get_all(client, valid_user, valid_user_raw_password):
     assert len(data) == 1
     assert data[0]["email"] == valid_user.email
     assert data[0]["username"] == valid_user.username
-    check_password_hash(data[0]["password"], valid_user_raw_password) == True
+    assert "password" not in data[0]
+
+
+def test_user_api_get_all_projects_fields(client, user):
+    response = client.get("/api/users/all?fields=username")
+    assert response.status_code == 200
+    data = json.loads(response.get_data(as_text=True))
+    assert data == [{"username": "TestUser"}]
+
+
+def test_user_api_get_all_unknown_field_returns_400(client):
+    response = client.get("/api/users/all?fields=password")
+    data = json.loads(response.get_data(as_text=True))
+    assert data["message"] == "Unknown field: password"
+    assert response.status_code == 400
 
 
 def test_user_api_add_user_with_empty_user(client):
@@ -241,7 +273,7 @@ def test_delete_returns_404_on_invalid_user(client):
     assert response.status_code == 404
 
 
-def test_delete_returns_200_on_valid_user(client, valid_user):
+def test_delete_returns_200_on_valid_user(client, user, valid_user):
     response = client.get("/api/users/delete_user/" + valid_user.username)
     data = json.loads(response.get_data(as_text=True))
     assert data["message"] == "User deleted successfully"
@@ -266,7 +298,7 @@ def test_user_api_add_user_with_valid_user(client, valid_user, valid_user_raw_pa
 
 
 def test_user_api_add_user_with_duplicate_username(
-    client, valid_user, valid_user_raw_password
+    client, user, valid_user, valid_user_raw_password
 ):
     response = client.post(
         "/api/users/add_user",
@@ -285,7 +317,7 @@ def test_user_api_add_user_with_duplicate_username(
 
 
 def test_user_api_add_user_with_duplicate_email(
-    client, valid_user, valid_user_raw_password
+    client, user, valid_user, valid_user_raw_password
 ):
     response = client.post(
         "/api/users/add_user",
@@ -303,7 +335,7 @@ def test_user_api_add_user_with_duplicate_email(
     assert response.status_code == 409
 
 
-def test_user_api_get_all(client, valid_user, valid_user_raw_password):
+def test_user_api_get_all(client, user, valid_user, valid_user_raw_password):
     response = client.post(
         "/login",
         data=json.dumps(
@@ -318,7 +350,7 @@ def test_user_api_get_all(client, valid_user, valid_user_raw_password):
     assert len(data) == 1
     assert data[0]["email"] == valid_user.email
     assert data[0]["username"] == valid_user.username
-    check_password_hash(data[0]["password"], valid_user_raw_password) == True
+    assert "password" not in data[0]
 
 
 def test_post_api_get_returns_empty_list(client, valid_user, valid_user_raw_password):
@@ -342,7 +374,7 @@ def test_post_api_create_empty_post_returns_400(
 
 
 def test_post_api_create_valid_post_returns_200(
-    client, valid_user, valid_user_raw_password
+    client, user, valid_user, valid_user_raw_password
 ):
     response = client.post(
         "/api/posts/create_post",
@@ -354,13 +386,226 @@ def test_post_api_create_valid_post_returns_200(
     assert response.status_code == 200
 
 
-def test_post_api_get_returns_added_post(client, valid_user, valid_user_raw_password):
+def test_post_api_get_returns_added_post(
+    client, post, valid_user, valid_user_raw_password
+):
     response = client.get("/api/posts/all")
     data = json.loads(response.get_data(as_text=True))
     assert response.status_code == 200
     assert data == [{"id": 1, "text": "Test Post"}]
 
 
+def test_post_api_get_paginates_with_cursor(client, post):
+    for text in ["Second Post", "Third Post"]:
+        create_post(client, text)
+
+    response = client.get("/api/posts/all?limit=2")
+    data = json.loads(response.get_data(as_text=True))
+    assert response.status_code == 200
+    assert [post["text"] for post in data] == ["Third Post", "Second Post"]
+    cursor = response.headers["X-Next-Cursor"]
+
+    response = client.get("/api/posts/all?limit=2&after=" + cursor)
+    data = json.loads(response.get_data(as_text=True))
+    assert data == [{"id": 1, "text": "Test Post"}]
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_post_api_get_invalid_cursor_returns_400(client):
+    response = client.get("/api/posts/all?after=invalid")
+    data = json.loads(response.get_data(as_text=True))
+    assert data["message"] == "Invalid cursor"
+    assert response.status_code == 400
+
+
+def test_post_api_get_streams_ndjson(client, post):
+    for text in ["Second Post", "Third Post"]:
+        create_post(client, text)
+
+    response = client.get("/api/posts/all?stream=1")
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    lines = response.get_data(as_text=True).splitlines()
+    assert [json.loads(line)["id"] for line in lines] == [3, 2, 1]
+
+
+def test_post_api_bulk_queues_posts(app, user, client):
+    flushed = json.loads(client.get("/api/posts/bulk/metrics").get_data())[
+        "flushed_posts"
+    ]
+    response = client.post(
+        "/api/posts/bulk",
+        data=json.dumps([{"text": "Bulk Post", "author": 1}] * 3),
+        headers={"Content-Type": "application/json"},
+    )
+    data = json.loads(response.get_data(as_text=True))
+    assert data["message"] == "Posts queued"
+    assert response.status_code == 202
+
+    post_writer.flush()
+    assert Post.query.filter_by(text="Bulk Post").count() == 3
+    metrics = json.loads(client.get("/api/posts/bulk/metrics").get_data())
+    assert metrics["flushed_posts"] == flushed + 3
+    assert metrics["queue_depth"] == 0
+
+
+def test_post_api_bulk_ack_on_flush(app, user, client):
+    app.config["POST_QUEUE_ACK"] = "flush"
+    response = client.post(
+        "/api/posts/bulk",
+        data=json.dumps([{"text": "Durable Post", "author": 1}]),
+        headers={"Content-Type": "application/json"},
+    )
+    app.config["POST_QUEUE_ACK"] = "enqueue"
+    data = json.loads(response.get_data(as_text=True))
+    assert data["message"] == "Posts added successfully"
+    assert response.status_code == 200
+    assert Post.query.filter_by(text="Durable Post").count() == 1
+
+
+def test_post_api_bulk_empty_text_returns_400(client):
+    response = client.post(
+        "/api/posts/bulk",
+        data=json.dumps([{"text": "", "author": 1}]),
+        headers={"Content-Type": "application/json"},
+    )
+    assert response.status_code == 400
+
+
+def test_post_api_bulk_unknown_author_returns_404(app, user, client):
+    response = client.post(
+        "/api/posts/bulk",
+        data=json.dumps(
+            [{"text": "Bulk Post", "author": 1}, {"text": "x", "author": 9}]
+        ),
+        headers={"Content-Type": "application/json"},
+    )
+    assert response.status_code == 404
+    post_writer.flush()
+    assert Post.query.count() == 0
+
+
+def test_post_writer_failed_batch_keeps_other_batches(app, user):
+    state = app.extensions["post_writer"]
+    good, bad = _Batch([{"text": "Kept", "author": 1}]), _Batch(
+        [{"text": "Lost", "author": 999}]
+    )
+    state.put(good)
+    state.put(bad)
+    state.drain()
+    assert good.error is None
+    assert isinstance(bad.error, IntegrityError)
+    assert [post.text for post in Post.query.all()] == ["Kept"]
+
+
+def test_post_writer_batch_with_invalid_value_keeps_other_batches(app, user):
+    state = app.extensions["post_writer"]
+    good, bad = _Batch([{"text": "Kept", "author": 1}]), _Batch(
+        [{"text": ["not", "text"], "author": 1}]
+    )
+    state.put(good)
+    state.put(bad)
+    state.drain()
+    assert good.error is None
+    assert bad.error is not None
+    assert [post.text for post in Post.query.all()] == ["Kept"]
+
+
+def test_post_writer_bounds_queue_by_posts(app, user, monkeypatch):
+    state = app.extensions["post_writer"]
+    monkeypatch.setattr(state, "max_posts", 5)
+    state.put(_Batch([{"text": "Queued", "author": 1}] * 4))
+    with pytest.raises(QueueFullError):
+        state.put(_Batch([{"text": "Queued", "author": 1}] * 2))
+    assert post_writer.metrics()["queue_depth"] == 4
+    state.drain()
+    assert post_writer.metrics()["queue_depth"] == 0
+
+
+def test_post_writer_adds_returned_ids_to_feed(app, user, monkeypatch):
+    added = []
+    monkeypatch.setattr(feed, "add_posts", added.extend)
+    post_writer.submit([{"text": "Fed", "author": 1}] * 3)
+    post_writer.flush()
+    posts = Post.query.order_by(Post.id).all()
+    assert added == [(post.id, 1) for post in posts]
+    # stored in format ORM reads back
+    assert all(isinstance(post.date_created, datetime) for post in posts)
+
+
+@pytest.mark.parametrize(
+    "post",
+    [{"text": {"a": 1}, "author": 1}, {"text": "x", "author": True}],
+)
+def test_post_api_bulk_invalid_types_return_400(client, user, post):
+    response = client.post(
+        "/api/posts/bulk",
+        data=json.dumps([post]),
+        headers={"Content-Type": "application/json"},
+    )
+    assert response.status_code == 400
+
+
+def test_user_api_bulk_import_reports_every_row(client, user, valid_user):
+    body = "\n".join(
+        [
+            "username,email,password",
+            "BulkUser1,bulk1@test.com,bulkpassword",
+            valid_user.username + ",bulk2@test.com,bulkpassword",
+            "BulkUser1,bulk3@test.com,bulkpassword",
+            "BulkUser4,,bulkpassword",
+        ]
+    )
+    response = client.post(
+        "/api/users/bulk", data=body, headers={"Content-Type": "text/csv"}
+    )
+    assert response.status_code == 200
+    results = [
+        json.loads(line) for line in response.get_data(as_text=True).splitlines()
+    ]
+    assert [result["status"] for result in results] == [
+        "success",
+        "error",
+        "error",
+        "error",
+    ]
+    assert results[1]["message"] == "User with that username already exists"
+    assert results[3]["message"] == "Missing data"
+    assert User.query.filter_by(username="BulkUser1").first().email == "bulk1@test.com"
+
+
+def test_user_api_bulk_import_reports_invalid_types(client, user):
+    body = "\n".join(
+        json.dumps(record)
+        for record in [
+            {"username": ["x"], "email": "list@test.com", "password": "password"},
+            {"username": "TypedUser", "email": "typed@test.com", "password": 12345},
+            {"username": "TypedUser", "email": "typed@test.com", "password": "secret"},
+        ]
+    )
+    response = client.post(
+        "/api/users/bulk", data=body, headers={"Content-Type": "application/x-ndjson"}
+    )
+    results = [
+        json.loads(line) for line in response.get_data(as_text=True).splitlines()
+    ]
+    assert [result["message"] for result in results[:2]] == ["Invalid data"] * 2
+    assert results[2]["status"] == "success"
+
+
+def test_user_import_cli_command(app, tmp_path):
+    path = tmp_path / "users.ndjson"
+    path.write_text(
+        json.dumps(
+            {"username": "CliUser", "email": "cli@test.com", "password": "clipassword"}
+        )
+        + "\n"
+    )
+    result = app.test_cli_runner().invoke(args=["api", "import-users", str(path)])
+    assert "Added 1 users, 0 failed" in result.output
+    assert User.query.filter_by(username="CliUser").first()
+
+
 def test_logout_redirects(client):
     response = client.get("/logout")
     assert response.status_code == 302
@@ -0,0 +1,156 @@
+from .. import db
+from ..api import migrations
+from ..api.migrations import (
+    MIGRATIONS,
+    SEARCH_DDL_V2,
+    create_schema,
+    migrate,
+    query_plan,
+    scans,
+)
+import pytest
+
+# (query, params, expected SEARCH), SCAN of whole index is not enough
+HOT_QUERIES = [
+    ("SELECT id FROM user WHERE username = ?", ("TestUser",), "(username=?)"),
+    ("SELECT id FROM user WHERE email = ?", ("test@test.com",), "(email=?)"),
+    (
+        "SELECT id, text FROM post WHERE author = ? "
+        "ORDER BY date_created DESC, id DESC LIMIT 20",
+        (1,),
+        "ix_post_author_date_created (author=?)",
+    ),
+    (
+        "SELECT id, text FROM post WHERE date_created <= ? "
+        "AND (date_created < ? OR id < ?) "
+        "ORDER BY date_created DESC, id DESC LIMIT 20",
+        ("2022-01-01 00:00:00", "2022-01-01 00:00:00", 10),
+        "ix_post_date_created_id (date_created<?)",
+    ),
+]
+
+
+def test_migrate_adds_post_indexes(empty_app):
+    db.create_all()
+    with db.engine.begin() as connection:
+        connection.exec_driver_sql("DROP INDEX ix_post_author_date_created")
+        connection.exec_driver_sql("DROP INDEX ix_post_date_created_id")
+
+    assert migrate() == [1, 2, 3, 4, 5, 6]
+    assert migrate() == []
+    with db.engine.connect() as connection:
+        indexes = connection.exec_driver_sql("PRAGMA index_list(post)").fetchall()
+    assert {"ix_post_author_date_created", "ix_post_date_created_id"} <= {
+        index[1] for index in indexes
+    }
+
+
+def test_create_schema_marks_migrations_applied(empty_app):
+    create_schema()
+    assert migrate() == []
+
+
+@pytest.mark.parametrize("sql, params, search", HOT_QUERIES)
+def test_hot_queries_search_index(empty_app, sql, params, search):
+    create_schema()
+    with db.engine.connect() as connection:
+        plan = query_plan(connection, sql, params)
+    assert scans(plan) == []
+    assert plan[0].startswith("SEARCH") and plan[0].endswith(search)
+
+
+def test_scans_include_index_scans():
+    plan = [
+        "SCAN post USING COVERING INDEX ix_post_date_created_id",
+        "SEARCH user USING INTEGER PRIMARY KEY (rowid=?)",
+        "SCAN CONSTANT ROW",
+    ]
+    assert scans(plan) == plan[:1]
+
+
+def test_migrate_rebuilds_post_table_with_cascade(empty_app):
+    create_schema()
+    with db.engine.begin() as connection:
+        # old schema didn't enforce foreign keys, posts of deleted users stayed
+        connection.exec_driver_sql("PRAGMA foreign_keys=OFF")
+        connection.exec_driver_sql("DELETE FROM schema_migrations WHERE version >= 4")
+        connection.exec_driver_sql("DROP TABLE post")
+        connection.exec_driver_sql(
+            "CREATE TABLE post (id INTEGER NOT NULL, date_created DATETIME, "
+            "text TEXT NOT NULL, author INTEGER NOT NULL, PRIMARY KEY (id), "
+            "FOREIGN KEY(author) REFERENCES user (id))"
+        )
+        for statement in SEARCH_DDL_V2:
+            connection.exec_driver_sql(statement)
+        connection.exec_driver_sql(
+            "INSERT INTO user (id, username, email) VALUES (1, 'a', 'a@test.com')"
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO post (id, text, author) "
+            "VALUES (1, 'kept', 1), (2, 'orphan', 2), (3, 'deleted', 1)"
+        )
+    with db.engine.connect() as connection:
+        connection.exec_driver_sql("PRAGMA foreign_keys=ON")
+
+    assert migrate() == [4, 5, 6]
+    with db.engine.begin() as connection:
+        connection.exec_driver_sql("DELETE FROM post WHERE id = 3")
+        assert connection.exec_driver_sql("SELECT id FROM post").scalars().all() == [1]
+        connection.exec_driver_sql("DELETE FROM user WHERE id = 1")
+        assert connection.exec_driver_sql("SELECT count(*) FROM post").scalar() == 0
+        # search index followed every delete
+        assert (
+            connection.exec_driver_sql(
+                "SELECT count(*) FROM post_search "
+                "WHERE post_search MATCH 'kept OR orphan OR deleted'"
+            ).scalar()
+            == 0
+        )
+
+
+def test_migrate_backfills_post_counters(empty_app):
+    create_schema()
+    with db.engine.begin() as connection:
+        # posts written before counters were maintained
+        connection.exec_driver_sql("DELETE FROM schema_migrations WHERE version = 5")
+        connection.exec_driver_sql("DROP TRIGGER post_counter_insert")
+        connection.exec_driver_sql("DROP TRIGGER post_counter_delete")
+        connection.exec_driver_sql(
+            "INSERT INTO user (id, username, email) VALUES (1, 'a', 'a@test.com')"
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO post (id, text, author, date_created) VALUES "
+            "(1, 'old', 1, '2022-01-01 00:00:00'), (2, 'new', 1, '2022-02-01 00:00:00')"
+        )
+
+    assert migrate() == [5]
+    with db.engine.begin() as connection:
+        counters = "SELECT post_count, last_post_at FROM user WHERE id = 1"
+        assert connection.exec_driver_sql(counters).one() == (2, "2022-02-01 00:00:00")
+        connection.exec_driver_sql("DELETE FROM post WHERE id = 2")
+        assert connection.exec_driver_sql(counters).one() == (1, "2022-01-01 00:00:00")
+
+
+def test_partly_migrated_db_accepts_writes(empty_app, monkeypatch):
+    db.create_all()
+    with db.engine.begin() as connection:
+        # schema from before search index and job queue
+        for trigger in ("insert", "delete", "update"):
+            connection.exec_driver_sql(f"DROP TRIGGER post_search_{trigger}")
+        for table in ("job", "dead_job", "post_search", "post_search_pending"):
+            connection.exec_driver_sql(f"DROP TABLE {table}")
+        connection.exec_driver_sql("DELETE FROM schema_migrations")
+    # run stopped after search index, before job queue
+    monkeypatch.setattr(migrations, "MIGRATIONS", MIGRATIONS[:2])
+    assert migrate() == [1, 2]
+    with db.engine.begin() as connection:
+        connection.exec_driver_sql(
+            "INSERT INTO user (id, username, email) VALUES (1, 'a', 'a@test.com')"
+        )
+        connection.exec_driver_sql("INSERT INTO post (text, author) VALUES ('x', 1)")
+        assert (
+            connection.exec_driver_sql(
+                "SELECT count(*) FROM post_search WHERE post_search MATCH 'x'"
+            ).scalar()
+            == 1
+        )
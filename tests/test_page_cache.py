@@ -0,0 +1,102 @@
+from .. import db
+from ..api.models import User
+from ..api.cache import FileCache
+from ..frontend.cache import page_cache
+from flask import render_template_string
+from werkzeug.security import generate_password_hash
+import re
+import pytest
+
+
+@pytest.fixture(scope="module")
+def app_config():
+    return {"WTF_CSRF_ENABLED": True, "LOGIN_DISABLED": False}
+
+
+@pytest.fixture()
+def app(database):
+    with database.app_context():
+        db.session.add(
+            User(
+                username="PageUser",
+                email="p@test.com",
+                password=generate_password_hash("password1"),
+            )
+        )
+        db.session.commit()
+    # requests must not share app context, flask_wtf keeps token in g
+    return database
+
+
+def csrf_token(html):
+    return re.search(rb'name="csrf_token" type="hidden" value="([^"]+)"', html)[1]
+
+
+def test_anonymous_index_is_cached(app):
+    client = app.test_client()
+    assert b"No posts yet." in client.get("/").data
+    client.post("/api/posts/create_post", data={"text": "fresh post", "author": 1})
+    assert b"No posts yet." in client.get("/").data
+    with app.app_context():
+        assert page_cache.metrics() == {"hits": 1, "misses": 1}
+        page_cache.clear()
+    assert b"fresh post" in client.get("/").data
+
+
+def test_cached_login_page_gets_token_of_each_visitor(app):
+    first, second = app.test_client(), app.test_client()
+    first_page = first.get("/login").data
+    second_page = second.get("/login").data
+    with app.app_context():
+        assert page_cache.metrics()["hits"] == 1
+    assert csrf_token(first_page) != csrf_token(second_page)
+
+    response = second.post(
+        "/login",
+        data={
+            "username": "PageUser",
+            "password": "password1",
+            "csrf_token": csrf_token(second_page).decode(),
+        },
+    )
+    assert response.location == "/my_profile"
+
+    # logged in visitors always get fresh page
+    second.get("/login")
+    with app.app_context():
+        assert page_cache.metrics()["hits"] == 1
+
+
+def test_pages_with_flashed_messages_are_not_cached(app):
+    client = app.test_client()
+    token = csrf_token(client.get("/login").data).decode()
+    client.post(
+        "/login",
+        data={"username": "Nobody", "password": "password1", "csrf_token": token},
+    )
+    assert b"User doesn&#39;t exist" in client.get("/login").data
+    assert b"User doesn&#39;t exist" not in client.get("/login").data
+    assert b"User doesn&#39;t exist" not in app.test_client().get("/login").data
+
+
+def test_fragment_cache(app, monkeypatch):
+    template = "{% cache 60, 'greeting', name %}Hello {{ name }}{% endcache %}"
+    with app.test_request_context():
+        assert render_template_string(template, name="<b>") == "Hello &lt;b&gt;"
+        assert render_template_string(template, name="<b>") == "Hello &lt;b&gt;"
+        assert page_cache.metrics() == {"hits": 1, "misses": 1}
+
+        page_cache.invalidate_fragment("greeting", "<b>")
+        monkeypatch.setitem(app.config, "PAGE_CACHE_ENABLED", False)
+        render_template_string(template, name="<b>")
+        assert page_cache.metrics() == {"hits": 1, "misses": 1}
+
+
+def test_file_cache(tmp_path):
+    cache = FileCache(str(tmp_path), ttl=60)
+    cache.set("page:/", "<html>")
+    assert FileCache(str(tmp_path)).get("page:/") == "<html>"
+    cache.set("page:/login", "<html>", ttl=-1)
+    assert cache.get("page:/login") is None
+    cache.clear()
+    assert cache.get("page:/") is None
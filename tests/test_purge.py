@@ -0,0 +1,63 @@
+from .. import db
+from ..api.models import Post, User
+from ..api.purge import user_purger
+import pytest
+
+
+@pytest.fixture()
+def user(app):
+    user = User(username="PurgeUser", email="purge@test.com", password="x")
+    other = User(username="OtherUser", email="other@test.com", password="x")
+    db.session.add_all([user, other])
+    db.session.flush()
+    db.session.execute(
+        Post.__table__.insert(),
+        [{"text": f"purged post {i}", "author": user.id} for i in range(25)]
+        + [{"text": "kept post", "author": other.id}],
+    )
+    db.session.commit()
+    return user
+
+
+def test_delete_user_cascades_to_posts(client, user):
+    response = client.get("/api/users/delete_user/PurgeUser")
+    assert response.status_code == 200
+    assert [post.text for post in Post.query] == ["kept post"]
+    # search index triggers run for cascaded deletes too
+    assert client.get("/api/posts/search?q=purged").json == []
+
+
+def test_create_post_of_missing_user_returns_404(client):
+    response = client.post(
+        "/api/posts/create_post", data={"text": "no author", "author": 42}
+    )
+    assert response.status_code == 404
+    assert response.json["message"] == "User doesn't exist"
+    assert Post.query.count() == 0
+
+
+def test_purge_user_deletes_in_chunks(app, client, monkeypatch, user):
+    monkeypatch.setitem(app.config, "PURGE_CHUNK_SIZE", 10)
+    monkeypatch.setitem(app.config, "PURGE_PAUSE", 0)
+    before = user_purger.metrics()
+
+    response = client.get("/api/users/purge_user/PurgeUser")
+    assert response.status_code == 202
+    user_purger.flush()
+
+    metrics = user_purger.metrics()
+    assert metrics["purged_users"] == before["purged_users"] + 1
+    assert metrics["purged_posts"] == before["purged_posts"] + 25
+    assert client.get("/api/users/PurgeUser").status_code == 204
+    assert [post.text for post in Post.query] == ["kept post"]
+
+
+def test_purge_missing_user_returns_404(client):
+    response = client.get("/api/users/purge_user/nobody")
+    assert response.status_code == 404
+
+
+def test_purge_user_cli_command(app, user):
+    result = app.test_cli_runner().invoke(args=["api", "purge-user", "PurgeUser"])
+    assert "Deleted user PurgeUser and 25 posts" in result.output
+    assert User.query.filter_by(username="PurgeUser").first() is None
@@ -0,0 +1,78 @@
+from .. import db
+from ..api.models import Post, User
+from ..api.instrumentation import QueryBudgetExceeded, assert_max_queries
+from ..api.migrations import query_plan
+from ..api.queries import posts_page, posts_with_authors, users_with_posts
+from datetime import datetime
+from sqlalchemy.exc import InvalidRequestError
+import pytest
+
+
+@pytest.fixture()
+def posts(app):
+    users = [
+        User(username=f"Author{i}", email=f"author{i}@test.com", password="x")
+        for i in range(5)
+    ]
+    db.session.add_all(users)
+    db.session.flush()
+    db.session.execute(
+        Post.__table__.insert(),
+        [{"text": f"post {i}", "author": users[i % 5].id} for i in range(20)],
+    )
+    db.session.commit()
+    db.session.expunge_all()
+    return [post_id for (post_id,) in db.session.query(Post.id)]
+
+
+@pytest.mark.parametrize("loading", ["joined", "selectin"])
+def test_posts_with_authors_loads_authors_up_front(posts, loading):
+    with assert_max_queries(2) as statements:
+        query = posts_with_authors(posts, loading)
+        authors = {post.user.username for post in db.session.scalars(query)}
+    assert len(authors) == 5
+    assert len(statements) == (1 if loading == "joined" else 2)
+
+
+def test_users_with_posts_loads_posts_up_front(posts):
+    usernames = [f"Author{i}" for i in range(5)]
+    with assert_max_queries(2):
+        users = db.session.scalars(users_with_posts(usernames)).all()
+        assert sum(len(user.posts) for user in users) == 20
+
+
+def test_lazy_load_of_relationship_raises(posts):
+    post = db.session.get(Post, posts[0])
+    with pytest.raises(InvalidRequestError):
+        post.user
+
+
+def test_assert_max_queries_lists_statements(posts):
+    with pytest.raises(QueryBudgetExceeded) as info:
+        with assert_max_queries(1):
+            db.session.get(Post, posts[0])
+            db.session.get(Post, posts[1])
+    assert len(info.value.statements) == 2
+    assert "ran 2 queries, budget is 1" in str(info.value)
+
+
+def test_view_over_query_budget_fails(app, client, monkeypatch, posts):
+    monkeypatch.setattr(app.view_functions["api.get_all_posts"], "query_budget", 1)
+    with pytest.raises(QueryBudgetExceeded):
+        client.get("/api/posts/all")
+
+
+def test_view_over_query_budget_is_logged(app, client, monkeypatch, caplog, posts):
+    monkeypatch.setattr(app.view_functions["api.get_all_posts"], "query_budget", 1)
+    monkeypatch.setitem(app.config, "QUERY_BUDGET_ENFORCED", False)
+    assert client.get("/api/posts/all").status_code == 200
+    assert "Request api.get_all_posts ran 2 queries, budget is 1" in caplog.text
+
+
+@pytest.mark.parametrize("author", [None, 1])
+def test_posts_page_after_cursor_seeks_index(app, author):
+    query = posts_page(20, (datetime(2022, 1, 1), 10), author=author)
+    plan = query_plan(db.session.connection(), query)
+    assert len(plan) == 1
+    assert plan[0].startswith("SEARCH post USING")
+    assert "date_created<?" in plan[0]
@@ -0,0 +1,108 @@
+from .. import db
+from ..api.models import User
+from ..api.ratelimit import (
+    MemoryBucketStore,
+    RateLimitExceeded,
+    SQLiteBucketStore,
+    limiter,
+)
+import json
+import pytest
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemoryBucketStore()
+    return SQLiteBucketStore(str(tmp_path / "buckets.db"))
+
+
+def client_from(app, address):
+    client = app.test_client()
+    client.environ_base["REMOTE_ADDR"] = address
+    return client
+
+
+def test_bucket_allows_burst_then_refills(store):
+    assert [store.take("k", rate=2, burst=3, now=100) for _ in range(3)] == [0] * 3
+    assert store.take("k", rate=2, burst=3, now=100) == pytest.approx(0.5)
+    assert store.take("k", rate=2, burst=3, now=100.5) == 0
+    assert store.take("other", rate=2, burst=3, now=100) == 0
+
+
+def test_sqlite_buckets_are_shared_between_workers(tmp_path):
+    path = str(tmp_path / "buckets.db")
+    first, second = SQLiteBucketStore(path), SQLiteBucketStore(path)
+    assert first.take("k", rate=1, burst=1, now=100) == 0
+    assert second.take("k", rate=1, burst=1, now=100) == pytest.approx(1)
+
+
+def test_create_post_over_limit_returns_429(app, client, monkeypatch):
+    monkeypatch.setitem(
+        app.config, "RATELIMITS", {"create_post": {"rate": 0.01, "burst": 2}}
+    )
+    db.session.add(User(username="Limited", email="l@test.com", password="x"))
+    db.session.commit()
+
+    statuses = [
+        client.post(
+            "/api/posts/create_post", data={"text": "post", "author": 1}
+        ).status_code
+        for _ in range(3)
+    ]
+    assert statuses == [200, 200, 429]
+    response = client.post("/api/posts/create_post", data={"text": "post", "author": 1})
+    assert response.json["message"] == "Too many requests"
+    assert 1 <= int(response.headers["Retry-After"]) <= 100
+    # other clients have own bucket
+    other = client_from(app, "10.0.0.2")
+    response = other.post("/api/posts/create_post", data={"text": "post", "author": 1})
+    assert response.status_code == 200
+    assert limiter.metrics()["limited_requests"] >= 2
+
+
+def test_login_attempts_are_limited_per_username(app, monkeypatch):
+    monkeypatch.setitem(app.config, "RATELIMITS", {"login": {"burst": 1}})
+    data = {"username": "Victim", "password": "guess"}
+    first = client_from(app, "10.0.0.1")
+    second = client_from(app, "10.0.0.2")
+    assert first.post("/login", data=data).status_code != 429
+    assert second.post("/login", data=data).status_code == 429
+    # pages are not limited
+    assert second.get("/login").status_code == 200
+
+
+def test_requests_over_concurrency_cap_are_shed(app):
+    with app.test_request_context(method="POST"):
+        slots = limiter.admit("busy", 1)
+        with pytest.raises(RateLimitExceeded) as e:
+            limiter.admit("busy", 1)
+        assert e.value.retry_after == 1
+        slots.release()
+        limiter.admit("busy", 1).release()
+
+
+def test_limits_can_be_disabled(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, "RATELIMITS", {"add_user": {"burst": 1}})
+    monkeypatch.setitem(app.config, "RATELIMIT_ENABLED", False)
+    for _ in range(3):
+        response = client.post("/api/users/add_user", data={})
+        assert response.status_code == 400
+
+
+def test_streamed_bulk_import_holds_slot_until_sent(client):
+    body = json.dumps({"username": "Streamed", "email": "s@test.com", "password": "x"})
+    headers = {"Content-Type": "application/x-ndjson"}
+    # other import takes one of 2 slots
+    held = limiter.admit("add_users_bulk", 2)
+    try:
+        first = client.post("/api/users/bulk", data=body, headers=headers)
+        # body of first import is not sent yet
+        response = client.post("/api/users/bulk", data=body, headers=headers)
+        assert response.status_code == 429
+        assert json.loads(first.get_data())["status"] == "success"
+        response = client.post("/api/users/bulk", data=body, headers=headers)
+        assert response.status_code == 200
+        response.get_data()
+    finally:
+        held.release()
@@ -0,0 +1,122 @@
+from .. import db
+from ..api.models import Post, User
+from ..api.cache import user_cache
+from ..api.jobs import Job, job_queue
+from ..api.migrations import create_schema
+from ..api.replica import refresh_snapshot, replica
+import os
+import pytest
+
+
+@pytest.fixture()
+def app_config(tmp_path):
+    return {
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///" + str(tmp_path / "primary.db"),
+        "SQLALCHEMY_BINDS": {"replica": "sqlite:///" + str(tmp_path / "replica.db")},
+        "SNAPSHOT_INTERVAL": 60,
+        "JOB_WORKERS": 0,
+        "RATELIMIT_ENABLED": False,
+    }
+
+
+@pytest.fixture()
+def app(empty_app):
+    create_schema()
+    db.session.add(User(username="ReplicaUser", email="r@test.com", password="x"))
+    db.session.commit()
+    return empty_app
+
+
+def add_post(text):
+    db.session.add(Post(text=text, author=1))
+    db.session.commit()
+
+
+def texts(client):
+    response = client.get("/api/posts/all")
+    # requests share session of app context of test, real ones end it
+    db.session.remove()
+    return [post["text"] for post in response.json]
+
+
+def test_reads_use_primary_until_snapshot_exists(app):
+    add_post("first")
+    assert texts(app.test_client()) == ["first"]
+
+
+def test_reads_come_from_snapshot(app):
+    add_post("first")
+    refresh_snapshot(app)
+    client = app.test_client()
+    add_post("second")
+    assert texts(client) == ["first"]
+
+    refresh_snapshot(app)
+    assert texts(client) == ["second", "first"]
+
+
+def test_client_reads_its_own_writes(app):
+    refresh_snapshot(app)
+    writer, reader = app.test_client(), app.test_client()
+    response = writer.post("/api/posts/create_post", data={"text": "mine", "author": 1})
+    assert response.status_code == 200
+    assert texts(writer) == ["mine"]
+    assert texts(reader) == []
+
+    refresh_snapshot(app)
+    assert texts(reader) == ["mine"]
+
+
+def test_read_your_writes_can_be_disabled(app):
+    app.config["READ_YOUR_WRITES"] = False
+    refresh_snapshot(app)
+    client = app.test_client()
+    client.post("/api/posts/create_post", data={"text": "mine", "author": 1})
+    assert texts(client) == []
+
+
+def test_first_request_schedules_refresh(app):
+    client = app.test_client()
+    client.get("/api/posts/all")
+    client.get("/api/posts/all")
+    assert Job.query.filter_by(name="refresh_snapshot").count() == 1
+    assert not os.path.exists(db.get_replica_engine().url.database)
+
+    assert job_queue.run_pending() == 1
+    assert os.path.exists(db.get_replica_engine().url.database)
+    # next refresh waits for interval
+    job = Job.query.filter_by(name="refresh_snapshot").one()
+    assert job.key == "refresh_snapshot"
+    assert job_queue.run_pending() == 0
+    assert replica.metrics()["refreshes"] == 1
+
+
+def test_replica_connections_are_read_only(app):
+    refresh_snapshot(app)
+    with db.get_replica_engine().connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA query_only").scalar() == 1
+
+
+def test_snapshot_replaced_by_other_worker_is_read(app, monkeypatch):
+    add_post("first")
+    refresh_snapshot(app)
+    client = app.test_client()
+    assert texts(client) == ["first"]
+
+    add_post("second")
+    # other worker refreshed, this one keeps its pooled connections
+    monkeypatch.setattr(db.get_replica_engine(), "dispose", lambda: None)
+    refresh_snapshot(app)
+    assert texts(client) == ["second", "first"]
+
+
+def test_user_cache_fills_from_primary(app):
+    refresh_snapshot(app)
+    user = User.query.filter_by(username="ReplicaUser").one()
+    db.session.delete(user)
+    db.session.commit()
+    with app.test_request_context("/api/users/ReplicaUser"):
+        # snapshot still has deleted user
+        assert db.session.query(User).filter_by(username="ReplicaUser").count()
+        assert user_cache.get_by_username("ReplicaUser") is None
+        assert user_cache.get_by_id(user.id) is None
@@ -0,0 +1,137 @@
+from .. import db
+from ..api.models import Post, User
+from ..api.jobs import job_queue
+from ..api.migrations import migrate
+from ..api import search
+from ..api.search import match_expression
+import pytest
+
+
+@pytest.fixture()
+def search_user(app):
+    db.session.add(User(username="SearchUser", email="s@test.com", password="x"))
+    db.session.commit()
+
+
+def add_posts(*texts):
+    db.session.add_all(Post(text=text, author=1) for text in texts)
+    db.session.commit()
+    job_queue.run_pending()
+
+
+def test_match_expression_quotes_words():
+    assert match_expression('hello "world" OR -x*') == '"hello" "world" "OR" "x"'
+    assert match_expression(" ?! ") is None
+
+
+def test_search_returns_ranked_matches(app, search_user):
+    client = app.test_client()
+    add_posts("flask apps", "cooking pasta", "flask flask flask", "Flask and SQLite")
+
+    response = client.get("/api/posts/search?q=flask")
+    assert response.status_code == 200
+    assert [post["id"] for post in response.json] == [3, 1, 4]
+    assert set(response.json[0]) == {"id", "text", "date_created"}
+
+    # all words must match, stemming finds other word forms
+    response = client.get("/api/posts/search?q=flask+app")
+    assert [post["id"] for post in response.json] == [1]
+
+
+def test_search_pages_with_cursor(app, search_user):
+    client = app.test_client()
+    add_posts(*(f"post number {i}" for i in range(5)))
+    response = client.get("/api/posts/search?q=post&limit=3")
+    first = [post["id"] for post in response.json]
+    response = client.get(
+        "/api/posts/search?q=post&limit=3&after=" + response.headers["X-Next-Cursor"]
+    )
+    second = [post["id"] for post in response.json]
+    assert "X-Next-Cursor" not in response.headers
+    assert sorted(first + second) == [1, 2, 3, 4, 5]
+
+
+def test_search_index_follows_updates_and_deletes(app, search_user):
+    client = app.test_client()
+    add_posts("old text")
+    post = db.session.get(Post, 1)
+    post.text = "new text"
+    db.session.commit()
+    assert client.get("/api/posts/search?q=old").json == []
+    assert len(client.get("/api/posts/search?q=new").json) == 1
+
+    db.session.delete(post)
+    db.session.commit()
+    assert client.get("/api/posts/search?q=new").json == []
+
+
+def test_search_without_query(app):
+    response = app.test_client().get("/api/posts/search?q=")
+    assert response.status_code == 400
+    assert response.json["message"] == "Search query cannot be empty"
+
+
+def test_migration_and_rebuild_index_existing_posts(empty_app):
+    app = empty_app
+    db.create_all()
+    db.session.add(User(username="SearchUser", email="s@test.com", password="x"))
+    add_posts("indexed later")
+    with db.engine.begin() as connection:
+        connection.exec_driver_sql("DROP TABLE post_search")
+        for trigger in ("insert", "delete", "update"):
+            connection.exec_driver_sql(f"DROP TRIGGER post_search_{trigger}")
+    migrate()
+    client = app.test_client()
+    assert len(client.get("/api/posts/search?q=later").json) == 1
+
+    with db.engine.begin() as connection:
+        connection.exec_driver_sql("DELETE FROM post_search")
+    result = app.test_cli_runner().invoke(args=["api", "rebuild-search"])
+    assert result.output == "Search index rebuilt\n"
+    assert len(client.get("/api/posts/search?q=later").json) == 1
+
+
+def test_new_posts_are_indexed_by_job(app, search_user):
+    client = app.test_client()
+    db.session.add_all(Post(text=f"queued post {i}", author=1) for i in range(3))
+    db.session.commit()
+    assert client.get("/api/posts/search?q=queued").json == []
+
+    # one job indexes all pending posts
+    assert job_queue.run_pending() == 1
+    assert len(client.get("/api/posts/search?q=queued").json) == 3
+
+
+def test_backlog_is_indexed_in_chunks(app, search_user, monkeypatch):
+    monkeypatch.setattr(search, "INDEX_CHUNK_SIZE", 2)
+    client = app.test_client()
+    db.session.add_all(Post(text=f"backlog post {i}", author=1) for i in range(5))
+    db.session.commit()
+
+    # every job commits its chunk and enqueues the next one
+    assert job_queue.run_pending() == 3
+    assert len(client.get("/api/posts/search?q=backlog").json) == 5
+    assert (
+        db.session.execute(db.text("SELECT count(*) FROM post_search_pending")).scalar()
+        == 0
+    )
+
+
+def test_posts_deleted_before_indexing_leave_index_intact(app, search_user):
+    client = app.test_client()
+    add_posts("kept post")
+    db.session.add(Post(text="short lived post", author=1))
+    db.session.commit()
+    post = db.session.get(Post, 2)
+    post.text = "edited post"
+    db.session.commit()
+    db.session.delete(post)
+    db.session.commit()
+
+    job_queue.run_pending()
+    assert [p["text"] for p in client.get("/api/posts/search?q=post").json] == [
+        "kept post"
+    ]
+    db.session.execute(
+        db.text("INSERT INTO post_search (post_search) VALUES ('integrity-check')")
+    )
@@ -0,0 +1,46 @@
+from .. import db
+from ..api.models import User
+from ..api.serializers import json_response, row_serializer
+from ..benchmarks.serialization import run
+from datetime import datetime
+from flask import jsonify
+import pytest
+
+
+@pytest.fixture()
+def json_user(app):
+    db.session.add(
+        User(
+            username="JsonUser",
+            email="json@test.com",
+            password="x",
+            date_created=datetime(2022, 4, 1, 12, 30),
+        )
+    )
+    db.session.commit()
+
+
+def test_row_serializer_projects_fields(app, json_user):
+    query = db.select(User.id, User.username, User.date_created)
+    row = db.session.execute(query).one()
+    serialize = row_serializer(query, ("username", "date_created"))
+    assert serialize(row) == {
+        "username": "JsonUser",
+        "date_created": "Fri, 01 Apr 2022 12:30:00 GMT",
+    }
+    assert row_serializer(query)(row)["id"] == 1
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_json_response_matches_jsonify(app, json_user, monkeypatch, use_orjson):
+    monkeypatch.setitem(app.config, "JSON_ORJSON", use_orjson)
+    query = db.select(User.id, User.username, User.email, User.date_created)
+    data = [row_serializer(query)(row) for row in db.session.execute(query)]
+    response = json_response(data)
+    assert response.mimetype == "application/json"
+    assert response.get_json() == jsonify(data).get_json()
+
+
+def test_row_serialization_faster_than_orm_jsonify():
+    for timings in run(rows=2000, repeat=3).values():
+        assert timings["rows + json"] * 3 < timings["orm + jsonify"]
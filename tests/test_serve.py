@@ -0,0 +1,45 @@
+from .. import create_app
+from ..api.migrations import create_schema
+from ..api.models import db
+from ..benchmarks.scaling import start_server, stop_server
+from ..serve import parse_setting, production_config
+from urllib.request import urlopen
+import os
+import signal
+import time
+
+
+def test_production_config_shares_rate_limits_between_workers(tmp_path):
+    assert production_config(1, str(tmp_path)) == {}
+    config = production_config(4, str(tmp_path))
+    assert config["RATELIMIT_STORAGE"] == str(tmp_path / "ratelimit.db")
+    assert config["USER_CACHE_DIR"] == str(tmp_path / "users")
+    assert config["FEED_MAX_AGE"] > 0
+    assert config["PASSWORD_HASH_WORKERS"] >= 1
+
+
+def test_parse_setting():
+    assert parse_setting("FEED_SIZE=10") == ("FEED_SIZE", 10)
+    assert parse_setting("RATELIMIT_ENABLED=false") == ("RATELIMIT_ENABLED", False)
+    assert parse_setting("URI=sqlite:///x.db") == ("URI", "sqlite:///x.db")
+
+
+def test_workers_serve_reload_and_stop(tmp_path):
+    uri = "sqlite:///" + str(tmp_path / "serve.db")
+    with create_app({"SQLALCHEMY_DATABASE_URI": uri}).app_context():
+        create_schema()
+        db.engine.dispose()
+
+    process, url = start_server(uri, workers=2, threads=2)
+    try:
+        for _ in range(4):
+            with urlopen(url + "/api/posts/all") as response:
+                assert response.status == 200
+
+        # new workers take over, old ones finish and exit
+        os.kill(process.pid, signal.SIGHUP)
+        time.sleep(0.5)
+        with urlopen(url + "/api/posts/all") as response:
+            assert response.status == 200
+    finally:
+        assert stop_server(process) == 0
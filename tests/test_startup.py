@@ -0,0 +1,42 @@
+from .. import create_app
+from ..api.feed import feed
+from ..api.migrations import create_schema
+from ..api.models import db
+from ..benchmarks.startup import STARTUP_BUDGET, fastest, lazy_imported, measure
+
+
+def test_startup_skips_lazy_modules():
+    assert lazy_imported(measure()["modules"]) == []
+
+
+def test_startup_is_within_budget():
+    result = fastest(runs=3)
+    assert result["import_seconds"] + result["create_seconds"] < STARTUP_BUDGET
+
+
+def test_warm_up_loads_templates_and_feed(tmp_path):
+    uri = "sqlite:///" + str(tmp_path / "warm.db")
+    with create_app({"SQLALCHEMY_DATABASE_URI": uri}).app_context():
+        create_schema()
+        db.engine.dispose()
+
+    app = create_app(
+        {
+            "SQLALCHEMY_DATABASE_URI": uri,
+            "WARM_UP": True,
+            "TEMPLATE_CACHE_DIR": str(tmp_path / "templates"),
+        }
+    )
+    assert list((tmp_path / "templates").iterdir())
+    with app.app_context():
+        assert app.extensions["feed"].timeline is not None
+        assert feed.page(20) == ([], None)
+        db.engine.dispose()
+
+
+def test_warm_up_skips_db_without_tables(tmp_path):
+    uri = "sqlite:///" + str(tmp_path / "empty.db")
+    app = create_app({"SQLALCHEMY_DATABASE_URI": uri, "WARM_UP": True})
+    with app.app_context():
+        assert app.extensions["feed"].timeline is None
+        db.engine.dispose()
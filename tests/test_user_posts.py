@@ -0,0 +1,104 @@
+from .. import db
+from ..api.models import Post, User
+from ..api.purge import user_purger
+from sqlalchemy import event
+import pytest
+
+
+@pytest.fixture()
+def user(app):
+    user = User(username="Poster", email="poster@test.com", password="x")
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def add_posts(user, count):
+    if not count:
+        return
+    db.session.execute(
+        Post.__table__.insert(),
+        [{"text": f"post {i}", "author": user.id} for i in range(count)],
+    )
+    db.session.commit()
+
+
+def counters(user):
+    db.session.refresh(user)
+    return user.post_count, user.last_post_at
+
+
+def test_create_post_updates_counters(client, user):
+    assert counters(user) == (0, None)
+    response = client.post(
+        "/api/posts/create_post", data={"text": "first", "author": user.id}
+    )
+    assert response.status_code == 200
+    post = Post.query.one()
+    assert counters(user) == (1, post.date_created)
+
+
+def test_delete_recomputes_last_post_at(user):
+    add_posts(user, 3)
+    posts = Post.query.order_by(Post.date_created, Post.id).all()
+    db.session.delete(posts[-1])
+    db.session.commit()
+    assert counters(user) == (2, max(post.date_created for post in posts[:-1]))
+
+    Post.query.delete()
+    db.session.commit()
+    assert counters(user) == (0, None)
+
+
+def test_purge_resets_counters(app, client, monkeypatch, user):
+    other = User(username="Other", email="other@test.com", password="x")
+    db.session.add(other)
+    db.session.commit()
+    add_posts(other, 4)
+    monkeypatch.setitem(app.config, "PURGE_PAUSE", 0)
+    client.get("/api/users/purge_user/Other")
+    user_purger.flush()
+    assert User.query.filter_by(username="Other").first() is None
+    assert counters(user) == (0, None)
+
+
+def test_user_posts_pages_with_total_count(client, user):
+    add_posts(user, 5)
+    response = client.get("/api/users/Poster/posts?limit=3")
+    assert response.status_code == 200
+    assert response.headers["X-Total-Count"] == "5"
+    assert len(response.json) == 3
+    assert set(response.json[0]) == {"id", "text", "date_created"}
+
+    cursor = response.headers["X-Next-Cursor"]
+    response = client.get(f"/api/users/Poster/posts?limit=3&after={cursor}")
+    assert len(response.json) == 2
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_user_posts_of_missing_user_returns_404(client):
+    response = client.get("/api/users/nobody/posts")
+    assert response.status_code == 404
+    assert response.json["message"] == "User doesn't exist"
+
+
+@pytest.mark.parametrize("count", [0, 50])
+def test_profile_query_count_does_not_depend_on_posts(client, user, count):
+    add_posts(user, count)
+    with client.session_transaction() as session:
+        session["_user_id"] = str(user.id)
+    statements = []
+
+    def count_statement(conn, cursor, statement, *args):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", count_statement)
+    try:
+        response = client.get("/my_profile")
+    finally:
+        event.remove(db.engine, "before_cursor_execute", count_statement)
+    assert response.status_code == 200
+    assert f"{count} posts".encode() in response.data
+    # user loader, post counters and latest posts
+    assert len(statements) <= 3